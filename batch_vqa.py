@@ -0,0 +1,84 @@
+"""
+Headless batch VQA: ask prompts about a directory or manifest of documents and images, without Streamlit.
+
+Documents are converted in a process pool and model requests run concurrently through the request
+scheduler (rate limits, retries and failover). Each answer is appended to a JSONL results file as soon as
+it arrives; rerunning the same command skips items already answered, so an interrupted batch resumes.
+
+Inputs:
+    a directory   every JPEG, PNG, GIF, PDF and PPTX file below it, asked each --prompt
+    a manifest    .jsonl (one object per line) or .csv (with a header row) with the keys file and,
+                  optionally, prompt, id and model; rows without a prompt are asked each --prompt
+
+Each result line holds id, file, prompt, model, status ("ok" or "error"), response or error, usage and
+timings. The OpenRouter key is read from OPENROUTER_API_KEY and the Cloudmersive key (PPTX only) from
+CLOUDMERSIVE_API_KEY.
+
+Usage (from the repository root):
+    python batch_vqa.py docs/ --prompt "Summarise this document" --output results.jsonl
+    python batch_vqa.py manifest.jsonl --model meta-llama/llama-4-maverick --concurrency 16 --workers 4
+"""
+import argparse, logging, os, sys
+
+from util.secrets import Secrets
+from llm.tools.batch_runner import BatchRunner, discover_items
+from llm.tools.lmodel_access import LModelAccess
+
+APP_NAME = "VQA Chatbot"
+APP_DNS = "https://l3vision-open-router.streamlit.app/"
+DEFAULT_MODEL = "google/gemini-3-pro-preview"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="directory of files, or a .jsonl/.csv manifest")
+    parser.add_argument("--prompt", action="append", default=[], help="prompt asked about each file (repeatable)")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL results file (default results.jsonl)")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help=f"model for items without one (default {DEFAULT_MODEL})")
+    parser.add_argument("--concurrency", type=int, default=8, help="max model requests in flight (default 8)")
+    parser.add_argument("--workers", type=int, default=None, help="conversion processes (default CPU count)")
+    parser.add_argument("--retries", type=int, default=3, help="retries per request before failing over (default 3)")
+    parser.add_argument("--no-failover", action="store_true", help="do not fail over to other models")
+    parser.add_argument("--hybrid", action="store_true", help="send text-heavy PDF pages as extracted text")
+    parser.add_argument("--max-sheets", type=int, default=1, help="max images a PDF is split into (default 1)")
+    parser.add_argument("--dedupe-threshold", type=int, default=12,
+                        help="near-duplicate page distance in bits, negative to keep every page (default 12)")
+    parser.add_argument("--cache-dir", default=os.environ.get("CONVERSION_CACHE_DIR"),
+                        help="conversion cache directory shared by the workers (default $CONVERSION_CACHE_DIR)")
+    parser.add_argument("--converters", default="libreoffice,cloudmersive",
+                        help="PPTX conversion backends in order of preference (default libreoffice,cloudmersive)")
+    parser.add_argument("--no-resume", action="store_true", help="overwrite the results file instead of resuming")
+    parser.add_argument("--api-base-url", default="https://openrouter.ai/api/v1", help="OpenAI-compatible endpoint")
+    parser.add_argument("--log-level", default="INFO", help="logging level (default INFO)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    api_key = Secrets.OPENROUTER_API_KEY.value
+    if not api_key:
+        parser.error("set OPENROUTER_API_KEY")
+
+    items = discover_items(args.source, args.prompt)
+    scheduler = LModelAccess(APP_NAME, APP_DNS, api_key, api_base_url=args.api_base_url).build_scheduler(
+        failover=not args.no_failover, max_concurrency=args.concurrency, max_retries=args.retries)
+    lma = LModelAccess(APP_NAME, APP_DNS, api_key, scheduler=scheduler, api_base_url=args.api_base_url)
+    runner = BatchRunner(lma, args.model, concurrency=args.concurrency, workers=args.workers, hybrid=args.hybrid,
+                         api_key=Secrets.CLOUDMERSIVE_API_KEY.value,
+                         pipeline_options={"max_sheets": args.max_sheets,
+                                           "min_page_side": 640,
+                                           "dedupe_threshold": args.dedupe_threshold if args.dedupe_threshold >= 0 else None,
+                                           "max_bytes": 5 * 1024 * 1024,
+                                           "cache_dir": args.cache_dir,
+                                           "converters": [name.strip() for name in args.converters.split(",")]})
+
+    def progress(record, finished, total):
+        detail = "" if record["status"] == "ok" else f": {record['error']}"
+        print(f"[{finished}/{total}] {record['status']} {record['id']}{detail}", file=sys.stderr, flush=True)
+
+    summary = runner.run(items, args.output, resume=not args.no_resume, progress=progress)
+    print(f"{summary['ok']} ok, {summary['error']} failed, {summary['skipped']} already answered "
+          f"in {summary['seconds']}s -> {args.output}", file=sys.stderr)
+    sys.exit(1 if summary["error"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Local OpenAI-compatible mock of the OpenRouter chat completions endpoint, for offline testing and benchmarks.
+
+Supports blocking and streaming (SSE) responses, configurable latency, and error injection (a fixed number
+of initial failures and/or a random error rate, with a chosen HTTP status and optional Retry-After).
+
+Usage (from the repository root):
+    python benchmarks/mock_openai_server.py --port 8765 --latency 0.5 --error-rate 0.1 --error-status 429
+
+Point LModelAccess at it with api_base_url="http://127.0.0.1:8765/v1".
+"""
+import argparse, json, random, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockOpenAIServer:
+    """
+    OpenAI-compatible /v1/chat/completions server running in a background thread.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, first_token_latency=None, chunk_delay=0.0,
+                 chunks=8, error_rate=0.0, error_status=429, fail_first=0, retry_after=None, seed=None):
+        """
+        Args:
+            host (str): Bind address. Default is 127.0.0.1.
+            port (int): Bind port. Default is 0 (any free port).
+            latency (float): Seconds before a blocking response is returned. Default is 0.0.
+            first_token_latency (float): Seconds before the first streamed chunk. Default is latency.
+            chunk_delay (float): Seconds between streamed chunks. Default is 0.0.
+            chunks (int): Number of streamed content chunks. Default is 8.
+            error_rate (float): Probability of failing a request. Default is 0.0.
+            error_status (int): HTTP status for injected failures. Default is 429.
+            fail_first (int): Number of initial requests that always fail. Default is 0.
+            retry_after (float): Retry-After header sent with injected failures. Default is None.
+            seed (int): Random seed for error injection. Default is None.
+        """
+        self.latency = latency
+        self.first_token_latency = latency if first_token_latency is None else first_token_latency
+        self.chunk_delay = chunk_delay
+        self.chunks = chunks
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.fail_first = fail_first
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.request_bytes = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mock-openai", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "errors": self.errors, "max_in_flight": self.max_in_flight,
+                    "request_bytes": self.request_bytes}
+
+    def _should_fail(self):
+        with self.lock:
+            self.requests += 1
+            fail = self.requests <= self.fail_first or self.random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+            return fail
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send_json(200, {"object": "list", "data": []})
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length)
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                request = json.loads(raw or b"{}")
+                with server.lock:
+                    server.request_bytes += len(raw)
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    self._complete(request)
+                finally:
+                    with server.lock:
+                        server.in_flight -= 1
+
+            def _complete(self, request):
+                model = request.get("model", "mock-model")
+                if server._should_fail():
+                    time.sleep(server.first_token_latency / 4)
+                    headers = {"Retry-After": str(server.retry_after)} if server.retry_after is not None else None
+                    self._send_json(server.error_status, {"error": {"message": "injected failure",
+                                                                   "code": server.error_status}}, headers)
+                    return
+                prompt_tokens = len(json.dumps(request.get("messages", []))) // 4
+                words = [f"word{index} " for index in range(server.chunks)]
+                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                         "total_tokens": prompt_tokens + len(words)}
+                if not request.get("stream"):
+                    time.sleep(server.latency)
+                    self._send_json(200, {
+                        "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": "".join(words)}}],
+                        "usage": usage,
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                time.sleep(server.first_token_latency)
+                for index, word in enumerate(words):
+                    if index:
+                        time.sleep(server.chunk_delay)
+                    self._event({"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                                 "model": model, "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]})
+                self._event({"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                             "usage": usage})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+            def _event(self, payload):
+                self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--chunk-delay", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--fail-first", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=None)
+    args = parser.parse_args()
+    server = MockOpenAIServer(args.host, args.port, latency=args.latency, chunk_delay=args.chunk_delay,
+                              error_rate=args.error_rate, error_status=args.error_status,
+                              fail_first=args.fail_first, retry_after=args.retry_after)
+    print(f"Mock OpenAI-compatible server listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
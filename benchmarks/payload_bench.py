@@ -0,0 +1,130 @@
+"""
+Peak memory per request of the upload-to-payload path. No network access or API keys are needed.
+
+A large synthetic photo is uploaded by several concurrent sessions; each prepares it (decode, downscale
+to the model's limits, encode) and sends it to the local mock OpenRouter endpoint. Each decode mode
+runs in a fresh interpreter, so the peak resident memory of one run is not hidden by another's:
+
+  full       the JPEG is decoded at full size, then downscaled
+  draft      the JPEG is decoded at 1/2, 1/4 or 1/8 scale when it is downscaled anyway (the default)
+
+The report gives, per mode, the peak RSS growth and peak Python heap (tracemalloc; image bitmaps are
+not included) over the level before the uploads, in total and per request, as JSON.
+
+Usage (from the repository root):
+    python benchmarks/payload_bench.py [--size 8000x6000] [--uploads 4] [--model google/gemini-3-pro-preview]
+                                       [--output payload.json]
+"""
+import argparse, json, os, subprocess, sys, tempfile, threading, time, tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ("full", "draft")
+PROMPT = "Describe this image"
+
+
+def run_child(args):
+    """
+    One measured run: concurrent uploads of the same file in one decode mode. Prints a JSON result line.
+    """
+    from PIL import JpegImagePlugin
+    from llm.tools.image_tools import ImageTools
+    from llm.tools.lmodel_access import LModelAccess
+    from llm.tools.pipeline_metrics import peak_rss_bytes
+    from llm.tools.token_budget import ImageBudgeter
+    from llm.tools.vqa_pipeline import VQAPipeline
+
+    lma = LModelAccess("payload-bench", "http://localhost/", "mock-key", api_base_url=args.url)
+    limits = lma.get_model_limits(args.model)
+    if args.child == "full":
+        JpegImagePlugin.JpegImageFile.draft = lambda self, mode, size: None   # fit() before draft decoding
+    pipeline = VQAPipeline(ImageTools(), ImageBudgeter(max_bytes=5 * 1024 * 1024))
+    uploads = []
+    for _ in range(args.uploads):   # one buffer per session, as each session holds its own upload
+        with open(args.file, "rb") as file:
+            uploads.append(file.read())
+
+    # warm up imports, the client pool and the JPEG codecs outside the measured window
+    with open(args.warmup, "rb") as file:
+        pipeline.invoke(lma.get_llm(args.model), pipeline.prepare(file.read(), "image/jpeg", limits), PROMPT)
+
+    tracemalloc.start()
+    rss_before, heap_before = peak_rss_bytes(), tracemalloc.get_traced_memory()[0]
+    payload_bytes = []
+    barrier = threading.Barrier(args.uploads)
+
+    def session(byte_data):
+        barrier.wait()   # all uploads land at once
+        prepared = pipeline.prepare(byte_data, "image/jpeg", limits)
+        payload_bytes.append(prepared["payload_bytes"])
+        pipeline.invoke(lma.get_llm(args.model), prepared, PROMPT)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(byte_data,)) for byte_data in uploads]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    heap_peak = tracemalloc.get_traced_memory()[1] - heap_before
+    rss_peak = peak_rss_bytes() - rss_before
+    print(json.dumps({
+        "mode": args.child,
+        "uploads": args.uploads,
+        "upload_bytes": len(uploads[0]),
+        "payload_bytes": payload_bytes[0] if payload_bytes else None,
+        "seconds": round(seconds, 3),
+        "rss_peak_growth_bytes": rss_peak,
+        "rss_peak_growth_per_request": rss_peak // args.uploads,
+        "python_peak_bytes": heap_peak,
+        "python_peak_per_request": heap_peak // args.uploads,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="8000x6000", help="uploaded photo size in pixels (default 8000x6000)")
+    parser.add_argument("--uploads", type=int, default=4, help="concurrent uploads per run (default 4)")
+    parser.add_argument("--model", default="google/gemini-3-pro-preview", help="model whose limits apply")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--file", help=argparse.SUPPRESS)
+    parser.add_argument("--warmup", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args)
+        return
+
+    from benchmarks.mock_openai_server import MockOpenAIServer
+    from benchmarks.vqa_bench import make_image
+
+    width, height = (int(side) for side in args.size.lower().split("x"))
+    report = {"python": sys.version.split()[0], "model": args.model, "size": [width, height], "modes": {}}
+    with tempfile.TemporaryDirectory(prefix="payload-bench-") as work_dir, MockOpenAIServer() as server:
+        upload, warmup = os.path.join(work_dir, "upload.jpg"), os.path.join(work_dir, "warmup.jpg")
+        with open(upload, "wb") as file:
+            file.write(make_image((width, height), "JPEG"))
+        with open(warmup, "wb") as file:
+            file.write(make_image((640, 480), "JPEG"))
+        for mode in MODES:
+            sent_before = server.stats()["request_bytes"]
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode, "--file", upload,
+                                     "--warmup", warmup, "--url", server.base_url, "--uploads", str(args.uploads),
+                                     "--model", args.model], cwd=ROOT, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"{mode} run failed: {result.stderr.strip().splitlines()[-1:]}")
+            record = json.loads(result.stdout.strip().splitlines()[-1])
+            sent = server.stats()["request_bytes"] - sent_before
+            record["request_bytes_per_request"] = sent // args.uploads   # the warm-up request is a few KB
+            report["modes"][mode] = record
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+PDF rasterization benchmark: wall time and peak RSS of the original serial pdf_to_jpeg pipeline
+against the PdfRasterizer engine, over a grid of page counts and DPIs. Both produce the same layout:
+pages stacked vertically at a width of 1024 pixels (the engine keeps a single page's aspect ratio).
+
+Each measurement runs in a fresh subprocess so peak RSS (ru_maxrss) is not polluted by earlier runs.
+Peak RSS covers the converting process only; forkserver render workers each hold one open document
+plus the page being rendered.
+
+Usage (from the repository root):
+    python benchmarks/pdf_rasterize_bench.py [--pages 1 10 40] [--dpi 100 200] [--workers N]
+"""
+import argparse, json, os, resource, subprocess, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LEGACY_WIDTH = 1024   # output width of the original pipeline
+
+
+def make_pdf(pages):
+    """
+    Build a synthetic report-style PDF: text lines plus vector shapes on every page.
+    """
+    import fitz
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Benchmark page {number + 1}", fontsize=20)
+        for line in range(40):
+            page.insert_text((72, 110 + line * 14), "Lorem ipsum dolor sit amet, consectetur adipiscing elit " * 2, fontsize=9)
+        for shape in range(60):
+            page.draw_circle((120 + shape * 6, 700), 10 + shape % 20, color=(shape % 2, 0.3, 1 - shape % 2))
+    return doc.tobytes()
+
+
+def legacy_pdf_to_jpeg(byte_obj, dpi):
+    """
+    The original ImageTools.pdf_to_jpeg / _merge_images pipeline (temp files cleaned up afterwards).
+    """
+    import fitz
+    from PIL import Image
+    tmp_paths = []
+
+    def temp_jpeg(image):
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpeg") as tmp_file:
+            image.save(tmp_file, "JPEG")
+            tmp_paths.append(tmp_file.name)
+            return tmp_file.name
+
+    try:
+        doc = fitz.open(stream=byte_obj, filetype="pdf")
+        zoom = dpi / 72
+        images = []
+        for page in doc:
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            images.append(Image.frombytes("RGB", [pix.width, pix.height], pix.samples))
+        if len(images) > 1:
+            imgs = list(map(Image.open, [temp_jpeg(image) for image in images]))
+            merged = Image.new("RGB", (max(i.width for i in imgs), sum(i.height for i in imgs)))
+            y_offset = 0
+            for img in imgs:
+                merged.paste(img, (0, y_offset))
+                y_offset += img.height
+            merged = merged.resize((LEGACY_WIDTH, int((LEGACY_WIDTH / merged.width) * merged.height)))
+            path = temp_jpeg(merged)
+        else:
+            path = temp_jpeg(images[0].resize((LEGACY_WIDTH, LEGACY_WIDTH)))
+        with open(path, "rb") as file:
+            return file.read()
+    finally:
+        for path in tmp_paths:
+            os.remove(path)
+
+
+def engine_pdf_to_jpeg(byte_obj, dpi, workers):
+    """
+    The same layout through the engine (ImageTools.pdf_to_jpeg itself now tiles pages into a labelled grid).
+    """
+    from llm.tools.image_tools import ImageTools
+    from llm.tools.pdf_rasterizer import PdfRasterizer
+    rasterizer = PdfRasterizer(max_workers=workers)
+    try:
+        with rasterizer.render_stacked(byte_obj, LEGACY_WIDTH, dpi) as image:
+            return ImageTools(rasterizer=rasterizer).encode_image(image)
+    finally:
+        rasterizer.close()
+
+
+def run_one(impl, pages, dpi, workers):
+    """
+    Single measurement, executed inside the child process. Prints one JSON line.
+    """
+    # import both code paths up front so baseline RSS is comparable between implementations
+    import llm.tools.image_tools  # noqa: F401
+    byte_obj = make_pdf(pages)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if impl == "legacy":
+        output = legacy_pdf_to_jpeg(byte_obj, dpi)
+    else:
+        output = engine_pdf_to_jpeg(byte_obj, dpi, workers)
+    wall = time.perf_counter() - start
+    print(json.dumps({
+        "impl": impl,
+        "pages": pages,
+        "dpi": dpi,
+        "wall_s": round(wall, 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "rss_growth_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kb) / 1024, 1),
+        "output_kb": len(output) // 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 40])
+    parser.add_argument("--dpi", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--run", nargs=3, metavar=("IMPL", "PAGES", "DPI"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        impl, pages, dpi = args.run
+        run_one(impl, int(pages), int(dpi), args.workers)
+        return
+
+    header = f"{'impl':<8}{'pages':>6}{'dpi':>6}{'wall s':>9}{'peak MB':>9}{'growth MB':>11}{'out KB':>8}"
+    print(header)
+    print("-" * len(header))
+    for pages in args.pages:
+        for dpi in args.dpi:
+            for impl in ("legacy", "engine"):
+                proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--workers", str(args.workers),
+                                       "--run", impl, str(pages), str(dpi)],
+                                      capture_output=True, text=True, check=True)
+                row = json.loads(proc.stdout.strip().splitlines()[-1])
+                print(f"{row['impl']:<8}{row['pages']:>6}{row['dpi']:>6}{row['wall_s']:>9}{row['peak_rss_mb']:>9}"
+                      f"{row['rss_growth_mb']:>11}{row['output_kb']:>8}")
+
+
+if __name__ == "__main__":
+    main()
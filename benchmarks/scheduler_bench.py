@@ -0,0 +1,63 @@
+"""
+RequestScheduler exercise against the local mock OpenAI-compatible server: many concurrent "sessions" issue
+blocking and streaming requests while the mock injects rate-limit or server errors. Reports wall time,
+scheduler stats (queue depth, wait times, retries, failovers) and the peak concurrency the server observed.
+
+Usage (from the repository root):
+    python benchmarks/scheduler_bench.py [--sessions 32] [--error-rate 0.2] [--error-status 429] [--concurrency 8]
+"""
+import argparse, json, os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_openai_server import MockOpenAIServer
+from llm.tools.lmodel_access import LModelAccess
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.2)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=int, default=600, help="per-model requests per minute")
+    parser.add_argument("--no-failover", action="store_true")
+    args = parser.parse_args()
+
+    with MockOpenAIServer(latency=args.latency, chunk_delay=0.01, error_rate=args.error_rate,
+                          error_status=args.error_status, seed=7) as server:
+        lma = LModelAccess("scheduler-bench", "http://localhost/", "mock-key", api_base_url=server.base_url)
+        scheduler = lma.build_scheduler(failover=not args.no_failover, max_concurrency=args.concurrency,
+                                        backoff_base=0.05, backoff_cap=0.5)
+        scheduler.rate_limits = {model: args.rpm for model in lma.get_all_models()}
+        lma.scheduler = scheduler
+        models = lma.get_all_models()
+
+        def session(index):
+            llm = lma.get_llm(models[index % len(models)])
+            try:
+                if index % 2:
+                    return "".join(chunk.content for chunk in llm.stream(["Describe this image"])), None
+                return llm.invoke(["Describe this image"]).content, None
+            except Exception as err:
+                return None, type(err).__name__
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+            results = list(pool.map(session, range(args.sessions)))
+        wall = time.perf_counter() - start
+
+        print(json.dumps({
+            "sessions": args.sessions,
+            "wall_s": round(wall, 3),
+            "succeeded": sum(1 for _, error in results if error is None),
+            "failed": [error for _, error in results if error is not None],
+            "server": server.stats(),
+            "scheduler": scheduler.stats(),
+        }, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
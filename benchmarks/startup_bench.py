@@ -0,0 +1,86 @@
+"""
+Cold-start import profile of the app. Each scenario runs in a fresh interpreter with `python -X importtime`,
+so nothing is served from modules already imported; the report gives the wall time per scenario (median
+over --repeats runs) and the top-level imports by cumulative time, as JSON.
+
+Scenarios:
+  app        import streamlit_app: what every fresh process pays before the login screen renders
+  deferred   each dependency the app imports only on first use (PDF rendering, PPTX conversion, the
+             OpenAI client, Google sign-in), measured on its own
+
+Usage (from the repository root):
+    python benchmarks/startup_bench.py [--repeats 5] [--top 15] [--output startup.json]
+"""
+import argparse, json, os, statistics, subprocess, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "app": "import streamlit_app",
+}
+DEFERRED = ["fitz", "cloudmersive_convert_api_client", "langchain_openai", "streamlit_oauth"]
+
+
+def profile(code):
+    """
+    Run code in a fresh interpreter with -X importtime.
+    Returns:
+        tuple: Wall seconds and a list of (module, self_us, cumulative_us, depth) per import.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"'{code}' failed: {result.stderr.strip().splitlines()[-1:]}")
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return wall, imports
+
+
+def summarize(code, repeats, top):
+    walls, imports = [], []
+    for _ in range(repeats):
+        wall, imports = profile(code)
+        walls.append(wall)
+    roots = [entry for entry in imports if entry[3] == 0]
+    # what the imported module pulls in directly: the place to look for a heavy dependency
+    direct = sorted((entry for entry in imports if entry[3] == 1), key=lambda entry: entry[2], reverse=True)
+    return {
+        "code": code,
+        "wall_s": round(statistics.median(walls), 4),
+        "import_s": round(sum(entry[2] for entry in roots) / 1e6, 4),
+        "modules": len(imports),
+        "top_imports": [{"module": name, "cumulative_ms": round(cumulative / 1000, 1)}
+                        for name, _, cumulative, _ in direct[:top]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5, help="runs per scenario; the median wall time is reported")
+    parser.add_argument("--top", type=int, default=15, help="top-level imports listed per scenario")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    baseline, _ = profile("pass")
+    report = {"python": sys.version.split()[0], "interpreter_s": round(baseline, 4), "scenarios": {}, "deferred": {}}
+    for name, code in SCENARIOS.items():
+        report["scenarios"][name] = summarize(code, args.repeats, args.top)
+    for module in DEFERRED:
+        report["deferred"][module] = summarize(f"import {module}", args.repeats, 3)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Offline end-to-end benchmark of the VQA pipeline. No network access or API keys are needed.
+
+A synthetic corpus is generated: PDFs, PNG/JPEG images, animated GIFs and PPTX stand-ins. The stand-ins
+are 16:9 slide decks as PDF, i.e. what the Cloudmersive conversion returns, since that conversion is
+remote. Two phases run over the corpus:
+
+  prepare   Each document goes through VQAPipeline.prepare (conversion, fitting, base64) serially, so
+            a background RSS sampler can attribute peak memory to the active stage.
+  requests  Concurrent sessions run the app's full path (prepare, prompt, invoke or stream through the
+            request scheduler) against the local mock OpenRouter endpoint, with injected latency and errors.
+
+The report gives throughput, p50/p95/p99 latency per stage and peak RSS growth per stage as JSON. The
+exit status is non-zero when the request success rate falls below --min-success, so the suite can
+gate CI.
+
+Usage (from the repository root):
+    python benchmarks/vqa_bench.py [--quick] [--repeats 3] [--sessions 48] [--concurrency 8]
+                                   [--latency 0.2] [--error-rate 0.1] [--error-status 429] [--hybrid]
+                                   [--output report.json]
+"""
+import argparse, io, json, math, os, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_openai_server import MockOpenAIServer
+from llm.tools.conversion_cache import ConversionCache
+from llm.tools.image_tools import ImageTools
+from llm.tools.lmodel_access import LModelAccess
+from llm.tools.pdf_rasterizer import PdfRasterizer
+from llm.tools.pipeline_metrics import PipelineMetrics, STAGES
+from llm.tools.token_budget import ImageBudgeter
+from llm.tools.vqa_pipeline import VQAPipeline, PDF_MIME_TYPE
+
+PROMPT = "Describe this image"
+
+
+def make_pdf(pages, width=612, height=792, slides=False):
+    """
+    Build a synthetic document: report pages (text and vector shapes) or slides (title, bullets, bar chart).
+    """
+    import fitz
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page(width=width, height=height)
+        if slides:
+            page.insert_text((48, 64), f"Quarterly review - slide {number + 1}", fontsize=28)
+            for bullet in range(5):
+                page.insert_text((64, 120 + bullet * 34), f"- Key point {bullet + 1}: revenue, churn and outlook", fontsize=16)
+            for bar in range(8):
+                top = height - 60 - 20 * (1 + (number + bar) % 9)
+                page.draw_rect(fitz.Rect(560 + bar * 40, top, 590 + bar * 40, height - 60), color=(0, 0, 0),
+                               fill=(0.2, 0.4 + 0.05 * bar, 0.8))
+        else:
+            page.insert_text((72, 72), f"Benchmark page {number + 1}", fontsize=20)
+            for line in range(40):
+                page.insert_text((72, 110 + line * 14), "Lorem ipsum dolor sit amet, consectetur adipiscing elit " * 2, fontsize=9)
+            for shape in range(60):
+                page.draw_circle((120 + shape * 6, 700), 10 + shape % 20, color=(shape % 2, 0.3, 1 - shape % 2))
+    return doc.tobytes()
+
+
+def make_image(size, image_format, frames=1):
+    """
+    Build a photo-like test image (gradient plus noise, so it compresses realistically); GIFs are animated.
+    """
+    from PIL import Image, ImageChops, ImageDraw
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 48)
+    base = Image.merge("RGB", (gradient, noise, ImageChops.invert(gradient)))
+    images = []
+    for frame in range(frames):
+        image = base.copy()
+        x = frame * size[0] // max(frames, 1)
+        ImageDraw.Draw(image).ellipse((x, size[1] // 3, x + size[0] // 5, size[1] // 3 + size[0] // 5), fill=(255, 200, 0))
+        images.append(image)
+    buffer = io.BytesIO()
+    if frames > 1:
+        images[0].save(buffer, image_format, save_all=True, append_images=images[1:], duration=80, loop=0)
+    else:
+        images[0].save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def build_corpus(quick=False):
+    """
+    Returns:
+        list: (name, mime type, bytes) test documents.
+    """
+    scale = 0.5 if quick else 1.0
+    corpus = [
+        ("pdf-1p", PDF_MIME_TYPE, make_pdf(1)),
+        ("pdf-5p", PDF_MIME_TYPE, make_pdf(5)),
+        ("pptx-standin-8", PDF_MIME_TYPE, make_pdf(8, 960, 540, slides=True)),
+        ("png-800x600", "image/png", make_image((800, 600), "PNG")),
+        ("png-3000x2000", "image/png", make_image((int(3000 * scale), int(2000 * scale)), "PNG")),
+        ("jpeg-2048x1536", "image/jpeg", make_image((int(2048 * scale), int(1536 * scale)), "JPEG")),
+        ("gif-12f", "image/gif", make_image((480, 360), "GIF", frames=12)),
+    ]
+    if not quick:
+        corpus.append(("pdf-30p", PDF_MIME_TYPE, make_pdf(30)))
+    return corpus
+
+
+class RssSampler:
+    """
+    Polls this process's resident memory and records, per stage of the traced run, the peak growth
+    over the RSS at the start of the run. Needs /proc (Linux); elsewhere no memory figures are reported.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.trace = None
+        self.baseline = 0
+        self.peaks = {}
+        self.available = os.path.exists("/proc/self/statm")
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if self.available else 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def rss(self):
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * self._page_size
+
+    def watch(self, trace):
+        if self.available:
+            self.baseline = self.rss()
+        self.trace = trace
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            trace = self.trace
+            if trace is None:
+                continue
+            growth = self.rss() - self.baseline
+            for name in list(trace.active):
+                self.peaks[name] = max(self.peaks.get(name, 0), growth)
+
+    def __enter__(self):
+        if self.available:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(records, wall, peaks=None):
+    """
+    Aggregate trace records: throughput, latency percentiles per stage and in total, and peak memory.
+    """
+    ok = [record for record in records if record["status"] == "ok"]
+    stage_names = sorted({name for record in ok for name in record["stages_s"]},
+                         key=lambda name: STAGES.index(name) if name in STAGES else len(STAGES))
+    stages = {}
+    for name in stage_names + ["total"]:
+        values = [record["total_s"] if name == "total" else record["stages_s"][name]
+                  for record in ok if name == "total" or name in record["stages_s"]]
+        if not values:
+            continue
+        stages[name] = {"count": len(values),
+                        "mean_ms": round(1000 * sum(values) / len(values), 2),
+                        "p50_ms": round(1000 * percentile(values, 0.50), 2),
+                        "p95_ms": round(1000 * percentile(values, 0.95), 2),
+                        "p99_ms": round(1000 * percentile(values, 0.99), 2)}
+        if peaks is not None and name in peaks:
+            stages[name]["peak_rss_growth_mb"] = round(peaks[name] / 2 ** 20, 1)
+    errors = {}
+    for record in records:
+        if record["status"] != "ok":
+            errors[record.get("error")] = errors.get(record.get("error"), 0) + 1
+    return {
+        "runs": len(records),
+        "succeeded": len(ok),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_per_s": round(len(ok) / wall, 2) if wall else None,
+        "payload_mb": round(sum(record.get("payload_bytes") or 0 for record in ok) / 2 ** 20, 2),
+        "stages": stages,
+    }
+
+
+def run_prepare_phase(corpus, repeats, limits, workers, hybrid=False):
+    """
+    Prepare every document `repeats` times, serially, without a conversion cache.
+    """
+    rasterizer = PdfRasterizer(max_workers=workers)
+    pipeline = VQAPipeline(ImageTools(rasterizer=rasterizer), ImageBudgeter(max_bytes=5 * 1024 * 1024))
+    metrics = PipelineMetrics(log_json=False)
+    per_item = {}
+    try:
+        pipeline.prepare(corpus[1][2], corpus[1][1], limits, hybrid=hybrid)   # warm-up: starts the render worker pool
+        records = []
+        start = time.perf_counter()
+        with RssSampler() as sampler:
+            for name, mime_type, byte_data in corpus:
+                item_records = []
+                for _ in range(repeats):
+                    trace = metrics.trace("prepare", item=name, upload_bytes=len(byte_data))
+                    sampler.watch(trace)
+                    try:
+                        with trace.activate():
+                            prepared = pipeline.prepare(byte_data, mime_type, limits, hybrid=hybrid)
+                        trace.annotate(payload_bytes=prepared["payload_bytes"])
+                        item_records.append(trace.finish())
+                    except Exception as err:
+                        item_records.append(trace.finish(err))
+                    sampler.trace = None
+                per_item[name] = summarize(item_records, sum(record["total_s"] for record in item_records))
+                records += item_records
+        report = summarize(records, time.perf_counter() - start, sampler.peaks if sampler.available else None)
+        report["per_item"] = {name: {"p50_ms": item["stages"]["total"]["p50_ms"],
+                                     "payload_mb": item["payload_mb"]} for name, item in per_item.items()
+                              if "total" in item["stages"]}
+        return report
+    finally:
+        rasterizer.close()
+
+
+def run_request_phase(corpus, args):
+    """
+    Concurrent sessions against the mock endpoint, through the scheduler, with the conversion cache on.
+    """
+    with MockOpenAIServer(latency=args.latency, chunk_delay=args.chunk_delay, error_rate=args.error_rate,
+                          error_status=args.error_status, seed=11) as server:
+        lma = LModelAccess("vqa-bench", "http://localhost/", "mock-key", api_base_url=server.base_url)
+        scheduler = lma.build_scheduler(max_concurrency=args.concurrency, backoff_base=0.05, backoff_cap=0.5)
+        scheduler.rate_limits = {model: 6000 for model in lma.get_all_models()}
+        lma.scheduler = scheduler
+        models = lma.get_all_models()
+        rasterizer = PdfRasterizer(max_workers=args.workers)
+        pipeline = VQAPipeline(ImageTools(cache=ConversionCache(), rasterizer=rasterizer),
+                               ImageBudgeter(max_bytes=5 * 1024 * 1024))
+        metrics = PipelineMetrics(log_json=False)
+
+        def session(index):
+            name, mime_type, byte_data = corpus[index % len(corpus)]
+            model = models[index % len(models)]
+            trace = metrics.trace("request", item=name, model=model)
+            try:
+                with trace.activate():
+                    prepared = pipeline.prepare(byte_data, mime_type, lma.get_model_limits(model), hybrid=args.hybrid)
+                    trace.annotate(payload_bytes=prepared["payload_bytes"])
+                    llm = lma.get_llm(model)
+                    if index % 2:
+                        "".join(pipeline.stream(llm, prepared, PROMPT))
+                    else:
+                        pipeline.invoke(llm, prepared, PROMPT)
+                return trace.finish()
+            except Exception as err:
+                return trace.finish(err)
+
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+                records = list(pool.map(session, range(args.sessions)))
+            report = summarize(records, time.perf_counter() - start)
+        finally:
+            rasterizer.close()
+        report["server"] = server.stats()
+        stats = scheduler.stats()
+        report["scheduler"] = {key: stats[key] for key in ("retries", "failovers", "wait_time_avg", "wait_time_max")}
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="smaller corpus and fewer runs (CI)")
+    parser.add_argument("--repeats", type=int, default=None, help="prepare runs per document (default 5, quick 2)")
+    parser.add_argument("--sessions", type=int, default=None, help="concurrent requests (default 48, quick 16)")
+    parser.add_argument("--concurrency", type=int, default=8, help="scheduler max in-flight requests")
+    parser.add_argument("--workers", type=int, default=None, help="PDF render workers (default CPU count)")
+    parser.add_argument("--latency", type=float, default=0.2, help="mock time to first token (s)")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="mock delay between streamed chunks (s)")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="mock injected error probability")
+    parser.add_argument("--error-status", type=int, default=429, help="mock injected error HTTP status")
+    parser.add_argument("--min-success", type=float, default=0.9, help="exit non-zero below this request success rate")
+    parser.add_argument("--hybrid", action="store_true", help="prepare PDFs as text plus figure images")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    args.repeats = args.repeats or (2 if args.quick else 5)
+    args.sessions = args.sessions or (16 if args.quick else 48)
+
+    corpus = build_corpus(args.quick)
+    limits = LModelAccess.model_limits["meta-llama/llama-4-maverick"]
+    report = {
+        "corpus": {name: len(byte_data) for name, _, byte_data in corpus},
+        "prepare": run_prepare_phase(corpus, args.repeats, limits, args.workers, args.hybrid),
+        "requests": run_request_phase(corpus, args),
+    }
+    text = json.dumps(report, indent=2, default=str)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+    requests = report["requests"]
+    if requests["succeeded"] / requests["runs"] < args.min_success:
+        sys.exit(f"Request success rate {requests['succeeded']}/{requests['runs']} below {args.min_success}")
+
+
+if __name__ == "__main__":
+    main()
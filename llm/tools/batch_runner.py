@@ -0,0 +1,268 @@
+import asyncio, csv, hashlib, json, multiprocessing, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from util.logger import get_logger
+from llm.tools.conversion_cache import ConversionCache
+from llm.tools.document_converter import ConversionQueue
+from llm.tools.image_tools import ImageTools
+from llm.tools.pdf_rasterizer import PdfRasterizer
+from llm.tools.token_budget import ImageBudgeter
+from llm.tools.vqa_pipeline import VQAPipeline, PDF_MIME_TYPE, PPTX_MIME_TYPE, GIF_MIME_TYPE
+
+MIME_TYPES = {
+    ".jpeg": "image/jpeg",
+    ".jpg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": GIF_MIME_TYPE,
+    ".pdf": PDF_MIME_TYPE,
+    ".pptx": PPTX_MIME_TYPE,
+}
+
+# Per-worker conversion pipeline, built once by _init_worker
+_worker_pipeline = None
+
+
+def _init_worker(options):
+    global _worker_pipeline
+    # one document per worker at a time: render its pages in-process rather than from a nested pool
+    rasterizer = PdfRasterizer(max_workers=1, parallel_min_pages=sys.maxsize)
+    cache = ConversionCache(max_entries=8, max_bytes=64 * 1024 * 1024, disk_dir=options.get("cache_dir"))
+    converter = ConversionQueue.from_names(options.get("converters", ["libreoffice", "cloudmersive"]), max_concurrency=1,
+                                           timeout=options.get("convert_timeout", 120))
+    image_tools = ImageTools(cache=cache, rasterizer=rasterizer, dedupe_threshold=options.get("dedupe_threshold"),
+                             converter=converter)
+    image_budgeter = ImageBudgeter(max_image_tokens=options.get("max_image_tokens"), max_bytes=options.get("max_bytes"))
+    _worker_pipeline = VQAPipeline(image_tools, image_budgeter,
+                                   max_sheets=options.get("max_sheets", 1),
+                                   min_page_side=options.get("min_page_side", 0),
+                                   max_frames=options.get("max_frames", 8),
+                                   frame_sampling=options.get("frame_sampling", "scene"),
+                                   frame_layout=options.get("frame_layout", "storyboard"))
+
+
+def _prepare_file(path, mime_type, limits, hybrid, api_key):
+    # the worker reads the file itself, so document bytes are not pickled into the pool
+    with open(path, "rb") as file:
+        byte_data = file.read()
+    return _worker_pipeline.prepare(byte_data, mime_type, limits, api_key=api_key, hybrid=hybrid)
+
+
+def mime_type_for(path):
+    """
+    Mime type of a supported document or image, from its extension, or None when unsupported.
+    """
+    return MIME_TYPES.get(os.path.splitext(path)[1].lower())
+
+
+def discover_items(source, prompts=None):
+    """
+    Build batch items from a directory or a manifest file.
+
+    A directory yields one item per supported file (searched recursively, in sorted order) and prompt.
+    A manifest is a JSONL file with one object per line, or a CSV file with a header row, with the keys
+    file and, optionally, prompt, id and model. Relative file paths are resolved against the manifest's
+    directory; rows without a prompt get one item per default prompt.
+
+    Args:
+        source (str): Directory or manifest (.jsonl or .csv) path.
+        prompts (list): Default prompts. Default is None (every manifest row must carry a prompt).
+
+    Returns:
+        list: Item dicts with file, prompt and, when given in the manifest, id and model.
+    """
+    prompts = list(prompts or [])
+    if os.path.isdir(source):
+        if not prompts:
+            raise ValueError("A prompt is required to run a directory.")
+        files = []
+        for root, dirs, names in os.walk(source):
+            dirs.sort()
+            files += [os.path.join(root, name) for name in sorted(names) if mime_type_for(name)]
+        return [{"file": path, "prompt": prompt} for path in files for prompt in prompts]
+
+    extension = os.path.splitext(source)[1].lower()
+    with open(source, newline="", encoding="utf-8") as file:
+        if extension == ".csv":
+            rows = list(csv.DictReader(file))
+        elif extension in (".jsonl", ".ndjson"):
+            rows = [json.loads(line) for line in file if line.strip()]
+        else:
+            raise ValueError(f"Unsupported manifest '{source}'. Use a directory, a .jsonl or a .csv file.")
+    base = os.path.dirname(os.path.abspath(source))
+    items = []
+    for number, row in enumerate(rows, start=1):
+        if not row.get("file"):
+            raise ValueError(f"Manifest row {number} has no file.")
+        item = {key: row[key] for key in ("id", "model") if row.get(key)}
+        item["file"] = os.path.join(base, row["file"])
+        row_prompts = [row["prompt"]] if row.get("prompt") else prompts
+        if not row_prompts:
+            raise ValueError(f"Manifest row {number} has no prompt and no default prompt was given.")
+        if item.get("id") and len(row_prompts) > 1:
+            raise ValueError(f"Manifest row {number} has an id but no prompt; ids must be unique per prompt.")
+        items += [dict(item, prompt=prompt) for prompt in row_prompts]
+    return items
+
+
+class BatchRunner:
+    """
+    BatchRunner answers prompts about many documents without the Streamlit app. Documents are converted
+    in a process pool (each worker holds its own conversion pipeline), while model requests run
+    concurrently on an asyncio event loop, up to a configurable limit. Every answer or error is appended
+    to a JSONL results file as soon as it arrives, so an interrupted batch resumes where it stopped.
+    """
+
+    def __init__(self, model_access, model_name, concurrency=8, workers=None, hybrid=False, temperature=0.0,
+                 api_key=None, pipeline_options=None):
+        """
+        Initialize the BatchRunner class.
+        Args:
+            model_access (LModelAccess): Model access; give it a scheduler for rate limits, retries and failover.
+            model_name (str): Model used for items that do not name one.
+            concurrency (int): Max model requests in flight. Default is 8.
+            workers (int): Conversion worker processes. Default is the CPU count.
+            hybrid (bool): Send text-dominant PDF pages as extracted text. Default is False.
+            temperature (float): The temperature for the model. Default is 0.0.
+            api_key (str): Cloudmersive API key, for PPTX conversion. Default is None.
+            pipeline_options (dict): VQAPipeline, ImageTools and ImageBudgeter settings for the workers
+                (max_sheets, min_page_side, dedupe_threshold, max_frames, frame_sampling, frame_layout,
+                max_image_tokens, max_bytes, cache_dir, converters, convert_timeout). Default is None (library defaults).
+        """
+        self.log = get_logger(__name__)
+        self.model_access = model_access
+        self.model_name = model_name
+        self.concurrency = concurrency
+        self.workers = workers or os.cpu_count() or 1
+        self.hybrid = hybrid
+        self.temperature = temperature
+        self.api_key = api_key
+        self.pipeline_options = pipeline_options or {}
+
+    @staticmethod
+    def item_id(file, prompt, model):
+        """
+        Stable id of an item: the file path plus a digest of the model and prompt.
+        """
+        digest = hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest()[:12]
+        return f"{file}::{digest}"
+
+    @staticmethod
+    def completed_ids(results_path):
+        """
+        Ids already answered in a results file. Failed items are not included, so they run again; a line
+        cut short by an interrupted write is ignored.
+        Args:
+            results_path (str): JSONL results file.
+        Returns:
+            set: Ids of items with status "ok".
+        """
+        done = set()
+        if not os.path.exists(results_path):
+            return done
+        with open(results_path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("status") == "ok":
+                    done.add(record["id"])
+        return done
+
+    def run(self, items, results_path, resume=True, progress=None):
+        """
+        Run a batch, appending one JSON line per item to results_path.
+        Args:
+            items (list): Item dicts from discover_items (file, prompt, optional id and model).
+            results_path (str): JSONL results file.
+            resume (bool): Skip items already answered in results_path; otherwise the file is overwritten. Default is True.
+            progress (callable): Called with (record, finished, total) after each item. Default is None.
+        Returns:
+            dict: total, skipped, ok, error and seconds.
+        """
+        return asyncio.run(self._run(items, results_path, resume, progress))
+
+    async def _run(self, items, results_path, resume, progress):
+        started = time.perf_counter()
+        items = [dict(item, model=item.get("model") or self.model_name) for item in items]
+        for item in items:
+            item.setdefault("id", self.item_id(item["file"], item["prompt"], item["model"]))
+        done = self.completed_ids(results_path) if resume else set()
+        pending = [item for item in items if item["id"] not in done]
+        summary = {"total": len(items), "skipped": len(items) - len(pending), "ok": 0, "error": 0}
+        self.log.info(f"Batch: {len(pending)} items to run, {summary['skipped']} already answered")
+
+        # each document is converted once per model, then asked all of its prompts
+        groups = {}
+        for item in pending:
+            groups.setdefault((item["file"], item["model"]), []).append(item)
+
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+        else:
+            context = multiprocessing.get_context("spawn")
+        requests = asyncio.Semaphore(self.concurrency)
+        # bounds converted documents held in memory while they wait for the model
+        slots = asyncio.Semaphore(self.workers + self.concurrency)
+        state = {"finished": 0, "total": len(pending)}
+        mode = "a" if resume else "w"
+        if resume and os.path.exists(results_path) and os.path.getsize(results_path):
+            with open(results_path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                torn = file.read(1) != b"\n"
+        else:
+            torn = False
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(self.pipeline_options,)) as pool, \
+                open(results_path, mode, encoding="utf-8") as out:
+            if torn:
+                out.write("\n")   # a previous run stopped mid-line
+            await asyncio.gather(*(self._run_group(pool, file, model, group, requests, slots, out, summary,
+                                                   state, progress)
+                                   for (file, model), group in groups.items()))
+        summary["seconds"] = round(time.perf_counter() - started, 3)
+        self.log.info(f"Batch finished: {summary}")
+        return summary
+
+    async def _run_group(self, pool, file, model, items, requests, slots, out, summary, state, progress):
+        async with slots:
+            mime_type = mime_type_for(file)
+            start = time.perf_counter()
+            prepared = error = None
+            try:
+                if mime_type is None:
+                    raise ValueError(f"Unsupported file type '{os.path.splitext(file)[1]}'.")
+                limits = self.model_access.get_model_limits(model)
+                prepared = await asyncio.get_running_loop().run_in_executor(
+                    pool, _prepare_file, file, mime_type, limits, self.hybrid, self.api_key)
+            except Exception as err:
+                self.log.warning(f"Failed to convert {file}: {err}")
+                error = f"Conversion failed: {err}"
+            convert_seconds = round(time.perf_counter() - start, 3)
+            await asyncio.gather(*(self._ask(item, prepared, error, convert_seconds, requests, out, summary,
+                                             state, progress) for item in items))
+
+    async def _ask(self, item, prepared, error, convert_seconds, requests, out, summary, state, progress):
+        record = {"id": item["id"], "file": item["file"], "prompt": item["prompt"], "model": item["model"],
+                  "convert_seconds": convert_seconds}
+        if prepared is not None:
+            async with requests:
+                start = time.perf_counter()
+                try:
+                    message = VQAPipeline.get_prompt(prepared, item["prompt"])
+                    llm = self.model_access.get_llm(item["model"], self.temperature)
+                    response = await llm.ainvoke([message])
+                    record.update(status="ok", response=response.content,
+                                  usage=dict(response.usage_metadata) if getattr(response, "usage_metadata", None) else None)
+                except Exception as err:
+                    self.log.warning(f"Request for {item['id']} failed: {err}")
+                    error = f"Request failed: {err}"
+                record["model_seconds"] = round(time.perf_counter() - start, 3)
+        if error is not None:
+            record.update(status="error", error=error)
+        # single writer (the event loop thread); flushed per line so a crash loses at most the line in progress
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        summary[record["status"]] += 1
+        state["finished"] += 1
+        if progress is not None:
+            progress(record, state["finished"], state["total"])
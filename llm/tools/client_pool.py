@@ -0,0 +1,111 @@
+import asyncio, threading, time
+import httpx
+from util.logger import get_logger
+
+class ClientPool:
+    """
+    Process-wide pool of model clients. Clients are reused by key (model, temperature, headers...) and all
+    of them share keep-alive HTTP connection pools, so repeated requests to the same endpoint skip the TCP
+    and TLS handshakes. Clients unused for idle_ttl seconds are evicted.
+    """
+
+    def __init__(self, idle_ttl=900, max_connections=64, max_keepalive_connections=16, keepalive_expiry=120, timeout=120):
+        """
+        Initialize the ClientPool class.
+        Args:
+            idle_ttl (float): Seconds a client may stay unused before eviction. Default is 900.
+            max_connections (int): Max open connections per HTTP pool. Default is 64.
+            max_keepalive_connections (int): Max idle keep-alive connections per HTTP pool. Default is 16.
+            keepalive_expiry (float): Seconds an idle connection is kept open. Default is 120.
+            timeout (float): HTTP timeout in seconds. Default is 120.
+        """
+        self.log = get_logger(__name__)
+        self.idle_ttl = idle_ttl
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections,
+                                   keepalive_expiry=keepalive_expiry)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._clients = {}          # key -> [client, last_used]
+        self._http_client = None
+        self._async_clients = {}    # event loop -> httpx.AsyncClient
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def http_client(self):
+        """
+        Shared synchronous HTTP client (thread-safe).
+        """
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(limits=self.limits, timeout=self.timeout)
+            return self._http_client
+
+    def async_http_client(self, loop):
+        """
+        Shared asynchronous HTTP client for an event loop. Async clients cannot be shared across loops.
+        Args:
+            loop (AbstractEventLoop): The event loop the client will be used on.
+        Returns:
+            httpx.AsyncClient: Client bound to that loop.
+        """
+        with self._lock:
+            for stale in [stale for stale in self._async_clients if stale.is_closed()]:
+                del self._async_clients[stale]
+            if loop not in self._async_clients:
+                self._async_clients[loop] = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            return self._async_clients[loop]
+
+    @staticmethod
+    def current_loop():
+        """
+        The running event loop, or None when called from synchronous code.
+        """
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+
+    def get(self, key, factory):
+        """
+        Return the pooled client for key, creating it with factory() on first use.
+        Args:
+            key (tuple): Hashable client identity.
+            factory (callable): Zero-argument function creating the client.
+        Returns:
+            object: The pooled client.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                entry[1] = now
+                self._stats["hits"] += 1
+                return entry[0]
+            self._stats["misses"] += 1
+        client = factory()
+        with self._lock:
+            # another thread may have raced us; keep the first client
+            entry = self._clients.setdefault(key, [client, now])
+            return entry[0]
+
+    def _evict_idle(self, now):
+        # caller holds self._lock
+        for key in [key for key, (_, last_used) in self._clients.items() if now - last_used > self.idle_ttl]:
+            del self._clients[key]
+            self._stats["evictions"] += 1
+
+    def stats(self):
+        """
+        Snapshot of the pool counters.
+        Returns:
+            dict: hits, misses, evictions, pooled clients and reuse rate.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["clients"] = len(self._clients)
+            stats["async_http_clients"] = len(self._async_clients)
+        lookups = stats["hits"] + stats["misses"]
+        stats["reuse_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,136 @@
+import re
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from util.logger import get_logger
+from llm.tools.pipeline_metrics import annotate
+from llm.tools.vqa_pipeline import VQAPipeline
+
+
+class Conversation:
+    """
+    Conversation holds the multi-turn context of one session about one uploaded document. The document
+    message (images base64 encoded once, at upload) is built with the first question and reused as the
+    first message of every later turn, so the image bytes are identical from turn to turn. Earlier
+    answers and follow-up questions are sent after it, newest first, within a text token budget; turns
+    that no longer fit are condensed into short excerpts, so the payload of a turn stays bounded.
+    """
+
+    def __init__(self, history_tokens=4096, summary_tokens=512, excerpt_chars=160, max_turns=64):
+        """
+        Initialize the Conversation class.
+        Args:
+            history_tokens (int): Text tokens of earlier turns sent in full with each request. Default is 4096.
+            summary_tokens (int): Text tokens of condensed excerpts of turns beyond that budget. Default is 512.
+            excerpt_chars (int): Characters kept of a question or answer in a condensed excerpt. Default is 160.
+            max_turns (int): Turns kept per document; the oldest follow-ups are forgotten first. Default is 64.
+        """
+        self.log = get_logger(__name__)
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.excerpt_chars = excerpt_chars
+        self.max_turns = max_turns
+        self.document_id = None
+        self.turns = []   # dicts of question, answer and tokens, oldest first
+        self._anchor = None
+        self._anchor_source = None
+
+    @staticmethod
+    def count_tokens(text):
+        return count_tokens_approximately([HumanMessage(content=text)])
+
+    def reset(self, document_id=None):
+        """
+        Forget all turns, e.g. when a different document is uploaded.
+        Args:
+            document_id (object): Identity of the document the next turns are about. Default is None.
+        """
+        self.document_id = document_id
+        self.turns = []
+        self._anchor = self._anchor_source = None
+
+    def use_document(self, document_id):
+        """
+        Start a new conversation if the turns so far were about another document.
+        Args:
+            document_id (object): Identity of the uploaded document.
+        """
+        if document_id != self.document_id:
+            if self.turns:
+                self.log.info(f"New document: dropping {len(self.turns)} turns of conversation context")
+            self.reset(document_id)
+
+    def _document_message(self, prepared, question):
+        # rebuilt only when the upload was prepared again (new file, model limits or mode)
+        if self._anchor_source is None or self._anchor_source[0] is not prepared or self._anchor_source[1] != question:
+            self._anchor = VQAPipeline.get_prompt(prepared, question)
+            self._anchor_source = (prepared, question)
+        return self._anchor
+
+    def _excerpt(self, text):
+        text = re.sub(r"\s+", " ", text or "").strip()
+        return text if len(text) <= self.excerpt_chars else text[:self.excerpt_chars - 1].rstrip() + "…"
+
+    def messages(self, prepared, user_prompt, document_id=None):
+        """
+        Build the messages for the next turn: the document message, earlier turns within the token
+        budgets and the new question. The first turn about a document is the single-turn prompt.
+        Args:
+            prepared (dict): The prepared upload (see VQAPipeline.prepare).
+            user_prompt (str): The user's input prompt.
+            document_id (object): Identity of the uploaded document; a new one starts a new conversation.
+        Returns:
+            list: Messages to send.
+        """
+        self.use_document(document_id)
+        if not self.turns:
+            return [self._document_message(prepared, user_prompt)]
+
+        first, follow_ups = self.turns[0], self.turns[1:]
+        budget = self.history_tokens
+        kept = []
+        for turn in reversed(follow_ups):   # newest turns first
+            if turn["tokens"] > budget:
+                break
+            kept.insert(0, turn)
+            budget -= turn["tokens"]
+        dropped = follow_ups[:len(follow_ups) - len(kept)]
+        # the answer to the document message is clipped rather than dropped, to keep turns alternating
+        first_answer = first["answer"] if self.count_tokens(first["answer"]) <= budget else self._excerpt(first["answer"])
+
+        summary, summary_budget = [], self.summary_tokens
+        for turn in reversed(dropped):
+            line = f"- Q: {self._excerpt(turn['question'])} A: {self._excerpt(turn['answer'])}"
+            tokens = self.count_tokens(line)
+            if tokens > summary_budget:
+                break
+            summary.insert(0, line)
+            summary_budget -= tokens
+
+        messages = [self._document_message(prepared, first["question"]), AIMessage(content=first_answer)]
+        questions = [turn["question"] for turn in kept] + [user_prompt]
+        if summary:
+            questions[0] = ("Earlier in this conversation (condensed):\n" + "\n".join(summary) +
+                            f"\n\nQuestion: {questions[0]}")
+        for question, turn in zip(questions, kept):
+            messages += [HumanMessage(content=question), AIMessage(content=turn["answer"])]
+        messages.append(HumanMessage(content=questions[-1]))
+
+        history_tokens = (sum(turn["tokens"] for turn in kept) + self.count_tokens(first_answer)
+                          + self.summary_tokens - summary_budget)
+        annotate(history_turns=len(kept) + 1, condensed_turns=len(summary),
+                 forgotten_turns=len(dropped) - len(summary), history_tokens=history_tokens)
+        self.log.debug(f"Conversation context: {len(kept) + 1} turns in full, {len(summary)} condensed, "
+                       f"~{history_tokens} text tokens")
+        return messages
+
+    def record(self, user_prompt, response):
+        """
+        Add a completed turn.
+        Args:
+            user_prompt (str): The user's input prompt.
+            response (str): The response shown to the user.
+        """
+        self.turns.append({"question": user_prompt, "answer": response,
+                           "tokens": self.count_tokens(user_prompt) + self.count_tokens(response)})
+        if len(self.turns) > self.max_turns:
+            del self.turns[1]   # the first turn carries the document message
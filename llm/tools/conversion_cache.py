@@ -0,0 +1,202 @@
+import hashlib, os, threading
+from collections import OrderedDict
+from util.logger import get_logger
+
+class ConversionCache:
+    """
+    Content-addressed cache for document-to-image conversions. Entries are keyed on a hash of the
+    input bytes plus the conversion parameters (dpi, target size, output format). A bounded in-memory
+    LRU tier is always used; an optional on-disk tier keeps results across process restarts and is
+    capped by total byte size, evicting the least recently used files first.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=256 * 1024 * 1024, disk_dir=None, disk_max_bytes=1024 * 1024 * 1024):
+        """
+        Initialize the ConversionCache class.
+        Args:
+            max_entries (int): Max number of conversions kept in memory.
+            max_bytes (int): Max total size (bytes) of conversions kept in memory.
+            disk_dir (str): Directory for the on-disk tier. Disabled when None.
+            disk_max_bytes (int): Max total size (bytes) of the on-disk tier.
+        """
+        self.log = get_logger(__name__)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+        if self.disk_dir is not None:
+            os.makedirs(self.disk_dir, exist_ok=True)
+        self.log.debug(f"ConversionCache initialized (max_entries={max_entries}, disk_dir={disk_dir})")
+
+    @staticmethod
+    def make_key(byte_obj, kind, **params):
+        """
+        Build a content-addressed cache key.
+        Args:
+            byte_obj (bytes): Input document bytes.
+            kind (str): Conversion type, e.g. 'pdf' or 'pptx'.
+            **params: Conversion parameters (dpi, target size, format...).
+        Returns:
+            str: Hex digest identifying the conversion.
+        """
+        digest = hashlib.sha256(byte_obj)
+        digest.update(kind.encode("utf-8"))
+        for name in sorted(params):
+            digest.update(f"|{name}={params[name]}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Look up a conversion result, promoting disk hits into memory.
+        Args:
+            key (str): Cache key from make_key.
+        Returns:
+            bytes: Cached result, or None on a miss.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return value
+
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._mem_put(key, value)
+        return value
+
+    def put(self, key, value):
+        """
+        Store a conversion result in both tiers.
+        Args:
+            key (str): Cache key from make_key.
+            value (bytes): Conversion result.
+        """
+        with self._lock:
+            self._mem_put(key, value)
+        self._disk_put(key, value)
+
+    def get_or_convert(self, key, convert):
+        """
+        Return the cached result for key, or run convert() and cache its result.
+        Args:
+            key (str): Cache key from make_key.
+            convert (callable): Zero-argument function producing the result bytes.
+        Returns:
+            bytes: Conversion result.
+        """
+        value = self.get(key)
+        if value is None:
+            value = convert()
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        """
+        Snapshot of the cache counters.
+        Returns:
+            dict: Hit/miss/eviction counters plus current tier sizes.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._entries)
+            stats["memory_bytes"] = self._mem_bytes
+        stats["disk_bytes"] = self._disk_usage() if self.disk_dir is not None else 0
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        """
+        Drop all in-memory entries. The on-disk tier is left intact.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._mem_bytes = 0
+
+    def _mem_put(self, key, value):
+        # caller holds self._lock
+        if len(value) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._mem_bytes -= len(self._entries.pop(key))
+        self._entries[key] = value
+        self._mem_bytes += len(value)
+        while len(self._entries) > self.max_entries or self._mem_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._mem_bytes -= len(evicted)
+            self._stats["memory_evictions"] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.bin")
+
+    def _disk_get(self, key):
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as file:
+                value = file.read()
+            os.utime(path)  # mark as recently used
+            return value
+        except FileNotFoundError:
+            return None
+        except OSError as err:
+            self.log.error(f"Error reading conversion cache entry {path}: {err}")
+            return None
+
+    def _disk_put(self, key, value):
+        if self.disk_dir is None or len(value) > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as file:
+                file.write(value)
+            os.replace(tmp_path, path)  # atomic: readers never see partial files
+        except OSError as err:
+            self.log.error(f"Error writing conversion cache entry {path}: {err}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._disk_evict()
+
+    def _disk_entries(self):
+        entries = []
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".bin"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _disk_usage(self):
+        return sum(size for _, size, _ in self._disk_entries())
+
+    def _disk_evict(self):
+        entries = sorted(self._disk_entries())  # oldest first
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                with self._lock:
+                    self._stats["disk_evictions"] += 1
+            except FileNotFoundError:
+                pass
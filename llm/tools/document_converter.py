@@ -0,0 +1,303 @@
+import contextvars, html, io, os, queue, re, shutil, signal, subprocess, tempfile, threading, time, zipfile
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from util.logger import get_logger
+from util.lazy_import import lazy_import
+from llm.tools.pipeline_metrics import annotate, stage
+
+# loaded on first use: most sessions never convert a presentation
+cloudmersive_convert_api_client = lazy_import("cloudmersive_convert_api_client")
+fitz = lazy_import("fitz")  # PyMuPDF
+
+
+class DocumentConverter(ABC):
+    """
+    Interface of a document-to-PDF conversion backend. Backends are run by a ConversionQueue, which
+    picks the first one that is available and accepts the document. Backends must implement convert().
+    """
+
+    name = "converter"
+    max_input_bytes = None   # None: no size limit
+
+    def available(self):
+        """
+        Whether the backend can run in this process (e.g. its binary is installed).
+        """
+        return True
+
+    def accepts(self, size, api_key=None):
+        """
+        Whether the backend takes a document of this size (bytes), with or without an API key.
+        """
+        return self.max_input_bytes is None or size <= self.max_input_bytes
+
+    @abstractmethod
+    def convert(self, byte_obj, api_key=None, timeout=None):
+        """
+        Convert a document to PDF.
+        Args:
+            byte_obj (bytes): Byte object of the document.
+            api_key (str): API key, for remote backends. Default is None.
+            timeout (float): Max seconds for the conversion. Default is None (no limit).
+        Returns:
+            bytes: The PDF document.
+        """
+
+
+class CloudmersiveConverter(DocumentConverter):
+    """
+    Remote PPTX to PDF conversion with the Cloudmersive API (free tier: 3 MB per document). One API
+    client, and so one HTTP connection pool, is kept per API key.
+    """
+
+    name = "cloudmersive"
+    max_input_bytes = 3 * 1024 * 1024
+
+    def __init__(self):
+        self.log = get_logger(__name__)
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def accepts(self, size, api_key=None):
+        return bool(api_key) and super().accepts(size)
+
+    def _client(self, api_key):
+        with self._lock:
+            if api_key not in self._clients:
+                configuration = cloudmersive_convert_api_client.Configuration()
+                configuration.api_key['Apikey'] = api_key
+                self._clients[api_key] = cloudmersive_convert_api_client.ConvertDocumentApi(
+                    cloudmersive_convert_api_client.ApiClient(configuration))
+            return self._clients[api_key]
+
+    def convert(self, byte_obj, api_key=None, timeout=None):
+        # The client uploads from a file path; the file is removed once the upload completes
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pptx") as temp_file:
+            temp_file.write(byte_obj)
+            input_file = temp_file.name
+        try:
+            # raw response: the PDF bytes as sent, not decoded to a string
+            response = self._client(api_key).convert_document_pptx_to_pdf(
+                input_file, _preload_content=False, _request_timeout=timeout)
+            return response.data
+        finally:
+            os.remove(input_file)
+
+
+class LibreOfficeConverter(DocumentConverter):
+    """
+    Local PPTX to PDF conversion with headless LibreOffice (soffice). No size limit and no network round
+    trip. Each concurrent conversion uses its own LibreOffice profile, reused by later conversions, since
+    one profile cannot be shared by two running instances.
+    """
+
+    name = "libreoffice"
+
+    def __init__(self, binary=None):
+        """
+        Initialize the LibreOfficeConverter class.
+        Args:
+            binary (str): Path of the soffice binary. Default is soffice or libreoffice on PATH.
+        """
+        self.log = get_logger(__name__)
+        self.binary = binary or shutil.which("soffice") or shutil.which("libreoffice")
+        self._profiles = queue.SimpleQueue()
+
+    def available(self):
+        return self.binary is not None
+
+    def convert(self, byte_obj, api_key=None, timeout=None):
+        try:
+            profile = self._profiles.get_nowait()
+        except queue.Empty:
+            profile = tempfile.mkdtemp(prefix="soffice-profile-")
+        try:
+            with tempfile.TemporaryDirectory(prefix="soffice-") as work_dir:
+                input_file = os.path.join(work_dir, "document.pptx")
+                with open(input_file, "wb") as file:
+                    file.write(byte_obj)
+                command = [self.binary, "--headless", "--norestore", "--nolockcheck",
+                           f"-env:UserInstallation=file://{profile}",
+                           "--convert-to", "pdf", "--outdir", work_dir, input_file]
+                # own process group: soffice forks a child that a plain kill would leave running
+                process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                           start_new_session=True)
+                try:
+                    _, stderr = process.communicate(timeout=timeout)
+                except subprocess.TimeoutExpired:
+                    os.killpg(process.pid, signal.SIGKILL)
+                    process.communicate()
+                    raise TimeoutError(f"LibreOffice conversion timed out after {timeout}s")
+                output_file = os.path.join(work_dir, "document.pdf")
+                if process.returncode != 0 or not os.path.exists(output_file):
+                    raise RuntimeError(f"LibreOffice exited with {process.returncode}: "
+                                       f"{stderr.decode('utf-8', 'replace').strip()[-500:]}")
+                with open(output_file, "rb") as file:
+                    return file.read()
+        finally:
+            self._profiles.put(profile)
+
+
+class StubConverter(DocumentConverter):
+    """
+    Offline stand-in for tests and benchmarks: one plain PDF page per slide, holding the slide's text.
+    PDF input is passed through unchanged.
+    """
+
+    name = "stub"
+
+    def __init__(self, delay=0.0):
+        """
+        Initialize the StubConverter class.
+        Args:
+            delay (float): Seconds each conversion sleeps, to simulate a slow backend. Default is 0.0.
+        """
+        self.delay = delay
+
+    @staticmethod
+    def _slide_number(name):
+        return int(re.search(r"(\d+)\.xml$", name).group(1))
+
+    def convert(self, byte_obj, api_key=None, timeout=None):
+        if self.delay:
+            time.sleep(self.delay)
+        if byte_obj[:5] == b"%PDF-":
+            return byte_obj
+        with zipfile.ZipFile(io.BytesIO(byte_obj)) as archive:
+            slides = sorted((name for name in archive.namelist() if re.match(r"ppt/slides/slide\d+\.xml$", name)),
+                            key=self._slide_number)
+            texts = [[html.unescape(run) for run in re.findall(r"<a:t>([^<]*)</a:t>", archive.read(name).decode("utf-8"))]
+                     for name in slides]
+        doc = fitz.open()
+        for number, runs in enumerate(texts or [[]], start=1):
+            page = doc.new_page(width=960, height=540)   # 16:9 slide at 72 dpi
+            page.insert_textbox(fitz.Rect(48, 48, 912, 492), "\n".join(runs) or f"Slide {number}", fontsize=20)
+        return doc.tobytes()
+
+
+# backend names accepted in configuration (e.g. PPTX_CONVERTERS=libreoffice,cloudmersive)
+CONVERTERS = {
+    CloudmersiveConverter.name: CloudmersiveConverter,
+    LibreOfficeConverter.name: LibreOfficeConverter,
+    StubConverter.name: StubConverter,
+}
+
+
+class ConversionQueue:
+    """
+    ConversionQueue runs document conversions on a bounded worker pool shared by all sessions, trying
+    its backends in order: a backend that is unavailable, rejects the document (size, missing API key)
+    or fails is skipped in favour of the next one. Each attempt is limited by a timeout.
+    """
+
+    def __init__(self, converters, max_concurrency=2, timeout=120.0):
+        """
+        Initialize the ConversionQueue class.
+        Args:
+            converters (list): DocumentConverter backends, in order of preference.
+            max_concurrency (int): Max conversions running at once. Default is 2.
+            timeout (float): Max seconds per conversion attempt. Default is 120.0.
+        """
+        self.log = get_logger(__name__)
+        self.converters = [converter for converter in converters if converter.available()]
+        for converter in converters:
+            if converter not in self.converters:
+                self.log.warning(f"Document converter '{converter.name}' is not available and is skipped")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="convert")
+        self._stats_lock = threading.Lock()
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "queued": 0, "wait_time_max": 0.0,
+                       "converters": {converter.name: {"completed": 0, "failed": 0} for converter in self.converters}}
+
+    @classmethod
+    def from_names(cls, names, **options):
+        """
+        Build a queue from backend names, e.g. ["libreoffice", "cloudmersive"].
+        Args:
+            names (list): Names from CONVERTERS, in order of preference.
+            **options: ConversionQueue options (max_concurrency, timeout).
+        Returns:
+            ConversionQueue: The queue.
+        """
+        unknown = [name for name in names if name not in CONVERTERS]
+        if unknown:
+            raise ValueError(f"Unknown document converters {unknown}. Choose from {sorted(CONVERTERS)}.")
+        return cls([CONVERTERS[name]() for name in names], **options)
+
+    def accepts(self, size, api_key=None):
+        """
+        Whether any backend takes a document of this size (bytes).
+        """
+        return any(converter.accepts(size, api_key) for converter in self.converters)
+
+    def submit(self, byte_obj, api_key=None):
+        """
+        Queue a conversion.
+        Args:
+            byte_obj (bytes): Byte object of the document.
+            api_key (str): API key, for remote backends. Default is None.
+        Returns:
+            Future: Resolves to the PDF bytes.
+        """
+        with self._stats_lock:
+            self._stats["submitted"] += 1
+            self._stats["queued"] += 1
+        # the worker runs in the caller's context, so stage timings reach the caller's trace
+        context = contextvars.copy_context()
+        return self._pool.submit(context.run, self._run, byte_obj, api_key, time.perf_counter())
+
+    def convert(self, byte_obj, api_key=None):
+        """
+        Convert a document to PDF, blocking until it is done.
+        Args:
+            byte_obj (bytes): Byte object of the document.
+            api_key (str): API key, for remote backends. Default is None.
+        Returns:
+            bytes: The PDF document.
+        """
+        return self.submit(byte_obj, api_key).result()
+
+    def _run(self, byte_obj, api_key, submitted_at):
+        waited = time.perf_counter() - submitted_at
+        with self._stats_lock:
+            self._stats["queued"] -= 1
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+        errors = []
+        for converter in self.converters:
+            if not converter.accepts(len(byte_obj), api_key):
+                errors.append(f"{converter.name}: not applicable")
+                continue
+            try:
+                with stage("convert"):
+                    pdf_byte_data = converter.convert(byte_obj, api_key=api_key, timeout=self.timeout)
+                if pdf_byte_data[:5] != b"%PDF-":
+                    raise RuntimeError("the response is not a PDF document")
+            except Exception as err:
+                self.log.warning(f"{type(err)}: Conversion with '{converter.name}' failed: {err}")
+                errors.append(f"{converter.name}: {err}")
+                self._count(converter.name, "failed")
+                continue
+            self._count(converter.name, "completed")
+            annotate(converter=converter.name, convert_wait_s=round(waited, 6))
+            return pdf_byte_data
+        with self._stats_lock:
+            self._stats["failed"] += 1
+        raise RuntimeError("No converter could convert the document (" + "; ".join(errors or ["none configured"]) + ")")
+
+    def _count(self, name, key):
+        with self._stats_lock:
+            self._stats["converters"][name][key] += 1
+            if key == "completed":
+                self._stats["completed"] += 1
+
+    def stats(self):
+        """
+        Snapshot of the queue counters.
+        Returns:
+            dict: Submitted, completed, failed and queued conversions, max queue wait and per-backend counters.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["converters"] = {name: dict(counts) for name, counts in self._stats["converters"].items()}
+        return stats
@@ -0,0 +1,83 @@
+import contextvars, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from util.logger import get_logger
+from llm.tools.prompt_utils import PromptUtils
+
+class MapReduceQA:
+    """
+    MapReduceQA answers a question about a long document page by page: each page group is sent as its
+    own request (map), with bounded concurrency, and the page-level answers are then combined into one
+    response with page citations (reduce).
+    """
+
+    def __init__(self, llm, max_concurrency=4):
+        """
+        Initialize the MapReduceQA class.
+        Args:
+            llm (ChatOpenAI): The LLM instance used for both steps.
+            max_concurrency (int): Max page requests in flight. Default is 4.
+        """
+        self.log = get_logger(__name__)
+        self.llm = llm
+        self.max_concurrency = max_concurrency
+
+    def _ask_pages(self, first_page, last_page, total_pages, image_byte_data, user_prompt, mime_type, image_tokens):
+        start = time.perf_counter()
+        try:
+            prompt = PromptUtils.get_page_prompt(image_byte_data, user_prompt, first_page, last_page,
+                                                 total_pages, mime_type, image_tokens)
+            answer, error = self.llm.invoke([prompt]).content, None
+        except Exception as err:
+            self.log.error(f"{type(err)}: Error answering pages {first_page}-{last_page}: {err}")
+            answer, error = None, err
+        return {
+            "first_page": first_page,
+            "last_page": last_page,
+            "answer": answer,
+            "error": error,
+            "latency": time.perf_counter() - start,
+        }
+
+    def map_pages(self, page_images, user_prompt, total_pages, mime_type="image/jpeg"):
+        """
+        Ask the question of every page group concurrently.
+        Args:
+            page_images (list): (first_page, last_page, image_bytes, image_tokens) tuples.
+            user_prompt (str): User prompt.
+            total_pages (int): Number of pages in the document.
+            mime_type (str): Mime type of the page images.
+        Yields:
+            dict: first_page, last_page, answer, error and latency, in completion order.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            # each page runs in a copy of the caller's context, so its stage timings reach the caller's trace
+            futures = [pool.submit(contextvars.copy_context().run, self._ask_pages, first, last, total_pages,
+                                   image_byte_data, user_prompt, mime_type, image_tokens)
+                       for first, last, image_byte_data, image_tokens in page_images]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def stream_reduce(self, user_prompt, page_results):
+        """
+        Combine page-level answers into a single cited response, streamed chunk by chunk.
+        Args:
+            user_prompt (str): User prompt.
+            page_results (list): Results from map_pages.
+        Yields:
+            str: Response text chunks.
+        """
+        ordered = sorted(page_results, key=lambda result: result["first_page"])
+        failed = [result for result in ordered if result["error"] is not None]
+        if failed and len(failed) == len(ordered):
+            raise failed[0]["error"]
+        if failed:
+            self.log.warning(f"{len(failed)} of {len(ordered)} page groups failed and are left out of the answer")
+        prompt = PromptUtils.get_reduce_prompt(
+            user_prompt, [(result["first_page"], result["last_page"], result["answer"]) for result in ordered if result["error"] is None])
+        for chunk in self.llm.stream([prompt]):
+            if chunk.content:
+                yield chunk.content
+        if failed:
+            pages = ", ".join(str(result["first_page"]) if result["first_page"] == result["last_page"]
+                              else f"{result['first_page']}-{result['last_page']}" for result in failed)
+            yield f"\n\n_Pages {pages} could not be analyzed and were not considered._"
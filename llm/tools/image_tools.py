@@ -1,65 +1,87 @@
-import ast, os, tempfile
-import streamlit as st
-from PIL import Image
-import fitz  # PyMuPDF
-import cloudmersive_convert_api_client
-from cloudmersive_convert_api_client.rest import ApiException
+import hashlib, io, json, math
+from util.logger import get_logger
+from PIL import Image, ImageChops, ImageStat
+from llm.tools.document_converter import CloudmersiveConverter, ConversionQueue
+from llm.tools.pdf_rasterizer import PdfRasterizer
+from llm.tools.pipeline_metrics import annotate, stage
 
 class ImageTools:
     """
     ImageTools class provides methods to handle image processing tasks required for VQA operations.
     """
 
-    def __init__(self):
+    target_width = 1024     # Llama Vision: max size is 1120x1120
+    output_format = "JPEG"
+
+    def __init__(self, cache=None, rasterizer=None, dedupe_threshold=None, converter=None):
         """
         Initialize the ImageTools class.
+        Args:
+            cache (ConversionCache): Optional cache for conversion results. Default is None (no caching).
+            rasterizer (PdfRasterizer): PDF page renderer. Default is a PdfRasterizer with one worker per CPU.
+            dedupe_threshold (int): Max perceptual hash distance (bits of 256) at which two pages count as
+                near-duplicates and only one is kept. Default is None (keep every page).
+            converter (ConversionQueue): PPTX to PDF conversion. Default is a queue with the Cloudmersive backend.
         """
-        self.log = st.logger.get_logger(__name__)
+        self.log = get_logger(__name__)
+        self.cache = cache
+        self.rasterizer = rasterizer or PdfRasterizer()
+        self.dedupe_threshold = dedupe_threshold
+        self.converter = converter or ConversionQueue([CloudmersiveConverter()])
         self.log.debug("ImageTools initialized")
 
-    def pdf_to_jpeg(self, byte_obj, dpi=200):
+    def _cached(self, kind, byte_obj, dpi, convert, **params):
+        """
+        Serve a conversion from the cache, running convert() on a miss.
+        Args:
+            kind (str): Conversion type used in the cache key.
+            byte_obj (bytes): Byte object of the input document (or a digest of it).
+            dpi (int): Dots per inch for the conversion.
+            convert (callable): Zero-argument function performing the conversion.
+            **params: Additional conversion parameters for the cache key.
+        Returns:
+            image_bytes: byte object containing all image data.
+        """
+        if self.cache is None:
+            return convert()
+        key = self.cache.make_key(byte_obj, kind, dpi=dpi, width=self.target_width, format=self.output_format, **params)
+        return self.cache.get_or_convert(key, convert)
+
+    def pdf_to_jpeg(self, byte_obj, dpi=200, max_side=None):
         """
-        Convert PDF file to a JPEG image. Multiple pages are converted to individual images
-        and then merged.
+        Convert PDF file to a JPEG image. Multiple pages are laid out as a labelled grid, choosing the
+        number of columns that gives each page the most pixels within max_side, and rendered in parallel
+        directly at that scale. Results are served from the conversion cache when one is configured.
         Args:
             byte_obj (bytes): Byte object of the PDF file.
             dpi (int): Dots per inch for the conversion. Default is 200.
+            max_side (int): Max image width and height, e.g. the model's max image side. Default is target_width.
         Returns:
             image_bytes: byte object containing all image data.
         """
-        jpeg_image_path = image_byte_data = None
         try:
-            # Convert to PIL image list using PyMuPDF
-            doc = fitz.open(stream=byte_obj, filetype="pdf")
-            images = []
-            
-            # Calculate zoom factor for DPI (PyMuPDF default is 72 DPI)
-            zoom = dpi / 72
-            matrix = fitz.Matrix(zoom, zoom)
-            
-            for page in doc:
-                pix = page.get_pixmap(matrix=matrix)
-                # Convert to PIL Image
-                # fitz pixmap is usually RGB, but check alpha
-                mode = "RGBA" if pix.alpha else "RGB"
-                img = Image.frombytes(mode, [pix.width, pix.height], pix.samples)
-                if mode == "RGBA":
-                    img = img.convert("RGB")
-                images.append(img)
-            
-            image_count = len(images)
-            if image_count > 1:
-                jpeg_image_path = self._merge_images(images)
-            elif image_count == 1:
-                image = images[0].convert("RGB")
-                image = image.resize((1024, 1024))  # Llama Vision: max size is 1120x1120
-                self.log.debug(f"image size: {image.size}")
-                jpeg_image_path = self.get_temp_jpeg(image)
-            else:
-                raise RuntimeError("No pages found in PDF.")
+            # checked outside the cache, so dropped pages are reported on cache hits too
+            pages = self._kept_pages(byte_obj)
+        except Exception as err:
+            self.log.critical(f"{type(err)}: Error converting PDF to image: {err}")
+            raise RuntimeError("Failed to convert the PDF document to JPEG image. Please investigate the file format and content.")
+        return self._tiled_jpeg(byte_obj, dpi, max_side or self.target_width, pages)
+
+    def _tiled_jpeg(self, byte_obj, dpi, max_side, pages):
+        return self._cached("pdf", byte_obj, dpi, lambda: self._pdf_to_jpeg(byte_obj, dpi, max_side, pages),
+                            max_side=max_side, dedupe=self.dedupe_threshold)
 
-            with open(jpeg_image_path, 'rb') as file:
-                image_byte_data = file.read()      
+    def _pdf_to_jpeg(self, byte_obj, dpi=200, max_side=None, pages=None):
+        image_byte_data = None
+        try:
+            image_count = self.rasterizer.page_count(byte_obj)
+            annotate(pages=image_count)
+            if image_count == 0:
+                raise RuntimeError("No pages found in PDF.")
+            # Pages are rendered at output scale and tiled
+            with self.rasterizer.render_tiled(byte_obj, max_side or self.target_width, dpi, pages=pages) as image:
+                self.log.debug(f"Tiled image size: {image.size}")
+                image_byte_data = self.encode_image(image)
         
         except Exception as err:
             self.log.critical(f"{type(err)}: Error converting PDF to image: {err}")
@@ -67,86 +89,333 @@ class ImageTools:
 
         return image_byte_data
 
-    def _merge_images(self, images):
+    @staticmethod
+    def perceptual_hash(image, hash_size=16):
         """
-        Merge multiple images into a single one. Logic scales merged image to maintain 
-        aspect ratio and attempt fit within max constraints of Llama Vision.  Overall results 
-        depreciate with image size. Llama Vision context window is 128k tokens and data truncates.
+        Difference hash (dHash) of an image: one bit per pair of horizontally adjacent cells of a grayscale
+        thumbnail, set where brightness increases. Near-identical images have hashes a few bits apart.
         Args:
-            images (list): List of PIL Image objects to merge.
+            image (PIL Image): Image to hash.
+            hash_size (int): Cells per side; the hash has hash_size squared bits. Default is 16.
         Returns:
-            PIL Image: Merged image.
-        """
-        tmp_image_paths = []
-        merged_image_name = "merged_pages.jpeg"
-        for index, image in enumerate(images):
-            self.log.debug(f"Converting page {index + 1} of PDF to image")
-            image.convert("RGB")
-            jpeg_path = self.get_temp_jpeg(image)
-            tmp_image_paths.append(jpeg_path)
-    
-        self.log.debug(f"Total pages converted: {len(tmp_image_paths)}")
-        imgs = list(map(Image.open, tmp_image_paths))
-        # Find max width, ttl height of images
-        max_img_width = max(i.width for i in imgs)
-        total_height = sum(i.height for i in imgs)
-    
-        # New image for merged pages
-        merged_image = Image.new('RGB', (max_img_width, total_height))
-        y_offset = 0
-        for img in imgs:
-            merged_image.paste(img, (0, y_offset))   # Merge images
-            y_offset += img.height                   # Reset y_offset for vertical stacking
-
-        img_width, img_height = merged_image.size
-        new_height = int((1024 / img_width) * img_height)  # Scale to maintain aspect ratio
-        merged_image = merged_image.resize((1024, new_height))  # Llama Vision: max size is 1120x1120               
-        self.log.debug(f"Merged image size: {merged_image.size}")
-        merged_image_path = self.get_temp_jpeg(merged_image) 
-        return merged_image_path
-    
-    def pptx_to_jpeg(self, api_key, byte_obj, dpi=200):
-        """
-        Convert PPTX file to a JPEG image. PPTX is converted to PDF using the Cloudmersive API (free tier).
-        Content is then converted to JPEG images. PDFs are converted to individual images and then
-         merged using the pdf_to_jpeg method.
+            int: The hash.
+        """
+        pixels = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR).tobytes()
+        value = 0
+        for row in range(hash_size):
+            offset = row * (hash_size + 1)
+            for col in range(offset, offset + hash_size):
+                value = value << 1 | (pixels[col + 1] > pixels[col])
+        return value
+
+    @staticmethod
+    def hash_distance(first, second):
+        """
+        Number of differing bits between two perceptual hashes.
+        """
+        return bin(first ^ second).count("1")
+
+    def unique_pages(self, byte_obj):
+        """
+        Find near-duplicate pages of a PDF: pages that look alike (perceptual hashes at most dedupe_threshold
+        bits apart) and whose text layers are equal or contained in one another. A page adding nothing to a
+        kept page is dropped, so repeated title, blank or agenda pages are kept where they first appear; a
+        page extending the page right before it replaces it, so build-up slides collapse into their last,
+        most complete step. Results are cached like conversions.
+        Args:
+            byte_obj (bytes): Byte object of the PDF file.
+        Returns:
+            tuple: (zero-based indices of the pages to keep, removed pages as dicts of page, kept_as and
+                   distance, with 1-based page numbers).
+        """
+        threshold = self.dedupe_threshold or 0
+        report = self._cached("pdf-dedupe", byte_obj, 0,
+                              lambda: json.dumps(self._unique_pages(byte_obj, threshold)).encode("utf-8"),
+                              threshold=threshold)
+        kept, removed = json.loads(report)
+        if removed:
+            annotate(duplicate_pages=removed)
+            self.log.info(f"Dropped {len(removed)} near-duplicate pages: "
+                          + ", ".join(f"p. {entry['page']} (as p. {entry['kept_as']})" for entry in removed))
+        return kept, removed
+
+    def _unique_pages(self, byte_obj, threshold):
+        kept = []       # (index, hash, normalized text) of the pages kept so far
+        removed = []
+        for index, (preview, text) in enumerate(self.rasterizer.page_previews(byte_obj)):
+            page_hash = self.perceptual_hash(preview)
+            text = " ".join(text.split())
+            for position, (other, other_hash, other_text) in enumerate(kept):
+                distance = self.hash_distance(page_hash, other_hash)
+                if distance > threshold:
+                    continue
+                if text in other_text:
+                    removed.append({"page": index + 1, "kept_as": other + 1, "distance": distance})
+                    break
+                if other_text in text and position == len(kept) - 1:
+                    kept[position] = (index, page_hash, text)
+                    for entry in removed:
+                        if entry["kept_as"] == other + 1:
+                            entry["kept_as"] = index + 1
+                    removed.append({"page": other + 1, "kept_as": index + 1, "distance": distance})
+                    break
+            else:
+                kept.append((index, page_hash, text))
+        return [entry[0] for entry in kept], sorted(removed, key=lambda entry: entry["page"])
+
+    def _kept_pages(self, byte_obj):
+        """
+        Zero-based indices of the pages to convert, or None for all pages when de-duplication is off.
+        """
+        return None if self.dedupe_threshold is None else self.unique_pages(byte_obj)[0]
+
+    def pdf_to_sheets(self, byte_obj, max_side=None, max_images=1, min_page_side=0, dpi=200):
+        """
+        Convert a PDF file to one or more labelled page grids. Pages are spread over more images (up to
+        max_images) only while a single grid would render pages with a longest side below min_page_side.
+        Args:
+            byte_obj (bytes): Byte object of the PDF file.
+            max_side (int): Max image width and height, e.g. the model's max image side. Default is target_width.
+            max_images (int): Max number of images. Default is 1.
+            min_page_side (int): Longest side in pixels a page should get before splitting stops. Default is 0.
+            dpi (int): Dots per inch for the conversion. Default is 200.
+        Returns:
+            list: (first_page, last_page, image_bytes) tuples, with 1-based page numbers.
+        """
+        max_side = max_side or self.target_width
+        try:
+            sizes = self.rasterizer.page_sizes(byte_obj)
+            if not sizes:
+                raise RuntimeError("No pages found in PDF.")
+            page_count = len(sizes)
+            pages = self._kept_pages(byte_obj) or list(range(page_count))
+            sizes = [sizes[index] for index in pages]
+            page_size = (max(width for width, _ in sizes), max(height for _, height in sizes))
+            for sheets in range(1, max_images + 1):
+                per_sheet = math.ceil(len(sizes) / sheets)
+                label_height = self.rasterizer.label_height(max_side) if per_sheet > 1 else 0
+                zoom = self.rasterizer.grid_layout(page_size, per_sheet, max_side, label_height)[2]
+                if max(page_size) * zoom >= min_page_side:
+                    break
+        except Exception as err:
+            self.log.critical(f"{type(err)}: Error converting PDF to image: {err}")
+            raise RuntimeError("Failed to convert the PDF document to JPEG image. Please investigate the file format and content.")
+        if per_sheet == len(sizes):
+            return [(1, page_count, self._tiled_jpeg(byte_obj, dpi, max_side, pages))]
+        annotate(pages=page_count)
+        self.log.debug(f"Splitting {len(sizes)} pages into sheets of {per_sheet}")
+        return self._page_groups(byte_obj, pages, per_sheet, dpi, max_side)
+
+    def pdf_to_page_jpegs(self, byte_obj, pages_per_image=1, dpi=200, max_side=None):
+        """
+        Convert a PDF file to one JPEG image per group of consecutive pages, for page-level question
+        answering. Each group is cached individually when a conversion cache is configured.
         Args:
+            byte_obj (bytes): Byte object of the PDF file.
+            pages_per_image (int): Consecutive pages tiled into each image. Default is 1.
+            dpi (int): Dots per inch for the conversion. Default is 200.
+            max_side (int): Max image width and height, e.g. the model's max image side. Default is target_width.
+        Returns:
+            list: (first_page, last_page, image_bytes) tuples, with 1-based page numbers. With de-duplication
+                  on, dropped pages are skipped, so a group can span more pages than it shows.
+        """
+        try:
+            page_count = self.rasterizer.page_count(byte_obj)
+            annotate(pages=page_count)
+            if page_count == 0:
+                raise RuntimeError("No pages found in PDF.")
+            pages = self._kept_pages(byte_obj) or list(range(page_count))
+        except Exception as err:
+            self.log.critical(f"{type(err)}: Error converting PDF pages to images: {err}")
+            raise RuntimeError("Failed to convert the PDF document to JPEG images. Please investigate the file format and content.")
+        return self._page_groups(byte_obj, pages, pages_per_image, dpi, max_side or self.target_width)
+
+    def _page_groups(self, byte_obj, indices, pages_per_image, dpi, max_side):
+        try:
+            doc_id = hashlib.sha256(byte_obj).digest()  # hash the document once, not once per group
+            groups = []
+            for start in range(0, len(indices), pages_per_image):
+                pages = indices[start:start + pages_per_image]
+                image_byte_data = self._cached("pdf-pages", doc_id, dpi,
+                                               lambda: self._pages_to_jpeg(byte_obj, pages, dpi, max_side),
+                                               first=pages[0], last=pages[-1], max_side=max_side,
+                                               dedupe=self.dedupe_threshold)
+                groups.append((pages[0] + 1, pages[-1] + 1, image_byte_data))
+        except Exception as err:
+            self.log.critical(f"{type(err)}: Error converting PDF pages to images: {err}")
+            raise RuntimeError("Failed to convert the PDF document to JPEG images. Please investigate the file format and content.")
+        self.log.debug(f"Converted {len(indices)} pages into {len(groups)} images")
+        return groups
+
+    def _pages_to_jpeg(self, byte_obj, pages, dpi, max_side):
+        with self.rasterizer.render_tiled(byte_obj, max_side, dpi, pages=pages) as image:
+            return self.encode_image(image)
+
+    def pdf_region_to_jpeg(self, byte_obj, page, clip=None, dpi=200, max_side=None, doc_id=None):
+        """
+        Convert one PDF page, or a figure region of it, to a JPEG image keeping its aspect ratio.
+        Args:
+            byte_obj (bytes): Byte object of the PDF file.
+            page (int): Zero-based page index.
+            clip (tuple): (x0, y0, x1, y1) region in points. Default is None (the whole page).
+            dpi (int): Dots per inch for the conversion. Default is 200.
+            max_side (int): Max image width and height, e.g. the model's max image side. Default is target_width.
+            doc_id (bytes): Digest of byte_obj when already computed, for the cache key. Default is None.
+        Returns:
+            image_bytes: byte object containing the image data.
+        """
+        max_side = max_side or self.target_width
+
+        def convert():
+            image = self.rasterizer.render_region(byte_obj, page, max_side, dpi, clip)
+            return self.encode_image(image)
+
+        try:
+            return self._cached("pdf-region", doc_id or hashlib.sha256(byte_obj).digest(), dpi, convert,
+                                page=page, clip=clip, max_side=max_side)
+        except Exception as err:
+            self.log.critical(f"{type(err)}: Error converting PDF page {page + 1} to image: {err}")
+            raise RuntimeError("Failed to convert the PDF document to JPEG images. Please investigate the file format and content.")
+
+    def pptx_to_jpeg(self, api_key, byte_obj, dpi=200, max_side=None):
+        """
+        Convert PPTX file to a JPEG image. PPTX is converted to PDF by the converter queue (local LibreOffice,
+        the Cloudmersive API, ...). Content is then converted to JPEG images. PDFs are converted to individual
+        images and then tiled using the pdf_to_jpeg method. Cache hits skip the conversion entirely.
+        Args:
+            api_key (str): Cloudmersive API key, for the Cloudmersive backend.
             byte_obj (bytes): Byte object of the PPTX file.
             dpi (int): Dots per inch for the conversion. Default is 200.
+            max_side (int): Max image width and height, e.g. the model's max image side. Default is target_width.
         Returns:
             image_bytes: byte object containing all image data.
         """
+        max_side = max_side or self.target_width
+        return self._cached("pptx", byte_obj, dpi, lambda: self._pptx_to_jpeg(api_key, byte_obj, dpi, max_side),
+                            max_side=max_side, dedupe=self.dedupe_threshold)
+
+    def _pptx_to_jpeg(self, api_key, byte_obj, dpi=200, max_side=None):
         try:
-            # Configure API key authorization: Apikey
-            configuration = cloudmersive_convert_api_client.Configuration()
-            configuration.api_key['Apikey'] = api_key
-            # Uncomment below to setup prefix (e.g. Bearer) for API key, if needed
-            # configuration.api_key_prefix['Apikey'] = 'Bearer'
-            # create an instance of the API class
-            api_instance = cloudmersive_convert_api_client.ConvertDocumentApi(cloudmersive_convert_api_client.ApiClient(configuration))
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pptx") as temp_file:
-                temp_file.write(byte_obj)
-                input_file = temp_file.name
-                #temp_file.seek(0, os.SEEK_END)    # goto eof
-                #temp_file_size = temp_file.tell() # eof = size
-            
-            # Convert Document to PDF
-            response = api_instance.convert_document_pptx_to_pdf(input_file)
-            return self.pdf_to_jpeg(ast.literal_eval(response), dpi)
+            pdf_byte_data = self.converter.convert(byte_obj, api_key)
+            return self._pdf_to_jpeg(pdf_byte_data, dpi, max_side, self._kept_pages(pdf_byte_data))
 
         except Exception as e:
             self.log.critical(f"Error converting PPTX to JPEG image: {e}")
             raise RuntimeError("Failed to convert the PPTX document to JPEG image. Please investigate the file format and content.")
 
-    def get_temp_jpeg(self, image):
+    @staticmethod
+    def frame_count(byte_obj):
+        """
+        Number of frames of an image; 1 for still images.
+        """
+        with Image.open(io.BytesIO(byte_obj)) as image:
+            return getattr(image, "n_frames", 1)
+
+    def sample_frames(self, byte_obj, max_frames=8, sampling="scene", scene_threshold=8, check_cancelled=None):
+        """
+        Decode an animated image (GIF) and pick at most max_frames frames. Scene sampling spaces the picks
+        evenly along the accumulated change between consecutive frames (mean absolute difference of 32x32
+        RGB thumbnails, 0-255): a cut is picked right after it happens, steady motion is sampled in
+        proportion to how much it changes the picture and static stretches are skipped. Every
+        scene_threshold of accumulated change earns one frame, so a still animation yields a single
+        frame. Stride sampling keeps evenly spaced frames.
+        Args:
+            byte_obj (bytes): Byte object of the animated image.
+            max_frames (int): Max frames to keep. Default is 8.
+            sampling (str): "scene" or "stride". Default is "scene".
+            scene_threshold (float): Accumulated change per sampled frame. Default is 8.
+            check_cancelled (callable): Called between frames; raises to stop early. Default is None.
+        Returns:
+            list: Dicts of index (zero-based frame number), time_ms (frame start) and image (RGB PIL Image).
+        """
+        check_cancelled = check_cancelled or (lambda: None)
+        try:
+            with Image.open(io.BytesIO(byte_obj)) as animation:
+                frame_total = getattr(animation, "n_frames", 1)
+                times, progress = [], []    # frame start times; accumulated change up to each frame
+                time_ms, change, last_thumbnail = 0, 0.0, None
+                for index in range(frame_total):
+                    check_cancelled()
+                    with stage("decode"):
+                        animation.seek(index)
+                        times.append(time_ms)
+                        time_ms += animation.info.get("duration", 0) or 0
+                        if sampling == "scene":
+                            # colour matters for scene changes, so thumbnails are compared rather than dHashes
+                            thumbnail = animation.convert("RGB").resize((32, 32), Image.BILINEAR)
+                            if last_thumbnail is not None:
+                                change += sum(ImageStat.Stat(ImageChops.difference(thumbnail, last_thumbnail)).mean) / 3
+                            last_thumbnail = thumbnail
+                    progress.append(change)
+
+                if sampling == "scene":
+                    count = max(1, min(max_frames, frame_total, 1 + int(change // scene_threshold)))
+                    targets = [number * change / count for number in range(count)]
+                    # first frame at or past each target
+                    wanted, position = [], 0
+                    for target in targets:
+                        while progress[position] < target:
+                            position += 1
+                        wanted.append(position)
+                else:
+                    step = (frame_total - 1) / (max_frames - 1) if max_frames > 1 else 0
+                    wanted = [round(number * step) for number in range(min(max_frames, frame_total))]
+                frames = []
+                for index in sorted(set(wanted)):
+                    check_cancelled()
+                    with stage("decode"):
+                        animation.seek(index)
+                        frames.append({"index": index, "time_ms": times[index], "image": animation.convert("RGB")})
+        except (OSError, EOFError, ValueError) as err:   # Pillow decode errors; cancellation propagates
+            self.log.critical(f"{type(err)}: Error decoding animated image frames: {err}")
+            raise RuntimeError("Failed to decode the animated image. Please investigate the file format and content.")
+        annotate(frames=frame_total, sampled_frames=len(frames))
+        self.log.debug(f"Sampled {len(frames)} of {frame_total} frames ({sampling})")
+        return frames
+
+    def frames_to_storyboard(self, frames, max_side=None, gap=4):
         """
-        Create a temporary JPEG file.
+        Lay sampled frames out as a labelled grid (storyboard) no larger than max_side, in frame order.
+        Args:
+            frames (list): Frames from sample_frames.
+            max_side (int): Max image width and height, e.g. the model's max image side. Default is target_width.
+            gap (int): Pixels between frames. Default is 4.
         Returns:
-            str: Path to the temporary JPEG file.
-        """
-        jpeg_path = None
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpeg") as tmp_file:
-            image.save(tmp_file, "JPEG")
-            jpeg_path = tmp_file.name
-            self.log.debug(f"Saved image as {jpeg_path}")  
-        return jpeg_path  
\ No newline at end of file
+            image_bytes: byte object containing the storyboard image data.
+        """
+        max_side = max_side or self.target_width
+        frame_size = (max(frame["image"].width for frame in frames), max(frame["image"].height for frame in frames))
+        label_height = self.rasterizer.label_height(max_side)
+        cols, rows, zoom = self.rasterizer.grid_layout(frame_size, len(frames), max_side, label_height, gap)
+        zoom = min(zoom, 1.0)   # never upscale frames
+        cell = (math.ceil(frame_size[0] * zoom), math.ceil(frame_size[1] * zoom) + label_height)
+        canvas = Image.new("RGB", (cols * cell[0] + (cols - 1) * gap, rows * cell[1] + (rows - 1) * gap), (255, 255, 255))
+        for position, frame in enumerate(frames):
+            row, col = divmod(position, cols)
+            x, y = col * (cell[0] + gap), row * (cell[1] + gap)
+            with stage("resize"):
+                image = frame["image"].resize((max(1, round(frame["image"].width * zoom)),
+                                               max(1, round(frame["image"].height * zoom))), Image.LANCZOS)
+            with stage("merge"):
+                canvas.paste(image, (x + (cell[0] - image.width) // 2, y + label_height))
+                canvas.paste(self.rasterizer.label_tile(self.frame_label(frame), label_height), (x, y))
+        self.log.debug(f"Storyboard of {len(frames)} frames as {cols}x{rows}: {canvas.size}")
+        return self.encode_image(canvas)
+
+    @staticmethod
+    def frame_label(frame):
+        return f"f. {frame['index'] + 1}, {frame['time_ms'] / 1000:.2f}s"
+
+    def encode_image(self, image):
+        """
+        Encode an image once, in memory, in the output format.
+        Args:
+            image (PIL Image): Image to encode.
+        Returns:
+            bytes: Encoded image data.
+        """
+        buffer = io.BytesIO()
+        with stage("encode"):
+            image.save(buffer, self.output_format)
+        self.log.debug(f"Encoded {image.size} image to {buffer.tell()} bytes")
+        return buffer.getvalue()
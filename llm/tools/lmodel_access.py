@@ -1,5 +1,7 @@
-from langchain_openai import ChatOpenAI
-import streamlit as st
+from util.logger import get_logger
+from llm.tools.request_scheduler import RequestScheduler, ScheduledLLM
+from llm.tools.client_pool import ClientPool
+from llm.tools.response_cache import CachedLLM
 
 class LModelAccess:
     """
@@ -7,6 +9,9 @@ class LModelAccess:
     """
 
     
+    # Shared by every LModelAccess instance in the process, so clients survive Streamlit reruns and sessions
+    client_pool = ClientPool()
+
     model_repository = {
         "llama": [
             "meta-llama/llama-3.2-11b-vision-instruct",               #  Llama 3.2 11B Vision - Multi-modal 
@@ -16,21 +21,101 @@ class LModelAccess:
             "google/gemini-3-pro-preview"                             # Gemini 3.0 Pro Preview - Multi-modal
         ]
     }
+
+    # Image handling limits per model. Providers bill images per tile of the (resized) input:
+    # tokens = base_tokens + min(tiles, max_tiles) * tokens_per_tile. Larger images are downscaled
+    # by the provider to max_image_side, so sending more pixels only costs bytes.
+    # Routing attributes (see ModelRouter): input_price and output_price in USD per million tokens
+    # (OpenRouter list prices), quality rank (higher is better), max_images per request, max_pages a
+    # single image can hold legibly at max_image_side, and typical_latency_s until latencies are observed.
+    model_limits = {
+        "meta-llama/llama-3.2-11b-vision-instruct": {
+            "max_image_side": 1120,         # up to 2x2 tiles of 560px
+            "tile_size": 560,
+            "tokens_per_tile": 1601,        # 40x40 ViT-H/14 patches + CLS
+            "max_tiles": 4,
+            "base_tokens": 0,
+            "context_limit": 131072,
+            "requests_per_minute": 60,
+            "input_price": 0.049,
+            "output_price": 0.049,
+            "quality": 1,
+            "max_images": 1,           # one image per request
+            "max_pages": 2,
+            "typical_latency_s": 4.0,
+        },
+        "meta-llama/llama-4-maverick": {
+            "max_image_side": 1344,
+            "tile_size": 336,
+            "tokens_per_tile": 144,         # 24x24 patches, pixel-shuffled 4:1
+            "max_tiles": 16,
+            "base_tokens": 144,             # global thumbnail tile
+            "context_limit": 1048576,
+            "requests_per_minute": 60,
+            "input_price": 0.15,
+            "output_price": 0.6,
+            "quality": 2,
+            "max_images": 8,
+            "max_pages": 6,
+            "typical_latency_s": 6.0,
+        },
+        "google/gemini-3-pro-preview": {
+            "max_image_side": 3072,
+            "tile_size": 768,
+            "tokens_per_tile": 258,
+            "max_tiles": 16,
+            "base_tokens": 0,
+            "context_limit": 1048576,
+            "requests_per_minute": 30,
+            "input_price": 2.0,
+            "output_price": 12.0,
+            "quality": 3,
+            "max_images": 16,
+            "max_pages": 48,
+            "typical_latency_s": 15.0,      # includes reasoning
+        },
+    }
+    default_limits = {
+        "max_image_side": 1024,
+        "tile_size": 512,
+        "tokens_per_tile": 170,
+        "max_tiles": 4,
+        "base_tokens": 85,
+        "context_limit": 131072,
+        "requests_per_minute": 20,
+        "input_price": 1.0,
+        "output_price": 4.0,
+        "quality": 1,
+        "max_images": 1,
+        "max_pages": 1,
+        "typical_latency_s": 10.0,
+    }
    
 
-    def __init__(self, app_name, app_dns, api_key=None):
+    def __init__(self, app_name, app_dns, api_key=None, scheduler=None, api_base_url="https://openrouter.ai/api/v1",
+                 response_cache=None):
         """
         Initialize the LModelAccess class.
+
+        Args:
+            app_name (str): Application name, sent as the X-Title header.
+            app_dns (str): Application URL, sent as the HTTP-Referer header.
+            api_key (str): OpenRouter API key.
+            scheduler (RequestScheduler): Optional shared scheduler that get_llm routes requests through.
+            api_base_url (str): OpenAI-compatible endpoint. Default is OpenRouter.
+            response_cache (ResponseCache): Optional cache that get_llm serves repeated requests from.
         """
-        self.log = st.logger.get_logger(__name__)
+        self.log = get_logger(__name__)
         self.app_name = app_name
         self.app_dns = app_dns
-        self.api_base_url = "https://openrouter.ai/api/v1"
+        self.api_base_url = api_base_url
         self.log.debug("LModelAccess initialized for app: %s", self.app_name)
         if api_key is None:
             self.log.critical("OpenRouter API key was not provided!")
             raise ValueError("OpenRouter API key must be provided!")
         self.api_key = api_key
+        self.scheduler = scheduler
+        self.response_cache = response_cache
 
 
     
@@ -58,33 +143,134 @@ class LModelAccess:
         return models[index]
     
 
+    def get_model_limits(self, model_id):
+        """
+        Get the image handling limits for a model, falling back to conservative defaults.
+
+        Args:
+            model_id (str): The model Id.
+
+        Returns:
+            dict: max_image_side, tile_size, tokens_per_tile, max_tiles, base_tokens, context_limit,
+                  requests_per_minute and the routing attributes (prices, quality, max_images, max_pages,
+                  typical_latency_s).
+        """
+        if model_id not in self.model_limits:
+            self.log.warning(f"No limits registered for model '{model_id}'. Using defaults.")
+        return self.model_limits.get(model_id, self.default_limits)
+
+    def get_shared_limits(self, model_ids):
+        """
+        Get limits that satisfy every model in a group, so one prepared image can be sent to all of them.
+
+        Args:
+            model_ids (list): The model Ids.
+
+        Returns:
+            dict: Limits of the model with the smallest max image side, with the smallest context limit.
+        """
+        limits = [self.get_model_limits(model_id) for model_id in model_ids]
+        shared = dict(min(limits, key=lambda entry: entry["max_image_side"]))
+        shared["context_limit"] = min(entry["context_limit"] for entry in limits)
+        return shared
+
     def get_all_models(self):
         models = list()
         for key in self.model_repository:
             models.extend(self.get_model_by_provider(key))
         return models 
+
+    def get_fallback_models(self, model_id):
+        """
+        Get the models to fail over to for a model: the same provider's models first, then all others.
+
+        Args:
+            model_id (str): The model Id.
+
+        Returns:
+            list: Ordered model Ids, excluding model_id.
+        """
+        same_provider = next((ids for ids in self.model_repository.values() if model_id in ids), [])
+        ordered = list(same_provider) + [model for model in self.get_all_models() if model not in same_provider]
+        return [model for model in ordered if model != model_id]
+
+    def build_scheduler(self, failover=True, **options):
+        """
+        Build a RequestScheduler using this repository's rate limits and, optionally, failover order.
+
+        Args:
+            failover (bool): Fail over to other repository models once retries are exhausted. Default is True.
+            **options: Additional RequestScheduler options (max_concurrency, max_retries, on_result, ...).
+
+        Returns:
+            RequestScheduler: A new scheduler; share one instance per process.
+        """
+        models = self.get_all_models()
+        return RequestScheduler(
+            llm_factory=lambda model_name, temperature: self.create_llm(model_name, temperature, max_retries=0),
+            rate_limits={model: self.get_model_limits(model)["requests_per_minute"] for model in models},
+            default_rpm=self.default_limits["requests_per_minute"],
+            fallbacks={model: self.get_fallback_models(model) for model in models} if failover else None,
+            **options,
+        )
             
     
     def get_llm(self, model_name, temperature=0.0):
         """
-        Get the LLM instance for the specified model name.
+        Get the LLM instance for the specified model name. When a scheduler is configured, calls are
+        queued, rate limited and retried by it; when a response cache is configured, repeated requests
+        are answered from it.
 
         Args:
             model_name (str): The name of the model.
             temperature (float): The temperature for the model. Default is 0.0.
 
         Returns:
-            ChatOpenAI: An instance of the ChatOpenAI class.
+            ChatOpenAI, ScheduledLLM or CachedLLM: An object exposing invoke() and stream().
         """
-        llm = ChatOpenAI(
-            temperature=temperature,
-            openai_api_key=self.api_key,
-            openai_api_base=self.api_base_url,
-            model_name=model_name,
-            default_headers={
-                "X-Title": self.app_name,
-                "HTTP-Referer": self.app_dns
-            },
-        )
+        if self.scheduler is not None:
+            llm = ScheduledLLM(self.scheduler, model_name, temperature)
+        else:
+            llm = self.create_llm(model_name, temperature)
+        if self.response_cache is not None:
+            llm = CachedLLM(llm, self.response_cache, model_name, temperature)
         return llm
 
+    def create_llm(self, model_name, temperature=0.0, max_retries=2):
+        """
+        Get a ChatOpenAI client for the specified model name, bypassing any scheduler. Clients are pooled
+        process-wide and share keep-alive HTTP connections.
+
+        Args:
+            model_name (str): The name of the model.
+            temperature (float): The temperature for the model. Default is 0.0.
+            max_retries (int): Client-side retries. Default is 2.
+
+        Returns:
+            ChatOpenAI: An instance of the ChatOpenAI class.
+        """
+        headers = {
+            "X-Title": self.app_name,
+            "HTTP-Referer": self.app_dns
+        }
+        # async HTTP clients are bound to an event loop, so clients created on one are pooled per loop
+        loop = self.client_pool.current_loop()
+        key = (model_name, temperature, max_retries, self.api_base_url, self.api_key,
+               tuple(sorted(headers.items())), loop)
+
+        def create():
+            from langchain_openai import ChatOpenAI   # slow to import; deferred until the first request
+            self.log.debug(f"Creating ChatOpenAI client for {model_name}")
+            return ChatOpenAI(
+                temperature=temperature,
+                openai_api_key=self.api_key,
+                openai_api_base=self.api_base_url,
+                model_name=model_name,
+                max_retries=max_retries,
+                stream_usage=True,  # token usage arrives with the last streamed chunk
+                default_headers=headers,
+                http_client=self.client_pool.http_client,
+                http_async_client=self.client_pool.async_http_client(loop) if loop is not None else None,
+            )
+
+        return self.client_pool.get(key, create)
@@ -0,0 +1,57 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from util.logger import get_logger
+
+class ModelFanout:
+    """
+    ModelFanout sends one prepared prompt to several models concurrently and yields each result as
+    soon as it completes, with per-model latency, token usage and failure status.
+    """
+
+    def __init__(self, max_workers=8):
+        """
+        Initialize the ModelFanout class.
+        Args:
+            max_workers (int): Max concurrent model calls. Default is 8.
+        """
+        self.log = get_logger(__name__)
+        self.max_workers = max_workers
+
+    def _invoke(self, model_name, llm, messages):
+        start = time.perf_counter()
+        try:
+            response = llm.invoke(messages)
+            return {
+                "model": model_name,
+                "content": response.content,
+                "latency": time.perf_counter() - start,
+                "usage": getattr(response, "usage_metadata", None) or {},
+                "error": None,
+            }
+        except Exception as err:
+            self.log.error(f"{type(err)}: Error generating response from {model_name}: {err}")
+            return {
+                "model": model_name,
+                "content": None,
+                "latency": time.perf_counter() - start,
+                "usage": {},
+                "error": err,
+            }
+
+    def run(self, llms, messages):
+        """
+        Invoke every model with the same messages.
+        Args:
+            llms (dict): Model name -> ChatOpenAI instance.
+            messages (list): Prepared messages; the encoded payload is shared by all calls.
+        Yields:
+            dict: model, content, latency (s), usage (token counts) and error (None on success),
+                  in completion order.
+        """
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(llms)) or 1) as pool:
+            futures = [pool.submit(self._invoke, name, llm, messages) for name, llm in llms.items()]
+            for future in as_completed(futures):
+                result = future.result()
+                self.log.info(f"{result['model']}: {result['latency']:.2f}s, usage={result['usage']}, "
+                              f"error={type(result['error']).__name__ if result['error'] else None}")
+                yield result
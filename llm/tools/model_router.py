@@ -0,0 +1,160 @@
+import math, statistics, threading
+from collections import deque
+from util.logger import get_logger
+from llm.tools.token_budget import ImageBudgeter
+
+POLICIES = ("cheapest", "fastest", "quality")
+
+
+class ModelRouter:
+    """
+    ModelRouter picks the model for a request from the LModelAccess catalog. Models that cannot take the
+    request (pages per image, images per request, context) are ruled out; the others are ranked by the
+    estimated cost of the request, its expected latency or their quality within a cost budget. Latency
+    and error rates are learnt from the outcomes of past calls (see RequestScheduler on_result) over a
+    rolling window per model; until enough calls are seen, the catalog's typical latency is used.
+    """
+
+    def __init__(self, model_access, window=50, min_samples=5, max_error_rate=0.5, prompt_tokens=300,
+                 output_tokens=600, parallel_requests=4):
+        """
+        Initialize the ModelRouter class.
+        Args:
+            model_access (LModelAccess): Catalog of models, limits and prices.
+            window (int): Recent calls per model the statistics are computed over. Default is 50.
+            min_samples (int): Calls needed before observed statistics replace the catalog's. Default is 5.
+            max_error_rate (float): Models failing more often than this are avoided while others can serve. Default is 0.5.
+            prompt_tokens (int): Text tokens assumed per request (prompt and instructions). Default is 300.
+            output_tokens (int): Response tokens assumed per request. Default is 600.
+            parallel_requests (int): Requests of a multi-request question (page mode) run at once. Default is 4.
+        """
+        self.log = get_logger(__name__)
+        self.model_access = model_access
+        self.window = window
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+        self.parallel_requests = parallel_requests
+        self._lock = threading.Lock()
+        self._outcomes = {}   # model -> deque of (seconds, failed)
+
+    def record(self, model_name, seconds, error=None):
+        """
+        Record the outcome of a call. Matches the RequestScheduler on_result signature.
+        Args:
+            model_name (str): The model called.
+            seconds (float): Duration of the call.
+            error (Exception): The error, or None on success.
+        """
+        with self._lock:
+            outcomes = self._outcomes.setdefault(model_name, deque(maxlen=self.window))
+            outcomes.append((seconds, error is not None))
+
+    def model_stats(self, model_name):
+        """
+        Rolling statistics of a model.
+        Returns:
+            dict: samples, error_rate, latency_p50 and latency_p90 (seconds of successful calls, None without any).
+        """
+        with self._lock:
+            outcomes = list(self._outcomes.get(model_name, ()))
+        latencies = sorted(seconds for seconds, failed in outcomes if not failed)
+        return {
+            "samples": len(outcomes),
+            "error_rate": sum(failed for _, failed in outcomes) / len(outcomes) if outcomes else 0.0,
+            "latency_p50": statistics.median(latencies) if latencies else None,
+            "latency_p90": latencies[min(len(latencies) - 1, int(0.9 * len(latencies)))] if latencies else None,
+        }
+
+    def stats(self):
+        """
+        Snapshot of the rolling statistics of every model seen so far.
+        """
+        with self._lock:
+            models = list(self._outcomes)
+        return {model: self.model_stats(model) for model in models}
+
+    def estimate(self, model_name, request, text_tokens=0):
+        """
+        Estimate what a request costs on a model and whether the model can take it.
+        Args:
+            model_name (str): The model Id.
+            request (dict): Request description from VQAPipeline.describe.
+            text_tokens (int): Text tokens sent besides the images and prompt, e.g. conversation history. Default is 0.
+        Returns:
+            dict: model, eligible, reason (why not eligible), input_tokens, cost_usd (whole question),
+                  latency_s (expected, whole question), error_rate, quality and observed (whether the
+                  latency was learnt rather than taken from the catalog).
+        """
+        limits = self.model_access.get_model_limits(model_name)
+        side = limits["max_image_side"]
+        width, height = request["image_size"] or (side, side)
+        image_tokens = request["images"] * ImageBudgeter.estimate_image_tokens(width, height, limits)
+        input_tokens = image_tokens + self.prompt_tokens + text_tokens
+        requests = request["requests"]
+        cost = requests * (input_tokens * limits["input_price"] + self.output_tokens * limits["output_price"]) / 1e6
+
+        stats = self.model_stats(model_name)
+        observed = stats["samples"] >= self.min_samples and stats["latency_p50"] is not None
+        latency = stats["latency_p50"] if observed else limits["typical_latency_s"]
+        error_rate = stats["error_rate"] if stats["samples"] >= self.min_samples else 0.0
+        # failed calls are retried, so an unreliable model is slower on average; requests run in waves
+        latency = latency / max(0.05, 1 - error_rate) * math.ceil(requests / self.parallel_requests)
+
+        reason = None
+        if request["pages_per_image"] > limits["max_pages"]:
+            reason = f"{request['pages_per_image']} pages per image (max {limits['max_pages']})"
+        elif request["images"] > limits["max_images"]:
+            reason = f"{request['images']} images per request (max {limits['max_images']})"
+        elif input_tokens + self.output_tokens > limits["context_limit"]:
+            reason = f"~{input_tokens} input tokens exceed the context of {limits['context_limit']}"
+        return {"model": model_name, "eligible": reason is None, "reason": reason, "input_tokens": input_tokens,
+                "cost_usd": cost, "latency_s": latency, "error_rate": error_rate, "quality": limits["quality"],
+                "observed": observed}
+
+    def route(self, request, policy="cheapest", budget=None, candidates=None, text_tokens=0):
+        """
+        Choose the model for a request.
+        Args:
+            request (dict): Request description from VQAPipeline.describe.
+            policy (str): "cheapest" (lowest estimated cost), "fastest" (lowest expected latency) or "quality"
+                (best quality whose estimated cost is within budget, the cheapest when none is). Default is "cheapest".
+            budget (float): Max estimated cost in USD per question, for the "quality" policy. Default is None (no limit).
+            candidates (list): Model Ids to choose from. Default is every model in the catalog.
+            text_tokens (int): Text tokens sent besides the images and prompt. Default is 0.
+        Returns:
+            dict: model, policy, reason (why it was chosen) and estimates (one per candidate, see estimate()).
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown routing policy '{policy}'. Choose from {POLICIES}.")
+        candidates = candidates or self.model_access.get_all_models()
+        estimates = [self.estimate(model, request, text_tokens) for model in candidates]
+        eligible = [entry for entry in estimates if entry["eligible"]]
+        if not eligible:
+            # nothing fits: the largest model degrades most gracefully (its images are downscaled further)
+            chosen = max(estimates, key=lambda entry: (self.model_access.get_model_limits(entry["model"])["max_pages"],
+                                                       entry["quality"]))
+            reason = "no model fits the request; using the one with the most room"
+        else:
+            healthy = [entry for entry in eligible if entry["error_rate"] <= self.max_error_rate] or eligible
+            if policy == "cheapest":
+                chosen = min(healthy, key=lambda entry: (entry["cost_usd"], entry["latency_s"]))
+                reason = "lowest estimated cost"
+            elif policy == "fastest":
+                chosen = min(healthy, key=lambda entry: (entry["latency_s"], entry["cost_usd"]))
+                reason = "lowest expected latency" + ("" if chosen["observed"] else " (catalog estimate)")
+            else:
+                affordable = [entry for entry in healthy if budget is None or entry["cost_usd"] <= budget]
+                if affordable:
+                    chosen = max(affordable, key=lambda entry: (entry["quality"], -entry["cost_usd"]))
+                    reason = "best quality" + ("" if budget is None else f" within ${budget:g}")
+                else:
+                    chosen = min(healthy, key=lambda entry: entry["cost_usd"])
+                    reason = f"no model within ${budget:g}; lowest estimated cost"
+            skipped = len(eligible) - len(healthy)
+            if skipped:
+                reason += f", {skipped} model(s) skipped for errors"
+        self.log.info(f"Routed {request} to {chosen['model']} ({policy}: {reason}, ~${chosen['cost_usd']:.4f}, "
+                      f"~{chosen['latency_s']:.1f}s)")
+        return {"model": chosen["model"], "policy": policy, "reason": reason, "estimates": estimates}
@@ -0,0 +1,388 @@
+import math, mmap, multiprocessing, os, sys, tempfile, threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import closing, contextmanager
+from multiprocessing import shared_memory
+from util.logger import get_logger
+from util.lazy_import import lazy_import
+from PIL import Image, ImageDraw, ImageFont
+fitz = lazy_import("fitz")  # PyMuPDF, loaded on the first render
+from llm.tools.pipeline_metrics import stage
+
+# Per-worker document handle, opened once per shared-memory block by _render_worker_page
+_worker_doc = _worker_doc_name = None
+
+def _render_page(doc, index, zoom_x, zoom_y):
+    pix = doc[index].get_pixmap(matrix=fitz.Matrix(zoom_x, zoom_y), alpha=False)
+    return index, pix.width, pix.height, pix.samples
+
+def _render_worker_page(shm_name, size, index, zoom_x, zoom_y):
+    global _worker_doc, _worker_doc_name
+    if _worker_doc_name != shm_name:
+        if _worker_doc is not None:
+            _worker_doc.close()
+        shm = shared_memory.SharedMemory(name=shm_name)  # owned and unlinked by the parent
+        try:
+            _worker_doc = fitz.open(stream=bytes(shm.buf[:size]), filetype="pdf")
+        finally:
+            shm.close()
+        _worker_doc_name = shm_name
+    return _render_page(_worker_doc, index, zoom_x, zoom_y)
+
+
+class PdfRasterizer:
+    """
+    PdfRasterizer renders PDF pages straight into a preallocated output canvas. Pages are rendered
+    at the scale the final image needs (never above the requested DPI) rather than at full DPI and
+    downscaled afterwards. Large documents are rendered across a persistent process pool; the PDF bytes
+    are placed in shared memory once per conversion and each worker opens the document from there. Only
+    a bounded number of rendered pages is in flight at any time, so memory held besides the output canvas
+    does not grow with page count.
+    """
+
+    def __init__(self, max_workers=None, parallel_min_pages=4, max_in_flight=None, spill_threshold=None, spill_dir=None):
+        """
+        Initialize the PdfRasterizer class.
+        Args:
+            max_workers (int): Worker processes for parallel rendering. Default is the CPU count.
+            parallel_min_pages (int): Documents with fewer pages are rendered in-process. Default is 4.
+            max_in_flight (int): Max rendered pages waiting to be pasted. Default is 2 per worker.
+            spill_threshold (int): Canvas size (bytes) above which the canvas is kept on disk. Default is None (never).
+            spill_dir (str): Directory for spilled canvases. Default is the system temp directory.
+        """
+        self.log = get_logger(__name__)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.parallel_min_pages = parallel_min_pages
+        self.max_in_flight = max_in_flight or 2 * self.max_workers
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.log.debug(f"PdfRasterizer initialized (max_workers={self.max_workers})")
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # forkserver avoids forking a multi-threaded Streamlit server process; spawn elsewhere
+                if "forkserver" in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context("forkserver")
+                    context.set_forkserver_preload([__name__, "fitz"])
+                else:
+                    context = multiprocessing.get_context("spawn")
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            return self._pool
+
+    def close(self):
+        """
+        Shut down the worker pool. A new pool is started on the next parallel render.
+        """
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+    @staticmethod
+    def page_count(byte_obj):
+        """
+        Count the pages of a PDF without rendering them.
+        Args:
+            byte_obj (bytes): Byte object of the PDF file.
+        Returns:
+            int: Number of pages.
+        """
+        with stage("decode"), fitz.open(stream=byte_obj, filetype="pdf") as doc:
+            return doc.page_count
+
+    def render_page(self, byte_obj, index, size, dpi=200):
+        """
+        Render a single page stretched to an exact output size.
+        Args:
+            byte_obj (bytes): Byte object of the PDF file.
+            index (int): Zero-based page index.
+            size (tuple): Output (width, height) in pixels.
+            dpi (int): Max rendering resolution. Default is 200.
+        Returns:
+            PIL Image: RGB image of the requested size.
+        """
+        max_zoom = dpi / 72  # PyMuPDF default is 72 DPI
+        with stage("rasterize"), fitz.open(stream=byte_obj, filetype="pdf") as doc:
+            rect = doc[index].rect
+            zoom_x = min(size[0] / rect.width, max_zoom)
+            zoom_y = min(size[1] / rect.height, max_zoom)
+            _, width, height, samples = _render_page(doc, index, zoom_x, zoom_y)
+        image = Image.frombytes("RGB", (width, height), samples)
+        if image.size != tuple(size):
+            with stage("resize"):
+                image = image.resize(size)
+        return image
+
+    def render_region(self, byte_obj, index, max_side, dpi=200, clip=None):
+        """
+        Render a page, or a rectangle of it, keeping its aspect ratio within max_side.
+        Args:
+            byte_obj (bytes): Byte object of the PDF file.
+            index (int): Zero-based page index.
+            max_side (int): Max output width and height in pixels.
+            dpi (int): Max rendering resolution. Default is 200.
+            clip (tuple): (x0, y0, x1, y1) rectangle in points. Default is None (the whole page).
+        Returns:
+            PIL Image: RGB image of the page or region.
+        """
+        with stage("rasterize"), fitz.open(stream=byte_obj, filetype="pdf") as doc:
+            page = doc[index]
+            rect = page.rect if clip is None else fitz.Rect(clip) & page.rect
+            zoom = min(max_side / max(rect.width, rect.height), dpi / 72)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=rect, alpha=False)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+    @staticmethod
+    def page_previews(byte_obj, side=64):
+        """
+        Small grayscale renders and the text layer of every page, for cheap page comparisons.
+        Args:
+            byte_obj (bytes): Byte object of the PDF file.
+            side (int): Longest side of the previews in pixels. Default is 64.
+        Returns:
+            list: (PIL Image, text) per page.
+        """
+        previews = []
+        with stage("rasterize"), fitz.open(stream=byte_obj, filetype="pdf") as doc:
+            for page in doc:
+                zoom = side / max(page.rect.width, page.rect.height)
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+                previews.append((Image.frombytes("L", (pix.width, pix.height), pix.samples), page.get_text()))
+        return previews
+
+    @staticmethod
+    def page_sizes(byte_obj):
+        """
+        Page sizes of a PDF, in points, without rendering.
+        Args:
+            byte_obj (bytes): Byte object of the PDF file.
+        Returns:
+            list: (width, height) per page.
+        """
+        with stage("decode"), fitz.open(stream=byte_obj, filetype="pdf") as doc:
+            return [(page.rect.width, page.rect.height) for page in doc]
+
+    @staticmethod
+    def grid_layout(page_size, count, max_side, label_height=0, gap=4):
+        """
+        Choose the grid (contact sheet) that shows count pages as large as possible in a max_side square.
+        Args:
+            page_size (tuple): (width, height) of the largest page, in points.
+            count (int): Number of pages.
+            max_side (int): Max canvas width and height in pixels.
+            label_height (int): Pixels reserved above each page for its label. Default is 0.
+            gap (int): Pixels between cells. Default is 4.
+        Returns:
+            tuple: (columns, rows, zoom).
+        """
+        best = None
+        for cols in range(1, count + 1):
+            rows = math.ceil(count / cols)
+            # one pixel of slack per cell absorbs rounding of the rendered page size
+            zoom = min((max_side - (gap + 1) * cols) / (cols * page_size[0]),
+                       (max_side - (gap + 1 + label_height) * rows) / (rows * page_size[1]))
+            if best is None or zoom > best[2]:
+                best = (cols, rows, zoom)
+        return best
+
+    @contextmanager
+    def render_stacked(self, byte_obj, width, dpi=200, pages=None):
+        """
+        Render pages stacked vertically, scaled uniformly so the widest page spans the output width.
+        Canvases larger than spill_threshold bytes are backed by an anonymous temporary file instead of
+        heap memory; the file is released when the context exits.
+        Args:
+            byte_obj (bytes): Byte object of the PDF file.
+            width (int): Output width in pixels.
+            dpi (int): Max rendering resolution. Default is 200.
+            pages (list): Zero-based page indices to render, in order. Default is None (all pages).
+        Yields:
+            PIL Image: RGB (or file-backed RGBX) image of the pages.
+        """
+        with stage("decode"), fitz.open(stream=byte_obj, filetype="pdf") as doc:
+            indices = list(range(doc.page_count)) if pages is None else list(pages)
+            rects = [doc[index].rect for index in indices]
+        if not rects:
+            raise RuntimeError("No pages found in PDF.")
+
+        target_zoom = width / max(rect.width for rect in rects)
+        zoom = min(target_zoom, dpi / 72)
+        matrix = fitz.Matrix(zoom, zoom)
+        page_sizes = [(rect * matrix).irect for rect in rects]
+        offsets = {}
+        y_offset = 0
+        for index, irect in zip(indices, page_sizes):
+            offsets[index] = (0, y_offset)
+            y_offset += irect.height
+        size = (max(irect.width for irect in page_sizes), y_offset)
+        with self._compose(byte_obj, indices, zoom, size, offsets) as canvas:
+            yield self._fit_width(canvas, width, zoom < target_zoom)
+
+    @contextmanager
+    def render_tiled(self, byte_obj, max_side, dpi=200, pages=None, labels=True, gap=4):
+        """
+        Render pages as a grid (contact sheet) no larger than max_side in either dimension, choosing the
+        number of columns that gives each page the most pixels. Each page can carry a burned-in label.
+        Args:
+            byte_obj (bytes): Byte object of the PDF file.
+            max_side (int): Max output width and height in pixels (the model's max image side).
+            dpi (int): Max rendering resolution. Default is 200.
+            pages (list): Zero-based page indices to render, in order. Default is None (all pages).
+            labels (bool): Burn a "p. N" label above each page (when there is more than one). Default is True.
+            gap (int): Pixels between cells. Default is 4.
+        Yields:
+            PIL Image: RGB (or file-backed RGBX) image of the pages.
+        """
+        with stage("decode"), fitz.open(stream=byte_obj, filetype="pdf") as doc:
+            indices = list(range(doc.page_count)) if pages is None else list(pages)
+            rects = {index: doc[index].rect for index in indices}
+        if not rects:
+            raise RuntimeError("No pages found in PDF.")
+
+        labels = labels and len(indices) > 1   # a lone page needs no label
+        label_height = self.label_height(max_side) if labels else 0
+        page_size = (max(rect.width for rect in rects.values()), max(rect.height for rect in rects.values()))
+        cols, rows, zoom = self.grid_layout(page_size, len(indices), max_side, label_height, gap)
+        zoom = min(zoom, dpi / 72)
+        matrix = fitz.Matrix(zoom, zoom)
+        cell = (math.ceil(page_size[0] * zoom), math.ceil(page_size[1] * zoom) + label_height)
+        offsets = {}
+        for position, index in enumerate(indices):
+            irect = (rects[index] * matrix).irect
+            row, col = divmod(position, cols)
+            # pages are centred in their cell; the label sits right above the page
+            offsets[index] = (col * (cell[0] + gap) + (cell[0] - irect.width) // 2,
+                              row * (cell[1] + gap) + label_height + (cell[1] - label_height - irect.height) // 2)
+        size = (cols * cell[0] + (cols - 1) * gap, rows * cell[1] + (rows - 1) * gap)
+        canvas_labels = [(f"p. {index + 1}", offsets[index][0], offsets[index][1] - label_height)
+                         for index in indices] if labels else None
+        self.log.debug(f"Tiling {len(indices)} pages as {cols}x{rows} at zoom {zoom:.3f} into {size}")
+        with self._compose(byte_obj, indices, zoom, size, offsets, canvas_labels, label_height, background=255) as canvas:
+            yield canvas
+
+    @staticmethod
+    def label_height(max_side):
+        """
+        Height in pixels of the page label band for a canvas of the given max side.
+        """
+        return max(12, min(24, max_side // 60))
+
+    @contextmanager
+    def _compose(self, byte_obj, indices, zoom, size, offsets, labels=None, label_height=0, background=0):
+        """
+        Render pages and paste each at its (x, y) offset on a canvas of the given size, plus label tiles
+        at their (text, x, y) positions. Canvases larger than spill_threshold bytes are file-backed.
+        """
+        spill = self.spill_threshold is not None and size[0] * size[1] * 4 > self.spill_threshold
+        self.log.debug(f"Rendering {len(indices)} pages at zoom {zoom:.3f} into canvas {size} (spill={spill})")
+        label_tiles = [(self.label_tile(text, label_height), (x, y)) for text, x, y in labels or ()]
+        with closing(self._render_pages(byte_obj, indices, zoom)) as pages:
+            if not spill:
+                canvas = Image.new("RGB", size, (background,) * 3)
+                for index, page_width, page_height, samples in pages:
+                    with stage("merge"):
+                        canvas.paste(Image.frombytes("RGB", (page_width, page_height), samples), offsets[index])
+                for tile, offset in label_tiles:
+                    canvas.paste(tile, offset)
+                yield canvas
+                return
+
+            # Unnamed temporary file: the OS reclaims it even if the process dies mid-conversion
+            with tempfile.TemporaryFile(dir=self.spill_dir, suffix=".rgbx") as file:
+                file.truncate(size[0] * size[1] * 4)  # zero-filled: black background, as Image.new
+                buffer = mmap.mmap(file.fileno(), size[0] * size[1] * 4)
+                try:
+                    if background:
+                        buffer.write(bytes([background]) * len(buffer))
+                    for index, page_width, page_height, samples in pages:
+                        with stage("merge"):
+                            self._write_tile(buffer, size[0], Image.frombytes("RGB", (page_width, page_height), samples),
+                                             offsets[index])
+                    for tile, offset in label_tiles:
+                        self._write_tile(buffer, size[0], tile, offset)
+                    # RGBX is a mappable mode, so the image shares the file mapping without copying
+                    canvas = Image.frombuffer("RGBX", size, buffer, "raw", "RGBX", 0, 1)
+                    yield canvas
+                finally:
+                    canvas = None
+                    try:
+                        buffer.close()
+                    except BufferError:
+                        pass  # an image still references the mapping; it is unmapped once collected
+
+    @staticmethod
+    def _write_tile(buffer, canvas_width, image, offset):
+        """
+        Copy an RGB image into an RGBX canvas buffer at offset (x, y), row by row unless it spans the canvas.
+        """
+        if offset[0] + image.width > canvas_width:
+            image = image.crop((0, 0, canvas_width - offset[0], image.height))
+        data = image.convert("RGBX").tobytes()
+        row_bytes = canvas_width * 4
+        tile_row_bytes = image.width * 4
+        start = offset[1] * row_bytes + offset[0] * 4
+        if image.width == canvas_width:
+            buffer[start:start + len(data)] = data
+            return
+        for row in range(image.height):
+            buffer[start + row * row_bytes:start + row * row_bytes + tile_row_bytes] = \
+                data[row * tile_row_bytes:(row + 1) * tile_row_bytes]
+
+    @staticmethod
+    def label_tile(text, label_height):
+        """
+        A label (white text on a dark band) to paste above a tile of a contact sheet.
+        """
+        font = ImageFont.load_default(size=max(8, label_height - 4))
+        width = math.ceil(font.getlength(text)) + 6
+        tile = Image.new("RGB", (width, label_height), (32, 32, 32))
+        ImageDraw.Draw(tile).text((3, 1), text, fill=(255, 255, 255), font=font)
+        return tile
+
+    @staticmethod
+    def _fit_width(canvas, width, upscale):
+        if upscale:
+            # DPI cap was hit: upscale once to the requested width
+            with stage("resize"):
+                return canvas.resize((width, int(width / canvas.width * canvas.height)))
+        return canvas
+
+    def _render_pages(self, byte_obj, indices, zoom):
+        """
+        Yield rendered pages as (index, width, height, samples), in completion order.
+        """
+        if len(indices) < self.parallel_min_pages or self.max_workers < 2:
+            with fitz.open(stream=byte_obj, filetype="pdf") as doc:
+                for index in indices:
+                    with stage("rasterize"):
+                        page = _render_page(doc, index, zoom, zoom)
+                    yield page
+            return
+
+        shm = shared_memory.SharedMemory(create=True, size=len(byte_obj))
+        try:
+            shm.buf[:len(byte_obj)] = byte_obj
+            pool = self._get_pool()
+            pending = set()
+            queued = iter(indices)
+            remaining = len(indices)
+            try:
+                while remaining or pending:
+                    while remaining and len(pending) < self.max_in_flight:
+                        pending.add(pool.submit(_render_worker_page, shm.name, len(byte_obj), next(queued), zoom, zoom))
+                        remaining -= 1
+                    with stage("rasterize"):  # the consumer's merge time overlaps worker rendering
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                if not isinstance(sys.exc_info()[1], GeneratorExit):
+                    self.close()  # pool may be broken: start fresh next time
+                raise
+        finally:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,158 @@
+import statistics
+from util.logger import get_logger
+from util.lazy_import import lazy_import
+from llm.tools.pipeline_metrics import stage
+
+fitz = lazy_import("fitz")  # PyMuPDF, loaded on the first analysis
+
+
+class PdfTextLayer:
+    """
+    PdfTextLayer inspects the text layer of a PDF page by page. Text-dominant pages are returned as
+    extracted text with light Markdown layout hints (headings, lists, tables, figure placeholders), so
+    they can be sent as text instead of image tiles; figure-heavy or scanned pages are flagged for
+    rendering. Figures on text pages are returned as regions to be rendered on their own.
+    """
+
+    def __init__(self, min_text_chars=200, max_figure_ratio=0.35, min_region_ratio=0.04, tables=True):
+        """
+        Initialize the PdfTextLayer class.
+        Args:
+            min_text_chars (int): Characters of extractable text a page needs to be sent as text. Default is 200.
+            max_figure_ratio (float): Max share of the page area covered by figures on a text page. Default is 0.35.
+            min_region_ratio (float): Min share of the page area for a figure to be rendered as a region;
+                smaller figures (logos, rules, icons) are dropped. Default is 0.04.
+            tables (bool): Detect tables and emit them as Markdown tables. Default is True.
+        """
+        self.log = get_logger(__name__)
+        self.min_text_chars = min_text_chars
+        self.max_figure_ratio = max_figure_ratio
+        self.min_region_ratio = min_region_ratio
+        self.tables = tables
+
+    def analyze(self, byte_obj):
+        """
+        Classify every page of a PDF and extract the text of the text-dominant ones.
+        Args:
+            byte_obj (bytes): Byte object of the PDF file.
+        Returns:
+            list: One dict per page with page (1-based), kind ("text" or "image"), text (Markdown, text
+                  pages only), regions (figure rectangles in points, text pages only), text_chars and
+                  figure_ratio.
+        """
+        with stage("decode"), fitz.open(stream=byte_obj, filetype="pdf") as doc:
+            layouts = [self._analyze_page(page) for page in doc]
+        text_pages = sum(layout["kind"] == "text" for layout in layouts)
+        self.log.debug(f"Text layer: {text_pages} of {len(layouts)} pages are text-dominant")
+        return layouts
+
+    def _analyze_page(self, page):
+        area = abs(page.rect) or 1.0
+        content = page.get_text("dict")
+        drawings = page.get_drawings()
+        tables = self._tables(page, drawings)
+        # ruled tables are drawings too; they are sent as Markdown, not as figures
+        figures = [rect for rect in self._figure_rects(page, content, drawings)
+                   if not any(abs(rect & table_rect) > 0.5 * abs(rect) for table_rect, _ in tables)]
+        figure_ratio = min(1.0, sum(abs(rect) for rect in figures) / area)
+        text_blocks = [block for block in content["blocks"] if block["type"] == 0]
+        text_chars = sum(len(span["text"].strip()) for block in text_blocks
+                         for line in block["lines"] for span in line["spans"])
+        layout = {"page": page.number + 1, "kind": "image", "text": None, "regions": [],
+                  "text_chars": text_chars, "figure_ratio": round(figure_ratio, 3)}
+        if text_chars < self.min_text_chars or figure_ratio > self.max_figure_ratio:
+            return layout
+        regions = [rect for rect in figures if abs(rect) >= self.min_region_ratio * area]
+        layout.update(kind="text", regions=[tuple(round(value, 1) for value in rect) for rect in regions],
+                      text=self._page_markdown(page, text_blocks, regions, tables))
+        return layout
+
+    @staticmethod
+    def _figure_rects(page, content, drawings, gap=12):
+        """
+        Rectangles of embedded images and of vector drawings (charts, diagrams), merged where they are
+        less than gap points apart (e.g. the bars of one chart) and clipped to the page.
+        """
+        rects = [fitz.Rect(block["bbox"]) for block in content["blocks"] if block["type"] == 1]
+        rects += [fitz.Rect(drawing["rect"]) for drawing in drawings]
+        # lines have an empty (zero-area) rectangle but still join the shapes they touch
+        merged = [rect & page.rect for rect in rects]
+        merged = [rect for rect in merged if rect.is_valid and (rect.width or rect.height)]
+        changed = True
+        while changed:   # a shape can bridge two clusters, so merge until stable
+            changed = False
+            clusters = []
+            for rect in merged:
+                grown = fitz.Rect(rect.x0 - gap, rect.y0 - gap, rect.x1 + gap, rect.y1 + gap)
+                for index, other in enumerate(clusters):
+                    if grown.intersects(other):
+                        clusters[index] = other | rect
+                        changed = True
+                        break
+                else:
+                    clusters.append(rect)
+            merged = clusters
+        # drop thin shapes: rules, underlines and page borders are not figures
+        return [rect for rect in merged if rect.width > 8 and rect.height > 8 and abs(rect) < 0.9 * abs(page.rect)]
+
+    def _tables(self, page, drawings):
+        """
+        Detected tables as (rectangle, Markdown) pairs. Detection is best effort.
+        """
+        # table detection is expensive; only pages with straight lines or boxes can hold a ruled table
+        if not self.tables or not any(item[0] in ("l", "re") for drawing in drawings for item in drawing["items"]):
+            return []
+        # newer PyMuPDF prints an install hint to stdout on the first table search
+        if hasattr(fitz, "no_recommend_layout"):
+            fitz.no_recommend_layout()
+        try:
+            return [(fitz.Rect(table.bbox), table.to_markdown().strip()) for table in page.find_tables().tables]
+        except Exception as err:
+            self.log.debug(f"Table detection failed on page {page.number + 1}: {err}")
+            return []
+
+    def _page_markdown(self, page, text_blocks, regions, tables):
+        """
+        Page text in reading order as Markdown: larger fonts become headings, detected tables become
+        Markdown tables and figures become numbered placeholders matching the rendered regions.
+        """
+        sizes = [span["size"] for block in text_blocks for line in block["lines"] for span in line["spans"]
+                 if span["text"].strip()]
+        body_size = statistics.median(sizes) if sizes else 0
+
+        items = []   # (y, x, markdown)
+        for rect, markdown in tables:
+            items.append((rect.y0, rect.x0, markdown))
+        for number, rect in enumerate(regions, start=1):
+            items.append((rect.y0, rect.x0, f"[Figure {number} on page {page.number + 1}: shown as an image]"))
+        for block in text_blocks:
+            rect = fitz.Rect(block["bbox"])
+            if any(rect.intersects(table_rect) for table_rect, _ in tables):
+                continue
+            if any(rect in region for region in regions):
+                continue   # labels inside a chart are read from the figure image
+            text = self._block_markdown(block, body_size)
+            if text:
+                items.append((rect.y0, rect.x0, text))
+        # top-to-bottom, then left-to-right; blocks on one line (e.g. table-like rows) stay together
+        items.sort(key=lambda item: (round(item[0] / 4), item[1]))
+        return "\n\n".join(item[2] for item in items)
+
+    @staticmethod
+    def _block_markdown(block, body_size):
+        lines = []
+        for line in block["lines"]:
+            text = "".join(span["text"] for span in line["spans"]).strip()
+            if text:
+                lines.append(text)
+        if not lines:
+            return ""
+        spans = [span for line in block["lines"] for span in line["spans"] if span["text"].strip()]
+        size = max(span["size"] for span in spans)
+        bold = all(span["flags"] & 16 for span in spans)   # bit 4: bold
+        text = " ".join(lines)
+        if body_size and len(text) < 120 and (size >= body_size * 1.5 or (size >= body_size * 1.15 and bold)):
+            return ("# " if size >= body_size * 1.8 else "## ") + text
+        if any(line[:1] in "•‣◦▪-*" or line[:2].rstrip(".)").isdigit() for line in lines[1:]):
+            return "\n".join(lines)   # keep list items on their own lines
+        return text
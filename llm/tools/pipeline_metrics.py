@@ -0,0 +1,304 @@
+import contextvars, json, os, sys, tempfile, threading, time, uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from util.logger import get_logger
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Stage names, in pipeline order; traces list their stages in this order
+STAGES = ("convert", "decode", "rasterize", "merge", "resize", "encode", "base64", "network", "model")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTE_BUCKETS = tuple(2 ** exponent for exponent in range(14, 27, 2))   # 16 KiB .. 64 MiB
+
+# Trace of the request being prepared on this thread (or task); stage() and annotate() are no-ops without one
+_current_trace = contextvars.ContextVar("pipeline_trace", default=None)
+
+
+def peak_rss_bytes():
+    """
+    High-water mark of this process's resident memory, or None where it is unavailable.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024   # bytes on macOS, KiB elsewhere
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a pipeline stage against the active trace. Stages repeated within one request (e.g. per page) add up.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
+
+
+def add_stage(name, seconds):
+    """
+    Record a stage measured elsewhere against the active trace, if any.
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_stage(name, seconds)
+
+
+def annotate(**fields):
+    """
+    Attach fields (page counts, image sizes...) to the active trace, if any.
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.annotate(**fields)
+
+
+class RequestTrace:
+    """
+    Stage timings and resource figures of one pipeline run (an upload preparation or a model request).
+    """
+
+    def __init__(self, metrics, kind, **fields):
+        self.metrics = metrics
+        self.kind = kind
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.fields = dict(fields)
+        self.stages = {}
+        self.active = []    # stages currently running, innermost last
+        self.started = time.perf_counter()
+        self.finished = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        self.active.append(name)
+        try:
+            yield
+        finally:
+            self.active.remove(name)
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        """
+        Record a stage measured elsewhere (e.g. streamed network and generation time).
+        """
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def annotate(self, **fields):
+        with self._lock:
+            self.fields.update(fields)
+
+    @contextmanager
+    def activate(self):
+        """
+        Make this the active trace for stage() and annotate() calls on the current thread.
+        """
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    @staticmethod
+    def _stage_order(name):
+        return STAGES.index(name) if name in STAGES else len(STAGES)
+
+    def finish(self, error=None):
+        """
+        Close the trace: log it as one JSON line and add it to the metrics. Later calls are ignored.
+        Args:
+            error (Exception): The error the run failed with. Default is None.
+        Returns:
+            dict: The trace record.
+        """
+        with self._lock:
+            if self.finished:
+                return None
+            self.finished = True
+            record = {
+                "event": "pipeline_trace",
+                "trace_id": self.trace_id,
+                "kind": self.kind,
+                "status": "ok" if error is None else "error",
+                "total_s": round(time.perf_counter() - self.started, 6),
+                "stages_s": {name: round(self.stages[name], 6) for name in sorted(self.stages, key=self._stage_order)},
+                "peak_rss_bytes": peak_rss_bytes(),
+                **self.fields,
+            }
+        if error is not None:
+            record["error"] = type(error).__name__
+        self.metrics.observe(record)
+        return record
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class PipelineMetrics:
+    """
+    PipelineMetrics aggregates request traces into per-stage latency histograms, payload size histograms,
+    token counters and a peak memory gauge. Every trace is also logged as a structured JSON line. The
+    aggregates are exported in the Prometheus text format, to a file (for a node-exporter textfile
+    collector) and/or over HTTP.
+    """
+
+    def __init__(self, prefix="vqa", log_json=True, prometheus_path=None):
+        """
+        Initialize the PipelineMetrics class.
+        Args:
+            prefix (str): Metric name prefix. Default is "vqa".
+            log_json (bool): Log each finished trace as a JSON line. Default is True.
+            prometheus_path (str): File rewritten with the Prometheus text after every trace. Default is None.
+        """
+        self.log = get_logger(__name__)
+        self.prefix = prefix
+        self.log_json = log_json
+        self.prometheus_path = prometheus_path
+        self._lock = threading.Lock()
+        self._stage_seconds = {}    # (kind, stage) -> _Histogram
+        self._payload_bytes = {}    # kind -> _Histogram
+        self._runs = {}             # (kind, status) -> count
+        self._tokens = {}           # direction -> count
+        self._pages = 0
+        self._peak_rss = 0
+        self._server = None
+
+    def trace(self, kind, **fields):
+        """
+        Start a trace.
+        Args:
+            kind (str): What is traced, e.g. "prepare" or "request".
+            **fields: Initial fields, e.g. session_id or model.
+        Returns:
+            RequestTrace: The new trace; call finish() when the run ends.
+        """
+        return RequestTrace(self, kind, **fields)
+
+    def observe(self, record):
+        """
+        Add a finished trace record to the aggregates and export it.
+        """
+        if self.log_json:
+            self.log.info(json.dumps(record, default=str))
+        kind = record["kind"]
+        usage = record.get("usage") or {}
+        with self._lock:
+            self._runs[(kind, record["status"])] = self._runs.get((kind, record["status"]), 0) + 1
+            for name, seconds in record["stages_s"].items():
+                self._stage_seconds.setdefault((kind, name), _Histogram(LATENCY_BUCKETS)).observe(seconds)
+            if record.get("payload_bytes") is not None:
+                self._payload_bytes.setdefault(kind, _Histogram(BYTE_BUCKETS)).observe(record["payload_bytes"])
+            for direction in ("input_tokens", "output_tokens"):
+                if usage.get(direction):
+                    self._tokens[direction] = self._tokens.get(direction, 0) + usage[direction]
+            self._pages += record.get("pages") or 0
+            self._peak_rss = max(self._peak_rss, record.get("peak_rss_bytes") or 0)
+        if self.prometheus_path:
+            try:
+                self.write_prometheus(self.prometheus_path)
+            except OSError as err:
+                self.log.warning(f"Failed to write metrics file {self.prometheus_path}: {err}")
+
+    def render_prometheus(self):
+        """
+        Render the aggregates in the Prometheus text exposition format.
+        Returns:
+            str: The metrics text.
+        """
+        name = self.prefix
+        lines = []
+        with self._lock:
+            lines += [f"# HELP {name}_stage_seconds Time spent per pipeline stage and run.",
+                      f"# TYPE {name}_stage_seconds histogram"]
+            for (kind, stage_name), histogram in sorted(self._stage_seconds.items()):
+                lines += self._histogram_lines(f"{name}_stage_seconds", f'kind="{kind}",stage="{stage_name}"', histogram)
+            lines += [f"# HELP {name}_payload_bytes Encoded image payload size per run.",
+                      f"# TYPE {name}_payload_bytes histogram"]
+            for kind, histogram in sorted(self._payload_bytes.items()):
+                lines += self._histogram_lines(f"{name}_payload_bytes", f'kind="{kind}"', histogram)
+            lines += [f"# HELP {name}_runs_total Finished pipeline runs.", f"# TYPE {name}_runs_total counter"]
+            lines += [f'{name}_runs_total{{kind="{kind}",status="{status}"}} {count}'
+                      for (kind, status), count in sorted(self._runs.items())]
+            lines += [f"# HELP {name}_tokens_total Model tokens reported by the provider.",
+                      f"# TYPE {name}_tokens_total counter"]
+            lines += [f'{name}_tokens_total{{direction="{direction.split("_")[0]}"}} {count}'
+                      for direction, count in sorted(self._tokens.items())]
+            lines += [f"# HELP {name}_pages_total Document pages rasterized.", f"# TYPE {name}_pages_total counter",
+                      f"{name}_pages_total {self._pages}",
+                      f"# HELP {name}_peak_rss_bytes Process resident memory high-water mark.",
+                      f"# TYPE {name}_peak_rss_bytes gauge",
+                      f"{name}_peak_rss_bytes {self._peak_rss}"]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _histogram_lines(metric, labels, histogram):
+        lines = [f'{metric}_bucket{{{labels},le="{bound:g}"}} {count}'
+                 for bound, count in zip(histogram.buckets, histogram.counts)]
+        lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f"{metric}_sum{{{labels}}} {histogram.sum:.6f}")
+        lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+        return lines
+
+    def write_prometheus(self, path):
+        """
+        Atomically rewrite a metrics file with the Prometheus text.
+        Args:
+            path (str): Output file path.
+        """
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as file:
+            file.write(self.render_prometheus())
+        os.replace(file.name, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serve the Prometheus text at /metrics from a background thread. Repeated calls return the running server.
+        Args:
+            port (int): Port to listen on (0 picks a free port).
+            host (str): Bind address. Default is 127.0.0.1.
+        Returns:
+            ThreadingHTTPServer: The running server.
+        """
+        if self._server is not None:
+            return self._server
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        self.log.info(f"Serving pipeline metrics on http://{host}:{self._server.server_address[1]}/metrics")
+        return self._server
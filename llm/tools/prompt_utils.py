@@ -1,13 +1,15 @@
 import base64
-import streamlit as st
+from util.logger import get_logger
 from langchain_core.messages import HumanMessage
 from langchain_core.messages.utils import count_tokens_approximately
+from llm.tools.pipeline_metrics import stage
 
 class PromptUtils:
     """
     Utility class for handling prompt templates.
     """
-    log = st.logger.get_logger(__name__)
+    log = get_logger(__name__)
+    NOT_FOUND = "NOT_FOUND"   # page-level answer when a page holds nothing relevant
 
 
     @staticmethod
@@ -22,39 +24,47 @@ class PromptUtils:
             str: Base64-encoded string of the image, or None if an error occurs.
         """    
         try:
-            return base64.b64encode(image_byte_data).decode("utf-8")
+            with stage("base64"):
+                return base64.b64encode(image_byte_data).decode("utf-8")
         except Exception as e:
             PromptUtils.log.critical(f"Error base64 encoding image data: {e}")
             return None
     
     @staticmethod 
-    def assess_token_count(message):
+    def assess_token_count(message, image_tokens=0):
         """
-        Checks the token count of a message.
+        Checks the token count of a message. Only text blocks are counted approximately; image
+        blocks are billed per tile by the provider, so their cost is passed in (see ImageBudgeter).
 
         Args:
             message (HumanMessage): The message to check.
+            image_tokens (int): Estimated image tokens for the message. Default is 0.
 
         Returns:
             int: The token count of the message.
         """
         try:
-            token_count = count_tokens_approximately([message])
-            estimated_bytes = token_count * 4 # Estimate 1 token = 4 chars
-            estimated_kb = estimated_bytes / 1024
-            PromptUtils.log.info(f"Prompt token count: {token_count}")
-            PromptUtils.log.info(f"Estimated prompt size: {estimated_kb:.2f} KB")
+            content = message.content
+            if isinstance(content, list):
+                content = [block for block in content if not (isinstance(block, dict) and block.get("type") == "image")]
+            text_tokens = count_tokens_approximately([HumanMessage(content=content)])
+            token_count = text_tokens + image_tokens
+            PromptUtils.log.info(f"Prompt token count: {token_count} (text: {text_tokens}, image: {image_tokens})")
+            return token_count
         except Exception as e:
-            PromptUtils.log.inform(f"Error checking token count: {e}")
+            PromptUtils.log.info(f"Error checking token count: {e}")
     
     @staticmethod    
-    def get_zshot_prompt(image_byte_data, user_prompt, mime_type="image/jpeg"):
+    def get_zshot_prompt(image_byte_data, user_prompt, mime_type="image/jpeg", image_tokens=0, encoded_image=None):
         """
         Creates a prompt for performing VQA on a single image.
 
         Args:
             image_byte_data (byte): byte object of image.
             user_prompt (str): User prompt.
+            mime_type (str): Mime type of the image.
+            image_tokens (int): Estimated image tokens, used for token count logging.
+            encoded_image (str): Base64 of image_byte_data when already encoded (e.g. at upload). Default is None.
 
         Returns:
             dict or None: The user message dictionary, or None if image encoding fails.
@@ -67,7 +77,7 @@ class PromptUtils:
                     {
                         "type": "image",
                         "source_type": "base64",
-                        "data": PromptUtils.encode_image(image_byte_data),
+                        "data": encoded_image or PromptUtils.encode_image(image_byte_data),
                         "mime_type": mime_type,
                     },
                 ],
@@ -75,5 +85,181 @@ class PromptUtils:
         except Exception as e:
             PromptUtils.log.critical(f"Error creating zero-shot prompt: {e}")
             raise RuntimeError(f"Failed to create zero-shot prompt. Please check the image content and try again! Exception: {e}")
+        PromptUtils.assess_token_count(message, image_tokens)
+        return message
+    
+    @staticmethod
+    def get_multi_image_prompt(images, user_prompt):
+        """
+        Creates a prompt for performing VQA on a document split across several page images.
+
+        Args:
+            images (list): (image_byte_data, mime_type, first_page, last_page, image_tokens, encoded_image) per
+                image, in page order; encoded_image may be None.
+            user_prompt (str): User prompt.
+
+        Returns:
+            HumanMessage: The user message with one image block per page image.
+        """
+        try:
+            shown = "; ".join(f"image {number} shows pages {first}-{last}" if first != last else f"image {number} shows page {first}"
+                              for number, (_, _, first, last, _, _) in enumerate(images, start=1))
+            prompt = (f"You are a helpful AI assistant that analyzes images and provides detailed responses. "
+                      f"The document is split across {len(images)} images, in page order ({shown}); each page "
+                      f"is labelled with its page number. {user_prompt}")
+            content = [{"type": "text", "text": prompt}]
+            for image_byte_data, mime_type, _, _, _, encoded_image in images:
+                content.append({
+                    "type": "image",
+                    "source_type": "base64",
+                    "data": encoded_image or PromptUtils.encode_image(image_byte_data),
+                    "mime_type": mime_type,
+                })
+            message = HumanMessage(content=content)
+        except Exception as e:
+            PromptUtils.log.critical(f"Error creating multi-image prompt: {e}")
+            raise RuntimeError(f"Failed to create multi-image prompt. Please check the image content and try again! Exception: {e}")
+        PromptUtils.assess_token_count(message, sum(image[4] for image in images))
+        return message
+
+    @staticmethod
+    def get_frames_prompt(images, frame_total, user_prompt):
+        """
+        Creates a prompt for performing VQA on frames sampled from an animation: either one storyboard
+        image holding all sampled frames, or one image per frame.
+
+        Args:
+            images (list): (image_byte_data, mime_type, frame_labels, image_tokens, encoded_image) per image, in
+                frame order; frame_labels lists the labels ("f. N, T s") of the frames the image shows.
+            frame_total (int): Number of frames in the animation.
+            user_prompt (str): User prompt.
+
+        Returns:
+            HumanMessage: The user message with the frame images.
+        """
+        try:
+            sampled = sum(len(image[2]) for image in images)
+            if len(images) == 1:
+                shown = (f"The image is a storyboard of {sampled} frames sampled from a {frame_total}-frame "
+                         f"animation, in playback order; each frame is labelled with its frame number and start time.")
+            else:
+                shown = (f"The {len(images)} images are frames sampled from a {frame_total}-frame animation, in "
+                         f"playback order ({'; '.join(f'image {number}: {image[2][0]}' for number, image in enumerate(images, start=1))}).")
+            prompt = (f"You are a helpful AI assistant that analyzes images and provides detailed responses. "
+                      f"{shown} {user_prompt}")
+            content = [{"type": "text", "text": prompt}]
+            for image_byte_data, mime_type, _, _, encoded_image in images:
+                content.append({
+                    "type": "image",
+                    "source_type": "base64",
+                    "data": encoded_image or PromptUtils.encode_image(image_byte_data),
+                    "mime_type": mime_type,
+                })
+            message = HumanMessage(content=content)
+        except Exception as e:
+            PromptUtils.log.critical(f"Error creating frames prompt: {e}")
+            raise RuntimeError(f"Failed to create frames prompt. Please check the image content and try again! Exception: {e}")
+        PromptUtils.assess_token_count(message, sum(image[3] for image in images))
+        return message
+
+    @staticmethod
+    def get_hybrid_prompt(parts, user_prompt):
+        """
+        Creates a prompt for performing VQA on a document sent as a mix of extracted page text and images:
+        text-dominant pages as text, figure-heavy pages and figures as images, in page order.
+
+        Args:
+            parts (list): In page order, ("text", page, text) for text pages and
+                ("image", page, figure, image_byte_data, mime_type, image_tokens, encoded_image) for images,
+                where figure is the figure number on a text page, or None for a whole page.
+            user_prompt (str): User prompt.
+
+        Returns:
+            HumanMessage: The user message with text and image blocks interleaved in page order.
+        """
+        try:
+            pages = len({part[1] for part in parts})
+            prompt = (f"You are a helpful AI assistant that analyzes documents and provides detailed responses. "
+                      f"Below are the {pages} pages of a document in page order. Pages that are mostly text are "
+                      f"given as extracted text, with Markdown headings, lists and tables approximating the "
+                      f"layout; pages that are mostly figures, and the figures on text pages, are given as "
+                      f"images. Cite page numbers where relevant.")
+            content = [{"type": "text", "text": prompt}]
+            for part in parts:
+                if part[0] == "text":
+                    _, page, text = part
+                    block = f"--- Page {page} ---\n{text}"
+                    if content[-1]["type"] == "text":
+                        content[-1]["text"] += "\n\n" + block   # merge consecutive text pages into one block
+                    else:
+                        content.append({"type": "text", "text": block})
+                    continue
+                _, page, figure, image_byte_data, mime_type, _, encoded_image = part
+                caption = f"--- Page {page} (image) ---" if figure is None else f"Figure {figure} on page {page}:"
+                if content[-1]["type"] == "text":
+                    content[-1]["text"] += "\n\n" + caption
+                else:
+                    content.append({"type": "text", "text": caption})
+                content.append({
+                    "type": "image",
+                    "source_type": "base64",
+                    "data": encoded_image or PromptUtils.encode_image(image_byte_data),
+                    "mime_type": mime_type,
+                })
+            content.append({"type": "text", "text": f"Question: {user_prompt}"})
+            message = HumanMessage(content=content)
+        except Exception as e:
+            PromptUtils.log.critical(f"Error creating hybrid prompt: {e}")
+            raise RuntimeError(f"Failed to create hybrid prompt. Please check the document content and try again! Exception: {e}")
+        PromptUtils.assess_token_count(message, sum(part[5] for part in parts if part[0] == "image"))
+        return message
+
+    @staticmethod
+    def get_page_prompt(image_byte_data, user_prompt, first_page, last_page, total_pages, mime_type="image/jpeg", image_tokens=0):
+        """
+        Creates a prompt for answering a question from one group of pages of a larger document (map step).
+
+        Args:
+            image_byte_data (byte): byte object of the page image.
+            user_prompt (str): User prompt.
+            first_page (int): First page shown in the image (1-based).
+            last_page (int): Last page shown in the image (1-based).
+            total_pages (int): Number of pages in the document.
+            mime_type (str): Mime type of the image.
+            image_tokens (int): Estimated image tokens, used for token count logging.
+
+        Returns:
+            HumanMessage: The page-level user message.
+        """
+        pages = f"page {first_page}" if first_page == last_page else f"pages {first_page}-{last_page}"
+        page_prompt = (f"The image shows {pages} of a {total_pages}-page document. Answer the question below "
+                       f"using only what is visible on {pages}. If nothing there is relevant, reply exactly "
+                       f"{PromptUtils.NOT_FOUND}.\nQuestion: {user_prompt}")
+        return PromptUtils.get_zshot_prompt(image_byte_data, page_prompt, mime_type, image_tokens)
+
+    @staticmethod
+    def get_reduce_prompt(user_prompt, page_answers):
+        """
+        Creates a text-only prompt combining page-level answers into one cited answer (reduce step).
+
+        Args:
+            user_prompt (str): User prompt.
+            page_answers (list): (first_page, last_page, answer) tuples, in page order.
+
+        Returns:
+            HumanMessage: The reduce user message.
+        """
+        findings = "\n\n".join(
+            f"[p. {first}]: {answer}" if first == last else f"[pp. {first}-{last}]: {answer}"
+            for first, last, answer in page_answers
+            if answer and answer.strip() != PromptUtils.NOT_FOUND
+        )
+        if not findings:
+            findings = "(No page contained relevant information.)"
+        prompt = ("You are a helpful AI assistant. Below are notes extracted separately from the pages of one "
+                  "document. Combine them into a single, consistent answer to the question. Cite the pages "
+                  "supporting each point, e.g. (p. 3) or (pp. 4-5), and do not invent content that is not in "
+                  f"the notes.\n\nQuestion: {user_prompt}\n\nNotes:\n{findings}")
+        message = HumanMessage(content=prompt)
         PromptUtils.assess_token_count(message)
-        return message
\ No newline at end of file
+        return message
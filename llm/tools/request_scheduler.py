@@ -0,0 +1,328 @@
+import asyncio, queue, random, threading, time
+from util.logger import get_logger
+
+RETRYABLE_ERRORS = {"RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError"}
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter: refills at rate tokens per second up to capacity.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:  # FIFO: waiters are served in arrival order
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RequestScheduler:
+    """
+    Process-wide scheduler for model requests. All sessions submit to one asyncio event loop running in a
+    background thread, which enforces per-model token-bucket rate limits and a global concurrency cap,
+    retries rate-limit (429), server (5xx) and connection errors with jittered exponential backoff, and
+    can fail over to other models once retries are exhausted.
+    """
+
+    def __init__(self, llm_factory, rate_limits=None, default_rpm=60, max_concurrency=16,
+                 max_retries=3, backoff_base=1.0, backoff_cap=30.0, fallbacks=None, on_result=None):
+        """
+        Initialize the RequestScheduler class.
+        Args:
+            llm_factory (callable): (model_name, temperature) -> ChatOpenAI, with client-side retries disabled.
+            rate_limits (dict): Model name -> requests per minute. Default is None (default_rpm for all).
+            default_rpm (int): Requests per minute for models without an explicit limit. Default is 60.
+            max_concurrency (int): Max requests in flight across all models. Default is 16.
+            max_retries (int): Retries per model before failing over. Default is 3.
+            backoff_base (float): Base backoff delay in seconds. Default is 1.0.
+            backoff_cap (float): Max backoff delay in seconds. Default is 30.0.
+            fallbacks (dict): Model name -> ordered list of models to fail over to. Default is None (no failover).
+            on_result (callable): Called with (model_name, seconds, error) after every attempt, error being None
+                on success, e.g. ModelRouter.record. Default is None.
+        """
+        self.log = get_logger(__name__)
+        self.llm_factory = llm_factory
+        self.rate_limits = rate_limits or {}
+        self.default_rpm = default_rpm
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.fallbacks = fallbacks or {}
+        self.on_result = on_result
+        self._buckets = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "queued": 0,
+            "in_flight": 0,
+            "retries": 0,
+            "failovers": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "models": {},
+        }
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self._thread = threading.Thread(target=self._run_loop, name="request-scheduler", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._init_loop_state(), self._loop).result()
+        self.log.debug(f"RequestScheduler started (max_concurrency={max_concurrency})")
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _init_loop_state(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def _bucket(self, model_name):
+        # only called on the scheduler loop, so no locking needed
+        if model_name not in self._buckets:
+            rpm = self.rate_limits.get(model_name, self.default_rpm)
+            self._buckets[model_name] = TokenBucket(rpm / 60, max(1.0, rpm / 10))
+        return self._buckets[model_name]
+
+    def _count(self, model_name, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+            model = self._stats["models"].setdefault(model_name, {"requests": 0, "retries": 0, "errors": 0})
+            if key in ("submitted", "retries"):
+                model["requests" if key == "submitted" else "retries"] += amount
+            elif key == "failed":
+                model["errors"] += amount
+
+    @staticmethod
+    def is_retryable(err):
+        """
+        Whether an error is worth retrying: rate limits, 5xx responses, timeouts and connection failures.
+        """
+        status = getattr(err, "status_code", None)
+        return type(err).__name__ in RETRYABLE_ERRORS or status == 429 or (status is not None and status >= 500)
+
+    def _backoff(self, err, attempt):
+        # honour Retry-After when the provider sends one, otherwise full-jitter exponential backoff
+        response = getattr(err, "response", None)
+        retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+        try:
+            if retry_after is not None:
+                return min(self.backoff_cap, float(retry_after))
+        except ValueError:
+            pass
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def _run(self, model_name, temperature, call, started):
+        """
+        Run call(llm) against model_name and its fallbacks, with rate limiting, concurrency cap and retries.
+        started() is invoked once, when the first attempt leaves the queue.
+        """
+        candidates = [model_name] + [model for model in self.fallbacks.get(model_name, []) if model != model_name]
+        last_error = None
+        for candidate_index, candidate in enumerate(candidates):
+            if candidate_index > 0:
+                self._count(candidate, "failovers")
+                self.log.warning(f"Failing over from {candidates[candidate_index - 1]} to {candidate}")
+            llm = self.llm_factory(candidate, temperature)
+            for attempt in range(self.max_retries + 1):
+                await self._bucket(candidate).acquire()
+                async with self._semaphore:
+                    started()
+                    attempt_start = time.monotonic()
+                    try:
+                        result = await call(llm)
+                        self._report(candidate, time.monotonic() - attempt_start, None)
+                        return result
+                    except Exception as err:
+                        self._report(candidate, time.monotonic() - attempt_start, err)
+                        last_error = err
+                        if not self.is_retryable(err):
+                            raise
+                if attempt < self.max_retries:
+                    delay = self._backoff(last_error, attempt)
+                    self._count(candidate, "retries")
+                    self.log.warning(f"{type(last_error).__name__} from {candidate}; retry {attempt + 1} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+        raise last_error
+
+    def _report(self, model_name, seconds, error):
+        if self.on_result is None:
+            return
+        try:
+            self.on_result(model_name, seconds, error)
+        except Exception as err:   # an observer must never fail a request
+            self.log.warning(f"Result observer failed: {err}")
+
+    def _track(self, model_name):
+        """
+        Register a submitted request. Returns a started() callback that records its queue wait time.
+        """
+        submitted_at = time.monotonic()
+        state = {"started": False}
+        self._count(model_name, "submitted")
+        with self._stats_lock:
+            self._stats["queued"] += 1
+
+        def started():
+            if state["started"]:
+                return
+            state["started"] = True
+            waited = time.monotonic() - submitted_at
+            with self._stats_lock:
+                self._stats["queued"] -= 1
+                self._stats["in_flight"] += 1
+                self._stats["wait_time_total"] += waited
+                self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+
+        return started, state
+
+    def _finish(self, model_name, state, failed):
+        with self._stats_lock:
+            if state["started"]:
+                self._stats["in_flight"] -= 1
+            else:
+                self._stats["queued"] -= 1
+        self._count(model_name, "failed" if failed else "completed")
+
+    def invoke(self, model_name, messages, temperature=0.0):
+        """
+        Invoke a model through the scheduler, blocking the calling thread until the response arrives.
+        Args:
+            model_name (str): The model name.
+            messages (list): Messages to send.
+            temperature (float): The temperature for the model. Default is 0.0.
+        Returns:
+            AIMessage: The model response.
+        """
+        started, state = self._track(model_name)
+
+        async def call(llm):
+            return await llm.ainvoke(messages)
+
+        future = asyncio.run_coroutine_threadsafe(self._run(model_name, temperature, call, started), self._loop)
+        try:
+            result = future.result()
+        except BaseException:
+            future.cancel()
+            self._finish(model_name, state, failed=True)
+            raise
+        self._finish(model_name, state, failed=False)
+        return result
+
+    async def ainvoke(self, model_name, messages, temperature=0.0):
+        """
+        Invoke a model through the scheduler from another event loop, without blocking it.
+        Args:
+            model_name (str): The model name.
+            messages (list): Messages to send.
+            temperature (float): The temperature for the model. Default is 0.0.
+        Returns:
+            AIMessage: The model response.
+        """
+        started, state = self._track(model_name)
+
+        async def call(llm):
+            return await llm.ainvoke(messages)
+
+        future = asyncio.run_coroutine_threadsafe(self._run(model_name, temperature, call, started), self._loop)
+        try:
+            result = await asyncio.wrap_future(future)
+        except BaseException:
+            future.cancel()
+            self._finish(model_name, state, failed=True)
+            raise
+        self._finish(model_name, state, failed=False)
+        return result
+
+    def stream(self, model_name, messages, temperature=0.0):
+        """
+        Stream a model response through the scheduler. Retries and failover only apply before the first chunk.
+        Args:
+            model_name (str): The model name.
+            messages (list): Messages to send.
+            temperature (float): The temperature for the model. Default is 0.0.
+        Yields:
+            AIMessageChunk: Response chunks.
+        """
+        started, state = self._track(model_name)
+        chunks = queue.Queue()
+        done = object()
+
+        async def call(llm):
+            stream = llm.astream(messages)
+            first = await stream.__anext__()  # errors before the first chunk are retryable
+            chunks.put(first)
+            try:
+                async for chunk in stream:
+                    chunks.put(chunk)
+            except Exception as err:
+                # chunks already reached the caller: a retry would duplicate them
+                raise RuntimeError(f"Stream from {llm.model_name} interrupted: {err}") from err
+
+        async def produce():
+            try:
+                await self._run(model_name, temperature, call, started)
+                chunks.put(done)
+            except BaseException as err:
+                chunks.put(err)
+
+        future = asyncio.run_coroutine_threadsafe(produce(), self._loop)
+        failed = False
+        try:
+            while True:
+                item = chunks.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    failed = True
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+            self._finish(model_name, state, failed=failed)
+
+    def stats(self):
+        """
+        Snapshot of the scheduler counters.
+        Returns:
+            dict: Queue depth, in-flight requests, wait times, retries, failovers and per-model counters.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["models"] = {name: dict(counts) for name, counts in self._stats["models"].items()}
+        started = stats["completed"] + stats["failed"] + stats["in_flight"]
+        stats["wait_time_avg"] = stats["wait_time_total"] / started if started else 0.0
+        return stats
+
+
+class ScheduledLLM:
+    """
+    Drop-in stand-in for a ChatOpenAI instance whose invoke/ainvoke/stream calls are routed through a RequestScheduler.
+    """
+
+    def __init__(self, scheduler, model_name, temperature=0.0):
+        self.scheduler = scheduler
+        self.model_name = model_name
+        self.temperature = temperature
+
+    def invoke(self, messages):
+        return self.scheduler.invoke(self.model_name, messages, self.temperature)
+
+    async def ainvoke(self, messages):
+        return await self.scheduler.ainvoke(self.model_name, messages, self.temperature)
+
+    def stream(self, messages):
+        return self.scheduler.stream(self.model_name, messages, self.temperature)
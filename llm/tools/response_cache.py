@@ -0,0 +1,278 @@
+import asyncio, hashlib, json, os, sqlite3, threading, time
+from collections import OrderedDict
+from concurrent.futures import Future
+from util.logger import get_logger
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+class MemoryResponseBackend:
+    """
+    In-process response store with TTL and LRU eviction.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteResponseBackend:
+    """
+    Local on-disk response store (SQLite) with TTL and LRU eviction; survives restarts and is shared by
+    every process using the same file.
+    """
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                  key TEXT PRIMARY KEY,
+                                  value TEXT NOT NULL,
+                                  expires_at REAL NOT NULL,
+                                  last_used REAL NOT NULL)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                               (key, value, now + ttl, now))
+            self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+            excess = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute("DELETE FROM responses WHERE key IN "
+                                   "(SELECT key FROM responses ORDER BY last_used LIMIT ?)", (excess,))
+                self.evictions += excess
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class ResponseCache:
+    """
+    ResponseCache stores model responses keyed on the prepared request (image hashes, normalized prompt
+    text, model id, temperature). Concurrent identical requests are de-duplicated (single flight): only the
+    first makes the upstream call and the others wait for its result.
+    """
+
+    def __init__(self, backend=None, ttl=24 * 3600, max_temperature=0.0):
+        """
+        Initialize the ResponseCache class.
+        Args:
+            backend (object): MemoryResponseBackend or SQLiteResponseBackend. Default is a MemoryResponseBackend.
+            ttl (float): Seconds a response stays valid. Default is 24 hours.
+            max_temperature (float): Requests above this temperature are never cached. Default is 0.0.
+        """
+        self.log = get_logger(__name__)
+        self.backend = backend if backend is not None else MemoryResponseBackend()
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "deduplicated": 0, "stores": 0}
+
+    @staticmethod
+    def normalize_prompt(text):
+        # whitespace only: prompts differing in case may ask different questions
+        return " ".join(text.split())
+
+    @staticmethod
+    def make_key(messages, model_name, temperature):
+        """
+        Build the cache key for a request. Image payloads are hashed; text is whitespace normalized.
+        Args:
+            messages (list): Messages (or a single prompt string) sent to the model.
+            model_name (str): The model Id.
+            temperature (float): The temperature.
+        Returns:
+            str: Hex digest identifying the request.
+        """
+        if isinstance(messages, str):
+            messages = [messages]
+        parts = []
+        for message in messages:
+            content = getattr(message, "content", message)
+            blocks = content if isinstance(content, list) else [content]
+            for block in blocks:
+                if isinstance(block, str):
+                    parts.append(["text", ResponseCache.normalize_prompt(block)])
+                elif block.get("type") == "text":
+                    parts.append(["text", ResponseCache.normalize_prompt(block["text"])])
+                elif block.get("type") == "image":
+                    data = block.get("data") or block.get("url", "")
+                    parts.append(["image", block.get("mime_type"), hashlib.sha256(data.encode("utf-8")).hexdigest()])
+                else:
+                    parts.append(["other", json.dumps(block, sort_keys=True, default=str)])
+            parts.append(["role", getattr(message, "type", "human")])
+        payload = json.dumps([model_name, float(temperature), parts])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def cacheable(self, temperature):
+        return temperature <= self.max_temperature
+
+    def lookup(self, key):
+        """
+        Look up a response. On a miss the caller either becomes the leader (gets None, must call complete()
+        or fail()) or, if an identical request is in flight, gets a Future for the leader's result.
+        Args:
+            key (str): Cache key from make_key.
+        Returns:
+            tuple: (cached text or None, Future to wait on or None).
+        """
+        value = self.backend.get(key)
+        with self._lock:
+            if value is not None:
+                self._stats["hits"] += 1
+                return value, None
+            if key in self._inflight:
+                self._stats["deduplicated"] += 1
+                return None, self._inflight[key]
+            self._stats["misses"] += 1
+            self._inflight[key] = Future()
+            return None, None
+
+    def complete(self, key, value):
+        """
+        Store the leader's result and release waiting requests.
+        """
+        self.backend.put(key, value, self.ttl)
+        with self._lock:
+            self._stats["stores"] += 1
+            future = self._inflight.pop(key, None)
+        if future is not None:
+            future.set_result(value)
+
+    def fail(self, key, err):
+        """
+        Release waiting requests with the leader's error. Nothing is cached.
+        """
+        with self._lock:
+            future = self._inflight.pop(key, None)
+        if future is not None:
+            future.set_exception(err)
+
+    def stats(self):
+        """
+        Snapshot of the cache counters.
+        Returns:
+            dict: hits, misses, deduplicated, stores, evictions, entries and hit rate.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._inflight)
+        stats["evictions"] = self.backend.evictions
+        stats["entries"] = len(self.backend)
+        lookups = stats["hits"] + stats["misses"] + stats["deduplicated"]
+        stats["hit_rate"] = (stats["hits"] + stats["deduplicated"]) / lookups if lookups else 0.0
+        return stats
+
+
+class CachedLLM:
+    """
+    Wraps a ChatOpenAI (or ScheduledLLM) so invoke/ainvoke/stream calls are served from a ResponseCache when possible.
+    """
+
+    def __init__(self, llm, cache, model_name, temperature=0.0):
+        self.llm = llm
+        self.cache = cache
+        self.model_name = model_name
+        self.temperature = temperature
+
+    def invoke(self, messages):
+        if not self.cache.cacheable(self.temperature):
+            return self.llm.invoke(messages)
+        key = self.cache.make_key(messages, self.model_name, self.temperature)
+        value, pending = self.cache.lookup(key)
+        if value is None and pending is not None:
+            value = pending.result()
+        if value is not None:
+            return AIMessage(content=value, response_metadata={"cache_hit": True})
+        try:
+            response = self.llm.invoke(messages)
+        except BaseException as err:
+            self.cache.fail(key, err)
+            raise
+        self.cache.complete(key, response.content)
+        return response
+
+    async def ainvoke(self, messages):
+        if not self.cache.cacheable(self.temperature):
+            return await self.llm.ainvoke(messages)
+        key = self.cache.make_key(messages, self.model_name, self.temperature)
+        value, pending = self.cache.lookup(key)
+        if value is None and pending is not None:
+            # shielded: a cancelled waiter must not cancel the leader's future for the others
+            value = await asyncio.shield(asyncio.wrap_future(pending))
+        if value is not None:
+            return AIMessage(content=value, response_metadata={"cache_hit": True})
+        try:
+            response = await self.llm.ainvoke(messages)
+        except BaseException as err:
+            # includes CancelledError: waiters get an error, nothing is cached
+            self.cache.fail(key, err if isinstance(err, Exception) else RuntimeError("Request cancelled"))
+            raise
+        self.cache.complete(key, response.content)
+        return response
+
+    def stream(self, messages):
+        if not self.cache.cacheable(self.temperature):
+            yield from self.llm.stream(messages)
+            return
+        key = self.cache.make_key(messages, self.model_name, self.temperature)
+        value, pending = self.cache.lookup(key)
+        if value is None and pending is not None:
+            value = pending.result()
+        if value is not None:
+            yield AIMessageChunk(content=value, response_metadata={"cache_hit": True})
+            return
+        parts = []
+        try:
+            for chunk in self.llm.stream(messages):
+                parts.append(chunk.content)
+                yield chunk
+        except BaseException as err:
+            # includes GeneratorExit: an abandoned stream is incomplete and must not be cached
+            self.cache.fail(key, err if isinstance(err, Exception) else RuntimeError("Stream abandoned"))
+            raise
+        self.cache.complete(key, "".join(parts))
@@ -0,0 +1,130 @@
+import io, math
+from util.logger import get_logger
+from PIL import Image
+from llm.tools.pipeline_metrics import stage
+
+class ImageBudgeter:
+    """
+    ImageBudgeter estimates what an image will actually cost on a given model (provider-side tiling, not
+    base64 length) and, when an image exceeds the model's limits or a configured token/byte budget,
+    picks the largest resolution and highest JPEG quality that fit.
+    """
+
+    def __init__(self, max_image_tokens=None, max_bytes=None, text_reserve=8192, qualities=(90, 80, 70, 60, 50), min_side=256):
+        """
+        Initialize the ImageBudgeter class.
+        Args:
+            max_image_tokens (int): Max image tokens per request. Default is None (bounded by the model context only).
+            max_bytes (int): Max encoded image size in bytes. Default is None (unbounded).
+            text_reserve (int): Context tokens kept free for prompt text and the response. Default is 8192.
+            qualities (tuple): JPEG qualities tried, best first, when re-encoding.
+            min_side (int): Images are never downscaled below this longest side (pixels). Default is 256.
+        """
+        self.log = get_logger(__name__)
+        self.max_image_tokens = max_image_tokens
+        self.max_bytes = max_bytes
+        self.text_reserve = text_reserve
+        self.qualities = qualities
+        self.min_side = min_side
+
+    @staticmethod
+    def estimate_image_tokens(width, height, limits):
+        """
+        Estimate billed image tokens for an image of the given size.
+        Args:
+            width (int): Image width in pixels.
+            height (int): Image height in pixels.
+            limits (dict): Model limits from LModelAccess.get_model_limits.
+        Returns:
+            int: Estimated image tokens.
+        """
+        scale = min(1.0, limits["max_image_side"] / max(width, height))  # provider-side downscale
+        tile = limits["tile_size"]
+        tiles = math.ceil(width * scale / tile) * math.ceil(height * scale / tile)
+        return limits["base_tokens"] + min(tiles, limits["max_tiles"]) * limits["tokens_per_tile"]
+
+    def token_budget(self, limits):
+        """
+        Image token budget for a model: the configured budget, capped by the model's usable context.
+        Args:
+            limits (dict): Model limits from LModelAccess.get_model_limits.
+        Returns:
+            int: Max image tokens.
+        """
+        budget = limits["context_limit"] - self.text_reserve
+        if self.max_image_tokens is not None:
+            budget = min(budget, self.max_image_tokens)
+        return budget
+
+    def fit(self, image_byte_data, mime_type, limits, max_tokens=None):
+        """
+        Fit an image to a model's limits and the configured budgets. Images already within budget are
+        returned untouched; otherwise the image is downscaled and re-encoded as JPEG.
+        Args:
+            image_byte_data (bytes): Encoded image.
+            mime_type (str): Mime type of the image.
+            limits (dict): Model limits from LModelAccess.get_model_limits.
+            max_tokens (int): Token share of this image when a request carries several. Default is None.
+        Returns:
+            tuple: (image bytes, mime type, report dict with size, tokens, bytes and quality).
+        """
+        try:
+            image = Image.open(io.BytesIO(image_byte_data))
+            width, height = image.size
+        except Exception as err:   # e.g. UnidentifiedImageError, DecompressionBombError
+            self.log.critical(f"{type(err)}: Error opening image: {err}")
+            raise RuntimeError("Failed to open the image. Please investigate the file format and content.")
+        token_budget = self.token_budget(limits)
+        if max_tokens is not None:
+            token_budget = min(token_budget, max_tokens)
+        report = {
+            "original_size": (width, height),
+            "original_bytes": len(image_byte_data),
+            "original_tokens": self.estimate_image_tokens(width, height, limits),
+            "token_budget": token_budget,
+            "resized": False,
+        }
+
+        # Pixels beyond max_image_side are discarded by the provider anyway
+        scale = min(1.0, limits["max_image_side"] / max(width, height))
+        while (self.estimate_image_tokens(width * scale, height * scale, limits) > token_budget
+               and max(width, height) * scale * 0.9 >= self.min_side):
+            scale *= 0.9
+
+        if scale == 1.0 and (self.max_bytes is None or len(image_byte_data) <= self.max_bytes):
+            report.update(size=(width, height), bytes=len(image_byte_data),
+                          tokens=report["original_tokens"], quality=None)
+            self.log.info(f"Image within budget: {report}")
+            return image_byte_data, mime_type, report
+
+        try:
+            with stage("decode"):
+                if scale < 1.0:
+                    # JPEGs are decoded at 1/2, 1/4 or 1/8 scale (no smaller than the target): the full-size
+                    # bitmap of an oversized photo is never allocated
+                    image.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+                image = image.convert("RGB")
+        except Exception as err:   # e.g. truncated or corrupt image data
+            self.log.critical(f"{type(err)}: Error decoding image: {err}")
+            raise RuntimeError("Failed to decode the image. Please investigate the file format and content.")
+        while True:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            with stage("resize"):
+                resized = image.resize(size, Image.LANCZOS) if size != image.size else image
+            for quality in self.qualities:
+                buffer = io.BytesIO()
+                with stage("encode"):
+                    resized.save(buffer, "JPEG", quality=quality)
+                if self.max_bytes is None or buffer.tell() <= self.max_bytes:
+                    break
+            fits = self.max_bytes is None or buffer.tell() <= self.max_bytes
+            if fits or max(size) * 0.8 < self.min_side:
+                break
+            scale *= 0.8
+
+        if not fits:
+            self.log.warning(f"Image could not be fit in {self.max_bytes} bytes; sending {buffer.tell()} bytes")
+        report.update(size=size, bytes=buffer.tell(), tokens=self.estimate_image_tokens(*size, limits),
+                      quality=quality, resized=True)
+        self.log.info(f"Image fitted to budget: {report}")
+        return buffer.getvalue(), "image/jpeg", report
@@ -0,0 +1,130 @@
+import threading, time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from util.logger import get_logger
+
+
+class PreparationCancelled(Exception):
+    """
+    Raised inside a preparation when its upload was replaced or removed.
+    """
+
+
+class PreparationJob:
+    """
+    Handle on one background preparation. The key identifies the upload and the settings it was prepared
+    for; a job whose key no longer matches the session's upload is stale and should be cancelled.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.future = None
+        self.submitted_at = time.perf_counter()
+        self.finished_at = None
+        self._cancelled = threading.Event()
+
+    def check_cancelled(self):
+        """
+        Called by the preparation between stages; stops it early once the job is cancelled.
+        """
+        if self._cancelled.is_set():
+            raise PreparationCancelled(f"Preparation {self.key} cancelled")
+
+    def cancel(self):
+        """
+        Cancel the job: a queued job never starts, a running one stops at its next stage boundary.
+        """
+        self._cancelled.set()
+        return self.future.cancel()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """
+        Wait for the prepared upload.
+        Args:
+            timeout (float): Max seconds to wait. Default is None (no limit).
+        Returns:
+            object: Whatever the preparation function returned.
+        """
+        return self.future.result(timeout)
+
+
+class UploadPreparer:
+    """
+    UploadPreparer runs upload preparation (conversion, resizing, base64 encoding) on a shared worker pool
+    as soon as a file is uploaded, so the work overlaps with the user typing the prompt.
+    """
+
+    def __init__(self, max_workers=4):
+        """
+        Initialize the UploadPreparer class.
+        Args:
+            max_workers (int): Max preparations running at once across all sessions. Default is 4.
+        """
+        self.log = get_logger(__name__)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upload-prep")
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "ready_on_submit": 0}
+
+    def submit(self, key, prepare, *args, **kwargs):
+        """
+        Start preparing an upload in the background.
+        Args:
+            key (tuple): Identity of the upload and its preparation settings.
+            prepare (callable): prepare(job, *args, **kwargs); should call job.check_cancelled() between stages.
+        Returns:
+            PreparationJob: Handle to wait on or cancel.
+        """
+        job = PreparationJob(key)
+
+        def run():
+            job.check_cancelled()
+            try:
+                return prepare(job, *args, **kwargs)
+            finally:
+                job.finished_at = time.perf_counter()
+
+        job.future = self.executor.submit(run)
+        job.future.add_done_callback(self._record)
+        with self._lock:
+            self._stats["submitted"] += 1
+        return job
+
+    def _record(self, future):
+        try:
+            error = future.exception()
+        except CancelledError:
+            error = PreparationCancelled()
+        outcome = "completed" if error is None else "cancelled" if isinstance(error, PreparationCancelled) else "failed"
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def collect(self, job, timeout=None):
+        """
+        Wait for a job from the prompt path, recording whether it had already finished.
+        Args:
+            job (PreparationJob): The session's job.
+            timeout (float): Max seconds to wait. Default is None (no limit).
+        Returns:
+            tuple: (prepared result, seconds the prompt path waited).
+        """
+        start = time.perf_counter()
+        if job.done():
+            with self._lock:
+                self._stats["ready_on_submit"] += 1
+        result = job.result(timeout)
+        return result, time.perf_counter() - start
+
+    def stats(self):
+        """
+        Snapshot of the preparer counters.
+        Returns:
+            dict: submitted, completed, failed, cancelled, and how many jobs were ready when the prompt arrived.
+        """
+        with self._lock:
+            return dict(self._stats)
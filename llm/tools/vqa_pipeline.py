@@ -0,0 +1,286 @@
+import hashlib, io, math, re, time, zipfile
+from PIL import Image
+from util.logger import get_logger
+from llm.tools.pdf_text_layer import PdfTextLayer
+from llm.tools.pipeline_metrics import add_stage, annotate
+from llm.tools.prompt_utils import PromptUtils
+
+PDF_MIME_TYPE = "application/pdf"
+PPTX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+GIF_MIME_TYPE = "image/gif"
+
+
+class VQAPipeline:
+    """
+    VQAPipeline is the upload-to-answer path: convert an upload to images, fit them to a model's limits,
+    base64 encode them once, and ask the model. It is shared by the Streamlit app and the offline benchmarks.
+    """
+
+    def __init__(self, image_tools, image_budgeter, max_sheets=1, min_page_side=0, text_layer=None,
+                 max_frames=8, frame_sampling="scene", frame_layout="storyboard"):
+        """
+        Initialize the VQAPipeline class.
+        Args:
+            image_tools (ImageTools): Document to image conversion.
+            image_budgeter (ImageBudgeter): Fits images to model limits and budgets.
+            max_sheets (int): Max images a PDF is split into when one page grid would be too small. Default is 1.
+            min_page_side (int): Longest side in pixels a PDF page should get before splitting stops. Default is 0.
+            text_layer (PdfTextLayer): Page classification and text extraction for hybrid mode. Default is a PdfTextLayer.
+            max_frames (int): Max frames sampled from an animated GIF. Default is 8.
+            frame_sampling (str): "scene" (frames where the picture changes) or "stride" (evenly spaced). Default is "scene".
+            frame_layout (str): "storyboard" (one labelled grid) or "frames" (one image per frame). Default is "storyboard".
+        """
+        self.log = get_logger(__name__)
+        self.image_tools = image_tools
+        self.image_budgeter = image_budgeter
+        self.max_sheets = max_sheets
+        self.min_page_side = min_page_side
+        self.text_layer = text_layer or PdfTextLayer()
+        self.max_frames = max_frames
+        self.frame_sampling = frame_sampling
+        self.frame_layout = frame_layout
+
+    def describe(self, byte_data, mime_type, page_mode=False, pages_per_request=1):
+        """
+        Describe the request an upload will become, without converting it, so a model can be chosen
+        (see ModelRouter) before the upload is fitted to that model's limits.
+        Args:
+            byte_data (bytes): Uploaded file data.
+            mime_type (str): Uploaded file mime type.
+            page_mode (bool): The PDF will be asked page by page. Default is False.
+            pages_per_request (int): Pages per image in page mode. Default is 1.
+        Returns:
+            dict: pages (pages, slides or frames), pages_per_image, images per request, requests (model
+                  calls) and image_size (pixels of a still image; None when sized to the model's max side).
+        """
+        if mime_type == PDF_MIME_TYPE:
+            pages = self.image_tools.rasterizer.page_count(byte_data)
+        elif mime_type == PPTX_MIME_TYPE:
+            with zipfile.ZipFile(io.BytesIO(byte_data)) as archive:
+                pages = sum(1 for name in archive.namelist() if re.match(r"ppt/slides/slide\d+\.xml$", name))
+        else:
+            with Image.open(io.BytesIO(byte_data)) as image:
+                frames = getattr(image, "n_frames", 1)
+                if frames == 1:
+                    return {"pages": 1, "pages_per_image": 1, "images": 1, "requests": 1, "image_size": image.size}
+            frames = min(frames, self.max_frames)
+            if self.frame_layout == "frames":
+                return {"pages": frames, "pages_per_image": 1, "images": frames, "requests": 1, "image_size": None}
+            return {"pages": frames, "pages_per_image": frames, "images": 1, "requests": 1, "image_size": None}
+        pages = max(pages, 1)
+        if page_mode:
+            # one request per page group, plus the one combining their answers
+            return {"pages": pages, "pages_per_image": pages_per_request, "images": 1,
+                    "requests": math.ceil(pages / pages_per_request) + 1, "image_size": None}
+        images = min(pages, self.max_sheets) if mime_type == PDF_MIME_TYPE else 1
+        return {"pages": pages, "pages_per_image": math.ceil(pages / images), "images": images, "requests": 1,
+                "image_size": None}
+
+    def prepare(self, byte_data, mime_type, limits, page_mode=False, pages_per_request=1, api_key=None,
+                check_cancelled=None, hybrid=False):
+        """
+        Convert an upload to images, fit them to the model limits and base64 encode them.
+        Args:
+            byte_data (bytes): Uploaded file data.
+            mime_type (str): Uploaded file mime type.
+            limits (dict): Model limits the images are fitted to.
+            page_mode (bool): Prepare a PDF page by page instead of as one merged image. Default is False.
+            pages_per_request (int): Pages per image in page mode. Default is 1.
+            api_key (str): Cloudmersive API key, for PPTX conversion. Default is None.
+            check_cancelled (callable): Called between stages; raises to stop early. Default is None.
+            hybrid (bool): Send text-dominant PDF pages as extracted text and only figures as images. Default is False.
+        Returns:
+            dict: mime_type and payload_bytes plus images (dicts of byte_data, mime_type, budget_report,
+                  encoded_image and pages), or page_images and total_pages in page mode. Hybrid mode adds
+                  parts, the text and image parts of the document in page order; animated GIFs add
+                  frame_total, and frames (the frame labels) per image.
+        """
+        check_cancelled = check_cancelled or (lambda: None)
+        max_side = limits["max_image_side"]
+        if page_mode:
+            page_groups = self.image_tools.pdf_to_page_jpegs(byte_data, pages_per_request, max_side=max_side)
+            page_images = []
+            for first, last, image_byte_data in page_groups:
+                check_cancelled()
+                image_byte_data, mime_type, report = self.image_budgeter.fit(image_byte_data, "image/jpeg", limits)
+                page_images.append((first, last, image_byte_data, report["tokens"]))
+            annotate(page_groups=len(page_images), image_tokens=sum(page[3] for page in page_images))
+            # pages are base64 encoded per request; payload size is the encoded length
+            # near-duplicate pages may be skipped, so the last group need not end on the last page
+            total_pages = self.image_tools.rasterizer.page_count(byte_data)
+            return {"mime_type": mime_type, "page_images": page_images, "total_pages": total_pages,
+                    "payload_bytes": sum(4 * -(-len(page[2]) // 3) for page in page_images)}
+
+        if mime_type == PDF_MIME_TYPE and hybrid:
+            return self._prepare_hybrid(byte_data, limits, check_cancelled)
+        if mime_type == PDF_MIME_TYPE:
+            self.log.debug("PDF document requires conversion to image")
+            sheets = self.image_tools.pdf_to_sheets(byte_data, max_side, self.max_sheets, self.min_page_side)
+            mime_type = "image/jpeg"  # Reset: JPEG image
+        elif mime_type == PPTX_MIME_TYPE:
+            self.log.debug("PPTX document requires conversion to image")
+            sheets = [(None, None, self.image_tools.pptx_to_jpeg(api_key, byte_data, max_side=max_side))]
+            mime_type = "image/jpeg"  # Reset: JPEG image
+        elif mime_type == GIF_MIME_TYPE and self.image_tools.frame_count(byte_data) > 1:
+            return self._prepare_frames(byte_data, limits, check_cancelled)
+        else:
+            sheets = [(None, None, byte_data)]
+        # several sheets share the request's image token budget
+        token_share = self.image_budgeter.token_budget(limits) // len(sheets) if len(sheets) > 1 else None
+        images = []
+        for first, last, image_byte_data in sheets:
+            check_cancelled()
+            image_byte_data, image_mime_type, budget_report = self.image_budgeter.fit(image_byte_data, mime_type,
+                                                                                      limits, token_share)
+            check_cancelled()
+            images.append({"byte_data": image_byte_data, "mime_type": image_mime_type, "budget_report": budget_report,
+                           "encoded_image": PromptUtils.encode_image(image_byte_data), "pages": (first, last)})
+        annotate(sheets=len(images), image_size=[image["budget_report"]["size"] for image in images],
+                 image_tokens=sum(image["budget_report"]["tokens"] for image in images))
+        return {"mime_type": images[0]["mime_type"], "images": images,
+                "payload_bytes": sum(len(image["encoded_image"]) for image in images)}
+
+    def _prepare_hybrid(self, byte_data, limits, check_cancelled):
+        """
+        Prepare a PDF as text and images: text-dominant pages as extracted text, their figures as cropped
+        images, and figure-heavy or scanned pages as whole-page images. The images share the token budget.
+        """
+        max_side = limits["max_image_side"]
+        layouts = self.text_layer.analyze(byte_data)
+        if not layouts:
+            raise RuntimeError("Failed to convert the PDF document. No pages found in PDF.")
+        if self.image_tools.dedupe_threshold is not None:
+            kept = set(self.image_tools.unique_pages(byte_data)[0])
+            layouts = [layout for layout in layouts if layout["page"] - 1 in kept]
+        doc_id = hashlib.sha256(byte_data).digest()
+        # (page, figure number or None, page index, clip) per image, in page order
+        wanted = []
+        for layout in layouts:
+            if layout["kind"] == "image":
+                wanted.append((layout["page"], None, layout["page"] - 1, None))
+            else:
+                wanted += [(layout["page"], number, layout["page"] - 1, region)
+                           for number, region in enumerate(layout["regions"], start=1)]
+        token_share = self.image_budgeter.token_budget(limits) // len(wanted) if len(wanted) > 1 else None
+        images, image_parts = [], {}
+        for page, figure, index, clip in wanted:
+            check_cancelled()
+            image_byte_data = self.image_tools.pdf_region_to_jpeg(byte_data, index, clip, max_side=max_side, doc_id=doc_id)
+            image_byte_data, image_mime_type, budget_report = self.image_budgeter.fit(image_byte_data, "image/jpeg",
+                                                                                      limits, token_share)
+            image = {"byte_data": image_byte_data, "mime_type": image_mime_type, "budget_report": budget_report,
+                     "encoded_image": PromptUtils.encode_image(image_byte_data), "pages": (page, page),
+                     "figure": figure}
+            images.append(image)
+            image_parts.setdefault(page, []).append(image)
+        parts = []
+        for layout in layouts:
+            if layout["kind"] == "text":
+                parts.append(("text", layout["page"], layout["text"]))
+            parts += [("image", layout["page"], image) for image in image_parts.get(layout["page"], [])]
+        text_bytes = sum(len(layout["text"].encode("utf-8")) for layout in layouts if layout["kind"] == "text")
+        annotate(pages=len(layouts), text_pages=sum(layout["kind"] == "text" for layout in layouts),
+                 sheets=len(images), image_tokens=sum(image["budget_report"]["tokens"] for image in images))
+        return {"mime_type": "image/jpeg", "images": images, "parts": parts,
+                "payload_bytes": text_bytes + sum(len(image["encoded_image"]) for image in images)}
+
+    def _prepare_frames(self, byte_data, limits, check_cancelled):
+        """
+        Prepare an animated GIF: sample frames, then lay them out as one storyboard or keep one image
+        per frame. The frame images share the token budget.
+        """
+        frame_total = self.image_tools.frame_count(byte_data)
+        frames = self.image_tools.sample_frames(byte_data, self.max_frames, self.frame_sampling,
+                                                check_cancelled=check_cancelled)
+        check_cancelled()
+        if self.frame_layout == "frames" and len(frames) > 1:
+            sheets = [([frame], self.image_tools.encode_image(frame["image"])) for frame in frames]
+        else:
+            sheets = [(frames, self.image_tools.frames_to_storyboard(frames, limits["max_image_side"]))]
+        token_share = self.image_budgeter.token_budget(limits) // len(sheets) if len(sheets) > 1 else None
+        images = []
+        for sheet_frames, image_byte_data in sheets:
+            check_cancelled()
+            image_byte_data, image_mime_type, budget_report = self.image_budgeter.fit(image_byte_data, "image/jpeg",
+                                                                                      limits, token_share)
+            images.append({"byte_data": image_byte_data, "mime_type": image_mime_type, "budget_report": budget_report,
+                           "encoded_image": PromptUtils.encode_image(image_byte_data), "pages": (None, None),
+                           "frames": [self.image_tools.frame_label(frame) for frame in sheet_frames]})
+        annotate(sheets=len(images), image_size=[image["budget_report"]["size"] for image in images],
+                 image_tokens=sum(image["budget_report"]["tokens"] for image in images))
+        return {"mime_type": "image/jpeg", "images": images, "frame_total": frame_total,
+                "payload_bytes": sum(len(image["encoded_image"]) for image in images)}
+
+    @staticmethod
+    def get_prompt(prepared, user_prompt):
+        """
+        Build the user message for a prepared upload: zero-shot for one image, multi-image for split PDFs,
+        mixed text and images for hybrid PDFs and frame images for animated GIFs.
+        """
+        if "frame_total" in prepared:
+            return PromptUtils.get_frames_prompt(
+                [(image["byte_data"], image["mime_type"], image["frames"], image["budget_report"]["tokens"],
+                  image["encoded_image"]) for image in prepared["images"]], prepared["frame_total"], user_prompt)
+        if "parts" in prepared:
+            return PromptUtils.get_hybrid_prompt(
+                [part if part[0] == "text" else
+                 ("image", part[1], part[2]["figure"], part[2]["byte_data"], part[2]["mime_type"],
+                  part[2]["budget_report"]["tokens"], part[2]["encoded_image"]) for part in prepared["parts"]],
+                user_prompt)
+        images = prepared["images"]
+        if len(images) == 1:
+            image = images[0]
+            return PromptUtils.get_zshot_prompt(image["byte_data"], user_prompt, image["mime_type"],
+                                                image["budget_report"]["tokens"], image["encoded_image"])
+        return PromptUtils.get_multi_image_prompt(
+            [(image["byte_data"], image["mime_type"], *image["pages"], image["budget_report"]["tokens"],
+              image["encoded_image"]) for image in images], user_prompt)
+
+    def invoke(self, llm, prepared, user_prompt, messages=None):
+        """
+        Ask the model about a prepared upload and wait for the whole response.
+        Args:
+            llm (ChatOpenAI): The LLM instance.
+            prepared (dict): Result of prepare().
+            user_prompt (str): The user's input prompt.
+            messages (list): Messages to send instead of the single-turn prompt, e.g. from a Conversation. Default is None.
+        Returns:
+            str: The generated response.
+        """
+        messages = messages or [self.get_prompt(prepared, user_prompt)]
+        start = time.perf_counter()
+        response = llm.invoke(messages)
+        add_stage("model", time.perf_counter() - start)
+        if getattr(response, "usage_metadata", None):
+            annotate(usage=dict(response.usage_metadata))
+        return response.content
+
+    def stream(self, llm, prepared, user_prompt, latency=None, messages=None):
+        """
+        Ask the model about a prepared upload, yielding response text as it arrives.
+        Args:
+            llm (ChatOpenAI): The LLM instance.
+            prepared (dict): Result of prepare().
+            user_prompt (str): The user's input prompt.
+            latency (dict): Populated with 'ttft' (time to first token) and 'total' seconds. Default is None.
+            messages (list): Messages to send instead of the single-turn prompt, e.g. from a Conversation. Default is None.
+        Yields:
+            str: Response text chunks.
+        """
+        latency = {} if latency is None else latency
+        messages = messages or [self.get_prompt(prepared, user_prompt)]
+        start = time.perf_counter()
+        for chunk in llm.stream(messages):
+            if chunk.usage_metadata:
+                annotate(usage=dict(chunk.usage_metadata))
+            if chunk.response_metadata.get("cache_hit"):
+                annotate(cache_hit=True)
+            if not chunk.content:
+                continue
+            if "ttft" not in latency:
+                latency["ttft"] = time.perf_counter() - start
+            yield chunk.content
+        latency["total"] = time.perf_counter() - start
+        # network: until the first token (upload, queueing, prefill); model: generation of the rest
+        add_stage("network", latency.get("ttft", latency["total"]))
+        add_stage("model", latency["total"] - latency.get("ttft", latency["total"]))
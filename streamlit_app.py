@@ -1,12 +1,9 @@
 import os, time, logging, json, base64
 import streamlit as st
 from util.secrets import Secrets 
-from llm.tools.lmodel_access import LModelAccess
-from llm.tools.image_tools import ImageTools
-from llm.tools.prompt_utils import PromptUtils
-from streamlit_oauth import OAuth2Component
 from streamlit.runtime.scriptrunner import get_script_run_ctx
-from streamlit_js_eval import streamlit_js_eval
+# llm.tools modules (and through them langchain, httpx, Pillow, sqlite3) are imported by the cached getters
+# and load_services() below, once the user is signed in: the login screen only needs streamlit and OAuth
 
 
 app_name = "VQA Chatbot"
@@ -17,16 +14,186 @@ app_dns = "http://localhost:8502/" if local else "https://l3vision-open-router.s
 log = st.logger.get_logger(__name__)
 log.info(f"{app_name}app_dns: {app_dns}")
 
-lma = LModelAccess(app_name, app_dns, Secrets.OPENROUTER_API_KEY.value)
-image_tools = ImageTools()
-models = lma.get_all_models()
-default_model = lma.get_model_by_id(init_model)
-default_index = models.index(default_model)
+# conversion cache: optional disk tier enabled by setting CONVERSION_CACHE_DIR
+CONVERSION_CACHE_ENTRIES = 32
+CONVERSION_CACHE_MEM_BYTES = 256 * 1024 * 1024
+CONVERSION_CACHE_DIR = os.environ.get("CONVERSION_CACHE_DIR")
+CONVERSION_CACHE_DISK_BYTES = 2 * 1024 * 1024 * 1024
+# PPTX to PDF conversion backends, tried in order: "libreoffice" (local soffice, skipped when not installed),
+# "cloudmersive" (remote, 3 MB limit) and "stub" (offline placeholder pages, for tests)
+PPTX_CONVERTERS = [name.strip() for name in os.environ.get("PPTX_CONVERTERS", "libreoffice,cloudmersive").split(",")]
+PPTX_CONVERT_CONCURRENCY = 2
+PPTX_CONVERT_TIMEOUT = 120
+# merged PDF canvases above this size are kept in a temp file instead of memory
+PDF_SPILL_BYTES = 128 * 1024 * 1024
+# PDF pages are tiled into a grid at the model's max image side; with PDF_MAX_SHEETS > 1 pages are spread
+# over several images while pages would otherwise get a longest side below PDF_MIN_PAGE_SIDE pixels
+PDF_MAX_SHEETS = 1
+PDF_MIN_PAGE_SIDE = 640
+# near-identical PDF/PPTX pages (perceptual hash distance in bits of 256, plus matching text) are sent once;
+# None keeps every page
+PAGE_DEDUPE_THRESHOLD = 12
+# animated GIFs: up to GIF_MAX_FRAMES frames sampled at scene changes ("scene") or evenly ("stride"),
+# sent as one labelled storyboard ("storyboard") or one image per frame ("frames")
+GIF_MAX_FRAMES = 8
+GIF_FRAME_SAMPLING = "scene"
+GIF_FRAME_LAYOUT = "storyboard"
+# image budgets per request: None = bounded by the model's own limits only
+IMAGE_TOKEN_BUDGET = None
+IMAGE_BYTE_BUDGET = 5 * 1024 * 1024
+# follow-up questions: earlier turns about the same upload are sent within this many text tokens, and
+# turns beyond it as condensed excerpts within CONVERSATION_SUMMARY_TOKENS
+CONVERSATION_HISTORY_TOKENS = 4096
+CONVERSATION_SUMMARY_TOKENS = 512
+# page-by-page document QA: max page requests in flight per question
+PAGE_QA_CONCURRENCY = 4
+# model routing: per-upload choice of model by estimated cost, latency learnt over the last ROUTER_WINDOW calls
+# per model, or quality within a budget per question (USD)
+ROUTING_POLICIES = {"Manual": None, "Cheapest": "cheapest", "Fastest": "fastest", "Best within budget": "quality"}
+ROUTER_WINDOW = 50
+ROUTE_BUDGET_USD = 0.02
+# shared request scheduler: global cap on in-flight OpenRouter requests across all sessions
+SCHEDULER_MAX_CONCURRENCY = 16
+SCHEDULER_MAX_RETRIES = 3
+SCHEDULER_FAILOVER = True
+# opt-in response cache: RESPONSE_CACHE=memory or RESPONSE_CACHE=sqlite (file at RESPONSE_CACHE_PATH)
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "").lower()
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", "cache/responses.sqlite3")
+RESPONSE_CACHE_TTL = 24 * 3600
+RESPONSE_CACHE_ENTRIES = 2048
+# uploads are converted, fitted and encoded in the background while the prompt is typed
+UPLOAD_PREP_WORKERS = 4
+# per-stage pipeline metrics: JSON trace logs always; Prometheus text file and/or /metrics endpoint when set
+PIPELINE_METRICS_PATH = os.environ.get("PIPELINE_METRICS_PATH")
+PIPELINE_METRICS_PORT = os.environ.get("PIPELINE_METRICS_PORT")
+
+@st.cache_resource
+def get_conversion_cache():
+    """
+    Process-wide conversion cache, shared across reruns and user sessions.
+    """
+    from llm.tools.conversion_cache import ConversionCache
+    return ConversionCache(max_entries=CONVERSION_CACHE_ENTRIES,
+                           max_bytes=CONVERSION_CACHE_MEM_BYTES,
+                           disk_dir=CONVERSION_CACHE_DIR,
+                           disk_max_bytes=CONVERSION_CACHE_DISK_BYTES)
+
+@st.cache_resource
+def get_image_tools():
+    """
+    Process-wide ImageTools, so the PDF render worker pool and the conversion queue survive reruns.
+    """
+    from llm.tools.document_converter import ConversionQueue
+    from llm.tools.image_tools import ImageTools
+    from llm.tools.pdf_rasterizer import PdfRasterizer
+    converter = ConversionQueue.from_names(PPTX_CONVERTERS, max_concurrency=PPTX_CONVERT_CONCURRENCY,
+                                           timeout=PPTX_CONVERT_TIMEOUT)
+    return ImageTools(cache=get_conversion_cache(), rasterizer=PdfRasterizer(spill_threshold=PDF_SPILL_BYTES),
+                      dedupe_threshold=PAGE_DEDUPE_THRESHOLD, converter=converter)
+
+@st.cache_resource
+def get_model_router():
+    """
+    Process-wide model router, learning latency and error rates from every session's requests.
+    """
+    from llm.tools.lmodel_access import LModelAccess
+    from llm.tools.model_router import ModelRouter
+    return ModelRouter(LModelAccess(app_name, app_dns, Secrets.OPENROUTER_API_KEY.value),
+                       window=ROUTER_WINDOW, parallel_requests=PAGE_QA_CONCURRENCY)
+
+@st.cache_resource
+def get_request_scheduler():
+    """
+    Process-wide request scheduler: rate limits, retries and failover for all sessions.
+    """
+    from llm.tools.lmodel_access import LModelAccess
+    return LModelAccess(app_name, app_dns, Secrets.OPENROUTER_API_KEY.value).build_scheduler(
+        failover=SCHEDULER_FAILOVER,
+        max_concurrency=SCHEDULER_MAX_CONCURRENCY,
+        max_retries=SCHEDULER_MAX_RETRIES,
+        on_result=get_model_router().record)
+
+@st.cache_resource
+def get_response_cache():
+    """
+    Process-wide response cache, or None unless enabled with the RESPONSE_CACHE environment variable.
+    """
+    from llm.tools.response_cache import ResponseCache, MemoryResponseBackend, SQLiteResponseBackend
+    if RESPONSE_CACHE == "memory":
+        backend = MemoryResponseBackend(max_entries=RESPONSE_CACHE_ENTRIES)
+    elif RESPONSE_CACHE == "sqlite":
+        backend = SQLiteResponseBackend(RESPONSE_CACHE_PATH, max_entries=RESPONSE_CACHE_ENTRIES)
+    else:
+        return None
+    log.info(f"Response cache enabled: {RESPONSE_CACHE}")
+    return ResponseCache(backend, ttl=RESPONSE_CACHE_TTL)
+
+@st.cache_resource
+def get_upload_preparer():
+    """
+    Process-wide worker pool preparing uploads in the background.
+    """
+    from llm.tools.upload_prep import UploadPreparer
+    return UploadPreparer(max_workers=UPLOAD_PREP_WORKERS)
+
+@st.cache_resource
+def get_pipeline_metrics():
+    """
+    Process-wide pipeline metrics, exported to PIPELINE_METRICS_PATH and/or served on PIPELINE_METRICS_PORT.
+    """
+    from llm.tools.pipeline_metrics import PipelineMetrics
+    metrics = PipelineMetrics(prometheus_path=PIPELINE_METRICS_PATH)
+    if PIPELINE_METRICS_PORT:
+        metrics.serve(int(PIPELINE_METRICS_PORT))
+    return metrics
+
+@st.cache_resource
+def get_model_access():
+    """
+    Process-wide model access, routing requests through the shared scheduler and response cache.
+    """
+    from llm.tools.lmodel_access import LModelAccess
+    return LModelAccess(app_name, app_dns, Secrets.OPENROUTER_API_KEY.value,
+                        scheduler=get_request_scheduler(), response_cache=get_response_cache())
+
+@st.cache_resource
+def get_vqa_pipeline():
+    """
+    Process-wide upload-to-answer pipeline.
+    """
+    from llm.tools.token_budget import ImageBudgeter
+    from llm.tools.vqa_pipeline import VQAPipeline
+    image_budgeter = ImageBudgeter(max_image_tokens=IMAGE_TOKEN_BUDGET, max_bytes=IMAGE_BYTE_BUDGET)
+    return VQAPipeline(get_image_tools(), image_budgeter, max_sheets=PDF_MAX_SHEETS, min_page_side=PDF_MIN_PAGE_SIDE,
+                       max_frames=GIF_MAX_FRAMES, frame_sampling=GIF_FRAME_SAMPLING, frame_layout=GIF_FRAME_LAYOUT)
+
+def load_services():
+    """
+    Import and bind the modules and objects the chat UI works with. Called only once the user is signed in,
+    so the login screen does not pay for them; all are process-wide singletons, so reruns only look them up.
+    """
+    global lma, image_tools, vqa_pipeline, model_fanout, model_router, upload_preparer, pipeline_metrics, models, \
+        default_index, ImageBudgeter, MapReduceQA, Conversation, add_stage, annotate, PDF_MIME_TYPE, PPTX_MIME_TYPE, \
+        streamlit_js_eval
+    from streamlit_js_eval import streamlit_js_eval
+    from llm.tools.conversation import Conversation
+    from llm.tools.document_qa import MapReduceQA
+    from llm.tools.model_fanout import ModelFanout
+    from llm.tools.pipeline_metrics import add_stage, annotate
+    from llm.tools.token_budget import ImageBudgeter
+    from llm.tools.vqa_pipeline import PDF_MIME_TYPE, PPTX_MIME_TYPE
+    lma = get_model_access()
+    image_tools = get_image_tools()
+    vqa_pipeline = get_vqa_pipeline()
+    model_fanout = ModelFanout()
+    model_router = get_model_router()
+    upload_preparer = get_upload_preparer()
+    pipeline_metrics = get_pipeline_metrics()
+    models = lma.get_all_models()
+    default_index = models.index(lma.get_model_by_id(init_model))
 
 # supported file types
 ENABLED_FILES_TYPES = ["jpeg", "jpg", "png", "gif", "pdf", "pptx", "ppt"]
-PDF_MIME_TYPE = "application/pdf"
-PPTX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
 sb_initial_state = "expanded"
 
 avatar_lkp = ({
@@ -62,15 +229,40 @@ def app_setup():
 
 def init_sidebar():
     with st.sidebar.expander(":blue[Chat Settings]", expanded=True):
+        routing = st.radio("Model routing:", options=list(ROUTING_POLICIES), index=0, horizontal=True,
+                           key="routing_policy",
+                           help="Let each upload pick its model: by estimated cost, by latency observed over recent "
+                                "requests, or the best quality within a budget per question")
+        if ROUTING_POLICIES[routing] == "quality":
+            st.number_input("Budget per question (USD):", min_value=0.0, value=ROUTE_BUDGET_USD, step=0.01,
+                            format="%.3f", key="route_budget")
         selected_model = st.selectbox("Model:", 
                                       models, key="active_model", 
-                                      help="Choose an Open Source Model", 
+                                      help="Choose an Open Source Model" if routing == "Manual" else
+                                           "Used when routing is Manual",
                                       on_change=model_change,
-                                      index=default_index
+                                      index=default_index,
+                                      disabled=routing != "Manual"
                                       )
-        st.write(f"Active Model:  ***{selected_model}***")
+        if routing == "Manual":
+            st.write(f"Active Model:  ***{selected_model}***")
+        else:
+            st.write("Active Model:  ***chosen per upload***")
         st.session_state.llm = lma.get_llm(selected_model, temperature=0.0)
 
+        compare_mode = st.toggle("Compare models", key="compare_mode",
+                                 help="Send the same image and prompt to several models at once")
+        if compare_mode:
+            st.multiselect("Models to compare:", models, key="compare_models",
+                           default=models, help="Responses are shown side by side as they complete")
+
+        document_mode = st.radio("PDF mode:", options=["Merged image", "Text + figures", "Page by page"], index=0,
+                                 horizontal=True, key="document_mode",
+                                 help="Text + figures sends pages with a text layer as text and only figures as images. "
+                                      "Page by page asks each page group separately and combines the answers with page citations")
+        if document_mode == "Page by page":
+            st.number_input("Pages per request:", min_value=1, max_value=8, value=1, key="pages_per_request")
+
         st.radio("Avatar:", 
             options=["Male", "Female", "Hacker"], 
             index=0, 
@@ -97,25 +289,235 @@ def model_change():
     # Reinitialize llm with chosen model
     st.session_state.llm = lma.get_llm(st.session_state.active_model, temperature=0.0) 
 
+def route_upload(uploaded_file, page_mode, text_tokens):
+    """
+    Choose the model for an upload with the session's routing policy. The decision is kept for the upload
+    and its settings, so follow-up questions go to the same model and the preparation is not restarted
+    as the router's statistics change.
+    Args:
+        uploaded_file (UploadedFile): The uploaded file.
+        page_mode (bool): The PDF is asked page by page.
+        text_tokens (int): Conversation text tokens sent with each question.
+    Returns:
+        dict: The routing decision (see ModelRouter.route), or None when routing is Manual.
+    """
+    policy = ROUTING_POLICIES[st.session_state.get("routing_policy", "Manual")]
+    if policy is None:
+        return None
+    budget = st.session_state.get("route_budget", ROUTE_BUDGET_USD) if policy == "quality" else None
+    pages_per_request = st.session_state.get("pages_per_request", 1) if page_mode else 1
+    file_id = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+    key = (file_id, page_mode, pages_per_request, policy, budget)
+    decision = st.session_state.get("route_decision")
+    if decision is None or decision["key"] != key:
+        try:
+            request = vqa_pipeline.describe(uploaded_file.getvalue(), uploaded_file.type, page_mode, pages_per_request)
+        except Exception as err:
+            # the preparation reports the unreadable file; the selected model is used meanwhile
+            log.warning(f"{type(err)}: Could not describe the upload for routing: {err}")
+            return None
+        decision = dict(model_router.route(request, policy, budget, text_tokens=text_tokens), key=key, request=request)
+        st.session_state.route_decision = decision
+    return decision
+
+def show_route_decision(decision):
+    """
+    Show the routing decision and the estimate of every candidate model in the sidebar.
+    """
+    with st.sidebar.expander(":blue[Routing]", expanded=True):
+        st.markdown(f"Routed to ***{decision['model']}***: {decision['reason']}")
+        request = decision["request"]
+        st.caption(f"{request['pages']} page(s), {request['images']} image(s) per request, "
+                   f"{request['requests']} request(s)")
+        for entry in decision["estimates"]:
+            if entry["eligible"]:
+                source = "observed" if entry["observed"] else "catalog"
+                st.caption(f"{entry['model']}: ≈ ${entry['cost_usd']:.4f} · ≈ {entry['latency_s']:.1f}s ({source}) · "
+                           f"errors {entry['error_rate']:.0%}")
+            else:
+                st.caption(f"{entry['model']}: ruled out, {entry['reason']}")
+
 def get_session_id():
     session_id = get_script_run_ctx().session_id
     return session_id
 
-def get_response(llm, img_byte_data, user_prompt, mime_type, session_id):             
+def get_response(llm, prepared, user_prompt, session_id, messages=None):             
     """
-    Generate response from the VLM using the base64 encoded image, user prompt, mime type and session ID.
+    Generate response from the VLM using the prepared (base64 encoded) image, user prompt and session ID.
     Args:
         llm (ChatOpenAI): The LLM instance.
-        encoded_image (str): Base64 encoded image data.
+        prepared (dict): The prepared upload (see VQAPipeline.prepare).
         user_prompt (str): The user's input prompt.
         session_id (str): The session ID for tracking.
+        messages (list): The conversation messages for this turn. Default is None (single-turn prompt).
     Returns:
         str: The generated response from the LLM.
     """
-    prompt = PromptUtils.get_zshot_prompt(img_byte_data, user_prompt, mime_type)
-    #chain = prompt | llm
-    messages = llm.invoke([prompt])
-    return messages.content
+    return vqa_pipeline.invoke(llm, prepared, user_prompt, messages)
+
+def stream_response(llm, prepared, user_prompt, session_id, latency, messages=None):
+    """
+    Stream the response from the VLM chunk by chunk, so the UI can render tokens as they arrive.
+    Args:
+        llm (ChatOpenAI): The LLM instance.
+        prepared (dict): The prepared upload (see VQAPipeline.prepare).
+        user_prompt (str): The user's input prompt.
+        session_id (str): The session ID for tracking.
+        latency (dict): Populated with 'ttft' (time to first token) and 'total' seconds.
+        messages (list): The conversation messages for this turn. Default is None (single-turn prompt).
+    Yields:
+        str: Response text chunks.
+    """
+    yield from vqa_pipeline.stream(llm, prepared, user_prompt, latency, messages)
+    log.info(f"Session {session_id}: time-to-first-token {latency.get('ttft', latency['total']):.2f}s, "
+             f"total {latency['total']:.2f}s")
+
+def compare_responses(model_names, prepared, user_prompt, session_id, messages=None):
+    """
+    Send one prepared prompt to several models concurrently and render each response side by side as it completes.
+    Args:
+        model_names (list): The models to compare.
+        prepared (dict): The prepared upload, fitted to the limits shared by all models.
+        user_prompt (str): The user's input prompt.
+        session_id (str): The session ID for tracking.
+        messages (list): The conversation messages for this turn. Default is None (single-turn prompt).
+    Returns:
+        str: Markdown of all responses, for the chat history.
+    """
+    image_tokens = {name: sum(ImageBudgeter.estimate_image_tokens(*image["budget_report"]["size"], lma.get_model_limits(name))
+                              for image in prepared["images"])
+                    for name in model_names}
+    # encode once: the same messages are sent to every model
+    messages = messages or [vqa_pipeline.get_prompt(prepared, user_prompt)]
+    llms = {name: lma.get_llm(name, temperature=0.0) for name in model_names}
+
+    placeholders = {}
+    for name, column in zip(model_names, st.columns(len(model_names))):
+        with column:
+            st.markdown(f"**{name}**")
+            placeholders[name] = st.empty()
+            placeholders[name].caption("Waiting for response...")
+
+    sections = {}
+    start = time.perf_counter()
+    totals = {"input_tokens": 0, "output_tokens": 0}
+    for result in model_fanout.run(llms, messages):
+        name = result["model"]
+        usage = result["usage"]
+        for direction in totals:
+            totals[direction] += usage.get(direction) or 0
+        stats = (f"{result['latency']:.2f}s · image ≈ {image_tokens[name]} tokens · "
+                 f"in/out {usage.get('input_tokens', '?')}/{usage.get('output_tokens', '?')} tokens")
+        with placeholders[name].container():
+            if result["error"] is None:
+                st.markdown(result["content"])
+                st.caption(stats)
+                sections[name] = f"**{name}** ({stats})\n\n{result['content']}"
+            else:
+                st.error(f"{type(result['error']).__name__}: {result['error']}")
+                st.caption(f"Failed after {result['latency']:.2f}s")
+                sections[name] = f"**{name}** failed after {result['latency']:.2f}s: {type(result['error']).__name__}"
+    add_stage("model", time.perf_counter() - start)
+    annotate(models=model_names, usage=totals)
+    log.info(f"Session {session_id}: compared {len(model_names)} models")
+    return "\n\n---\n\n".join(sections[name] for name in model_names)
+
+def document_response(llm, page_images, total_pages, user_prompt, mime_type, session_id):
+    """
+    Answer a question about a PDF page by page (map) and combine the page answers with citations (reduce).
+    Args:
+        llm (ChatOpenAI): The LLM instance.
+        page_images (list): (first_page, last_page, image bytes, image tokens) per page group, fitted to the model limits.
+        total_pages (int): Number of pages in the PDF.
+        user_prompt (str): The user's input prompt.
+        mime_type (str): The page image mime type.
+        session_id (str): The session ID for tracking.
+    Returns:
+        str: The combined response.
+    """
+    qa = MapReduceQA(llm, max_concurrency=PAGE_QA_CONCURRENCY)
+    start = time.perf_counter()
+    progress = st.progress(0.0, text=f"Reading {total_pages} pages...")
+    results = []
+    for result in qa.map_pages(page_images, user_prompt, total_pages, mime_type):
+        results.append(result)
+        progress.progress(len(results) / len(page_images), text=f"Read {len(results)} of {len(page_images)} page groups")
+    progress.empty()
+    log.info(f"Session {session_id}: map step over {len(page_images)} page groups took {time.perf_counter() - start:.2f}s")
+    response = st.write_stream(qa.stream_reduce(user_prompt, results))
+    add_stage("model", time.perf_counter() - start)
+    annotate(page_groups=len(page_images))
+    return response
+
+def prepare_upload(job, trace, byte_data, mime_type, page_mode, pages_per_request, limits, api_key=None, hybrid=False):
+    """
+    Convert an upload to images, fit them to the model limits and base64 encode them. Runs on the upload
+    preparer's worker pool as soon as the file lands, so it must not call Streamlit UI elements.
+    Args:
+        job (PreparationJob): Handle of this preparation, checked for cancellation between stages.
+        trace (RequestTrace): Trace receiving the stage timings of this preparation.
+        byte_data (bytes): Uploaded file data.
+        mime_type (str): Uploaded file mime type.
+        page_mode (bool): Prepare a PDF page by page instead of as one merged image.
+        pages_per_request (int): Pages per image in page mode.
+        limits (dict): Model limits the images are fitted to.
+        api_key (str): Cloudmersive API key, for PPTX conversion.
+        hybrid (bool): Send the text layer of text-heavy PDF pages as text and only figures as images.
+    Returns:
+        dict: The prepared upload (see VQAPipeline.prepare) plus its trace_id and the near-duplicate pages dropped.
+    """
+    try:
+        with trace.activate():
+            prepared = vqa_pipeline.prepare(byte_data, mime_type, limits, page_mode, pages_per_request, api_key,
+                                            check_cancelled=job.check_cancelled, hybrid=hybrid)
+        if mime_type in (PDF_MIME_TYPE, PPTX_MIME_TYPE):
+            log.info(f"Conversion cache stats: {image_tools.cache.stats()}")
+        if mime_type == PPTX_MIME_TYPE:
+            log.info(f"Conversion queue stats: {image_tools.converter.stats()}")
+    except Exception as err:
+        trace.finish(err)
+        raise
+    prepared["trace_id"] = trace.trace_id
+    prepared["duplicate_pages"] = trace.fields.get("duplicate_pages", [])
+    trace.annotate(payload_bytes=prepared["payload_bytes"])
+    trace.finish()
+    return prepared
+
+def start_upload_preparation(uploaded_file, page_mode, limits):
+    """
+    Start (or keep) the session's background preparation of the uploaded file. A preparation for a replaced
+    file, or for other settings, is cancelled and a new one started.
+    Args:
+        uploaded_file (UploadedFile): The uploaded file, or None when the uploader is empty.
+        page_mode (bool): Prepare a PDF page by page.
+        limits (dict): Model limits the images are fitted to.
+    Returns:
+        PreparationJob: The session's preparation, or None without an upload.
+    """
+    job = st.session_state.get("upload_job")
+    if uploaded_file is None:
+        key = None
+    else:
+        file_id = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+        pages_per_request = st.session_state.get("pages_per_request", 1) if page_mode else None
+        hybrid = uploaded_file.type == PDF_MIME_TYPE and st.session_state.get("document_mode") == "Text + figures"
+        key = (file_id, uploaded_file.type, page_mode, pages_per_request, tuple(sorted(limits.items())), hybrid)
+    if job is not None and job.key == key:
+        return job
+    if job is not None:
+        log.info(f"Cancelling stale upload preparation (running: {not job.cancel() and not job.done()})")
+        del st.session_state["upload_job"]
+    if key is None:
+        return None
+    api_key = Secrets.CLOUDMERSIVE_API_KEY.value if uploaded_file.type == PPTX_MIME_TYPE else None
+    byte_data = uploaded_file.getvalue()
+    trace = pipeline_metrics.trace("prepare", session_id=get_session_id(), mime_type=uploaded_file.type,
+                                   upload_bytes=len(byte_data), page_mode=page_mode, hybrid=key[5])
+    job = upload_preparer.submit(key, prepare_upload, trace, byte_data, uploaded_file.type,
+                                 page_mode, key[3], limits, api_key, key[5])
+    st.session_state.upload_job = job
+    log.debug(f"Started background preparation of {uploaded_file.name}")
+    return job
 
 def get_user_info(id_token):
     """
@@ -141,12 +543,18 @@ REVOKE_URL = "https://oauth2.googleapis.com/revoke"
 REDIRECT_URI = app_dns
 SCOPE = "openid email profile"
 
-oauth2 = OAuth2Component(Secrets.OAUTH_CLIENT_ID.value, 
-                         Secrets.OAUTH_CLIENT_SECRET.value, 
-                         AUTHORIZATION_URL, 
-                         TOKEN_URL, 
-                         TOKEN_URL, 
-                         REVOKE_URL)
+@st.cache_resource
+def get_oauth2():
+    """
+    Google OAuth2 component, only needed on the login screen.
+    """
+    from streamlit_oauth import OAuth2Component   # imported on first use: signed-in reruns never need it
+    return OAuth2Component(Secrets.OAUTH_CLIENT_ID.value, 
+                           Secrets.OAUTH_CLIENT_SECRET.value, 
+                           AUTHORIZATION_URL, 
+                           TOKEN_URL, 
+                           TOKEN_URL, 
+                           REVOKE_URL)
 
 # ------------------------
 # 
@@ -157,7 +565,7 @@ def main():
     bot_avator = "images/chat-bot.png"
     
     if 'token' not in st.session_state:
-        result = oauth2.authorize_button("Continue with Google", 
+        result = get_oauth2().authorize_button("Continue with Google", 
                                          REDIRECT_URI, SCOPE, 
                                          icon="data:image/svg+xml;charset=utf-8,%3Csvg xmlns='http://www.w3.org/2000/svg' xmlns:xlink='http://www.w3.org/1999/xlink' viewBox='0 0 48 48'%3E%3Cdefs%3E%3Cpath id='a' d='M44.5 20H24v8.5h11.8C34.7 33.9 30.1 37 24 37c-7.2 0-13-5.8-13-13s5.8-13 13-13c3.1 0 5.9 1.1 8.1 2.9l6.4-6.4C34.6 4.1 29.6 2 24 2 11.8 2 2 11.8 2 24s9.8 22 22 22c11 0 21-8 21-22 0-1.3-.2-2.7-.5-4z'/%3E%3C/defs%3E%3CclipPath id='b'%3E%3Cuse xlink:href='%23a' overflow='visible'/%3E%3C/clipPath%3E%3Cpath clip-path='url(%23b)' fill='%23FBBC05' d='M0 37V11l17 13z'/%3E%3Cpath clip-path='url(%23b)' fill='%23EA4335' d='M0 11l17 13 7-6.1L48 14V0H0z'/%3E%3Cpath clip-path='url(%23b)' fill='%2334A853' d='M0 37l30-23 7.9 1L48 0v48H0z'/%3E%3Cpath clip-path='url(%23b)' fill='%234285F4' d='M48 48L17 24l-4-3 35-10z'/%3E%3C/svg%3E"
                                          )
@@ -172,6 +580,7 @@ def main():
         log.info(f"User {st.session_state.auth_email} is already authenticated with Google OAuth2")
         session_id = get_session_id()
         log.info(f"Created Session ID: {session_id}")
+        load_services()
         app_setup()
         viewport_height = streamlit_js_eval(js_expressions='window.parent.innerHeight', key='HEIGHT', want_output=True)
         viewport_width = streamlit_js_eval(js_expressions='window.parent.innerWidth', key='WIDTH', want_output=True)
@@ -190,6 +599,11 @@ def main():
     
         if "messages" not in st.session_state:
             st.session_state.messages = []
+        if "conversation" not in st.session_state:
+            # context sent to the model: bounded, unlike the displayed history
+            st.session_state.conversation = Conversation(history_tokens=CONVERSATION_HISTORY_TOKENS,
+                                                         summary_tokens=CONVERSATION_SUMMARY_TOKENS)
+        conversation = st.session_state.conversation
         warning_placeholder = st.empty() # container for dynamic warnings
         
         if "active_model" in st.session_state:
@@ -210,33 +624,37 @@ def main():
 
             # Display file uploader and chat input
             st.markdown(css, unsafe_allow_html=True) 
-            if ((uploaded_file := st.file_uploader("Choose a file", type=ENABLED_FILES_TYPES)) and 
-                (prompt := st.chat_input("Describe this image"))):
-        
-                # Read file as bytes:
+            uploaded_file = st.file_uploader("Choose a file", type=ENABLED_FILES_TYPES)
+            page_mode, compare_models, limits, decision = False, [], None, None
+            model_name, llm = st.session_state.active_model, st.session_state.llm
+            if uploaded_file:
                 mime_type = uploaded_file.type
                 log.debug(f"Uploaded file mime_type: {mime_type}")
-                if mime_type == PDF_MIME_TYPE:
-                    log.debug("PDF document requires conversion to image")
-                    byte_data = image_tools.pdf_to_jpeg(uploaded_file.getvalue())
-                    mime_type = "image/jpeg"  # Reset: JPEG image
-                elif mime_type == PPTX_MIME_TYPE:
-                    log.debug("PPTX document requires conversion to image. Checking file size...")
-                    file_size = uploaded_file.size
-                    if file_size > 3 * 1024 * 1024:
-                        log.error("PPTX file size is larger than the 3MB limit.")
-                        with warning_placeholder:
-                            st.warning("""
-                                The uploaded Presentation is larger than the 3MB limit imposed by the API for converting to images!\n
-                                Please remove it and then upload a smaller presentation size or convert it to PDF first.
-                            """, icon="⚠️", width=warning_message_px)
-                        return
-                    byte_data = image_tools.pptx_to_jpeg(Secrets.CLOUDMERSIVE_API_KEY.value, uploaded_file.getvalue())
-                    mime_type = "image/jpeg"  # Reset: JPEG image
+                page_mode = mime_type == PDF_MIME_TYPE and st.session_state.get("document_mode") == "Page by page"
+                # Fit the image to the active model's limits (or those shared by all compared models) and budgets
+                compare_models = st.session_state.get("compare_models", []) if st.session_state.get("compare_mode") else []
+                if len(compare_models) > 1 and not page_mode:
+                    limits = lma.get_shared_limits(compare_models)
                 else:
-                    byte_data = uploaded_file.getvalue()
-                    #encoded_image = base64.b64encode(byte_data).decode('utf-8')
-            
+                    history = sum(turn["tokens"] for turn in conversation.turns)
+                    decision = route_upload(uploaded_file, page_mode, min(history, CONVERSATION_HISTORY_TOKENS))
+                    if decision is not None:
+                        model_name = decision["model"]
+                        llm = lma.get_llm(model_name, temperature=0.0)
+                        show_route_decision(decision)
+                    limits = lma.get_model_limits(model_name)
+                if mime_type == PPTX_MIME_TYPE and not image_tools.converter.accepts(uploaded_file.size,
+                                                                                     Secrets.CLOUDMERSIVE_API_KEY.value):
+                    log.error(f"No PPTX converter accepts a {uploaded_file.size} byte file (converters: {PPTX_CONVERTERS})")
+                    with warning_placeholder:
+                        st.warning("""
+                            The uploaded Presentation is larger than the configured converters accept (3MB for the Cloudmersive API)!\n
+                            Please remove it and then upload a smaller presentation size or convert it to PDF first.
+                        """, icon="⚠️", width=warning_message_px)
+                    uploaded_file = None
+            # Conversion starts as soon as the file lands, while the prompt is being typed
+            upload_job = start_upload_preparation(uploaded_file, page_mode, limits)
+            if upload_job is not None and (prompt := st.chat_input("Describe this image")):
                 # Add to chat history
                 st.session_state.messages.append({"role": "user", "content": prompt})
             
@@ -244,23 +662,67 @@ def main():
                     with st.chat_message("user", avatar=st.session_state.user_avator):
                         st.markdown(prompt)
 
+                    mode = "pages" if page_mode else "compare" if len(compare_models) > 1 else "single"
+                    trace = pipeline_metrics.trace("request", session_id=session_id, mode=mode, model=model_name)
+                    prepared = None
                     try:
-                        # Get llm response
-                        response = get_response(st.session_state.llm, byte_data, 
-                                                prompt, mime_type, session_id)
+                        prepared, waited = upload_preparer.collect(upload_job)
+                        log.info(f"Session {session_id}: waited {waited:.2f}s for upload preparation "
+                                 f"(preparer stats: {upload_preparer.stats()})")
+                        mime_type = prepared["mime_type"]
+                        trace.annotate(prepare_trace_id=prepared["trace_id"], prepare_wait_s=round(waited, 6),
+                                       payload_bytes=prepared["payload_bytes"])
+                        latency = {}
+                        with trace.activate(), st.chat_message("assistant", avatar=bot_avator):
+                            if decision is not None and mode != "compare":
+                                st.caption(f"Routed to {model_name}: {decision['reason']}")
+                                annotate(route_policy=decision["policy"], route_reason=decision["reason"])
+                            if prepared.get("duplicate_pages"):
+                                st.caption("Skipped near-duplicate pages: " + ", ".join(
+                                    f"p. {entry['page']} (same as p. {entry['kept_as']})"
+                                    for entry in prepared["duplicate_pages"]))
+                            # follow-ups about the same file carry earlier turns; the image is sent once per request
+                            document_id = upload_job.key[0]
+                            if page_mode:
+                                conversation.use_document(document_id)
+                                response = document_response(llm, prepared["page_images"],
+                                                             prepared["total_pages"], prompt, mime_type, session_id)
+                            else:
+                                messages = conversation.messages(prepared, prompt, document_id)
+                                if len(compare_models) > 1:
+                                    response = compare_responses(compare_models, prepared, prompt, session_id, messages)
+                                else:
+                                    # Stream llm response into the chat as it arrives
+                                    response = st.write_stream(stream_response(llm, prepared, prompt,
+                                                                               session_id, latency, messages))
+                        log.info(f"Request scheduler stats: {lma.scheduler.stats()}")
+                        log.info(f"Model router stats: {model_router.stats()}")
+                        log.info(f"LLM client pool stats: {lma.client_pool.stats()}")
+                        if lma.response_cache is not None:
+                            log.info(f"Response cache stats: {lma.response_cache.stats()}")
+                        trace.finish()
                         # Add to chat history
                         st.session_state.messages.append({"role": "assistant", "content": response})
-                        with st.chat_message("assistant", avatar=bot_avator):
-                            st.markdown(response)
+                        # page mode sends no history, and a comparison is several answers rather than one turn
+                        if mode == "single":
+                            conversation.record(prompt, response)
                     except Exception as err:
-                        log.error(f"{type(err)}: Error generating LLM response: {err}")
-                        if type(err).__name__ == "RateLimitError":
+                        trace.finish(err)
+                        if prepared is None:
+                            # a failed preparation is kept while the upload is unchanged: drop it, so the
+                            # next prompt prepares the file again
+                            log.error(f"{type(err)}: Error preparing the upload: {err}")
+                            del st.session_state["upload_job"]
+                            st.exception(f"Failed to prepare the uploaded file! Exception: {err}")
+                        elif type(err).__name__ == "RateLimitError":
+                            log.error(f"{type(err)}: Error generating LLM response: {err}")
                             st.exception(f"""
-                               << Rate Limits >> have been exceeded on OpenRouter model endpoint: {st.session_state.active_model}
+                               << Rate Limits >> have been exceeded on OpenRouter model endpoint: {model_name}
                                 Sorry for the inconvenience! Please try again later. 
                                 Exception: {err}
                             """)
                         else:
+                            log.error(f"{type(err)}: Error generating LLM response: {err}")
                             st.exception(f"Failed to generate LLM response! Exception: {err}")
                       
 # end main()
@@ -0,0 +1,35 @@
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_openai_server import MockOpenAIServer
+from llm.tools.lmodel_access import LModelAccess
+
+
+@pytest.fixture
+def mock_server():
+    """
+    Factory for local mock OpenRouter endpoints (see MockOpenAIServer); all are stopped after the test.
+    """
+    servers = []
+
+    def start(**options):
+        server = MockOpenAIServer(**options).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def model_access():
+    """
+    Factory for an LModelAccess pointed at a mock server.
+    """
+    def create(server, **options):
+        return LModelAccess("tests", "http://localhost/", "mock-key", api_base_url=server.base_url, **options)
+
+    return create
@@ -0,0 +1,103 @@
+import asyncio, time
+import pytest
+from llm.tools.request_scheduler import RequestScheduler, ScheduledLLM, TokenBucket
+
+MODEL = "google/gemini-3-pro-preview"
+PROMPT = ["Describe this image"]
+
+
+def build_scheduler(lma, **options):
+    options = {"max_retries": 1, "backoff_base": 0.01, **options}
+    return lma.build_scheduler(**options)
+
+
+def test_token_bucket_spaces_requests_beyond_capacity():
+    async def acquire_all():
+        bucket = TokenBucket(rate=20, capacity=1)
+        start = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    # the first token is available at once, the next two refill at 20 per second
+    assert asyncio.run(acquire_all()) >= 0.09
+
+
+def test_retries_rate_limited_request(mock_server, model_access):
+    server = mock_server(fail_first=1)
+    scheduler = build_scheduler(model_access(server), failover=False)
+    response = ScheduledLLM(scheduler, MODEL).invoke(PROMPT)
+
+    assert response.content.startswith("word0")
+    assert server.stats()["requests"] == 2
+    stats = scheduler.stats()
+    assert (stats["retries"], stats["failovers"], stats["completed"], stats["failed"]) == (1, 0, 1, 0)
+    assert (stats["queued"], stats["in_flight"]) == (0, 0)
+
+
+def test_honours_retry_after(mock_server, model_access):
+    server = mock_server(fail_first=1, retry_after=0.3)
+    scheduler = build_scheduler(model_access(server), failover=False)
+    start = time.monotonic()
+    ScheduledLLM(scheduler, MODEL).invoke(PROMPT)
+
+    assert time.monotonic() - start >= 0.3
+    assert server.stats()["requests"] == 2
+
+
+def test_fails_over_once_retries_are_exhausted(mock_server, model_access):
+    server = mock_server(fail_first=2)
+    lma = model_access(server)
+    outcomes = []
+    scheduler = build_scheduler(lma, on_result=lambda model, seconds, error: outcomes.append((model, error is None)))
+    response = ScheduledLLM(scheduler, MODEL).invoke(PROMPT)
+
+    fallback = lma.get_fallback_models(MODEL)[0]
+    assert response.response_metadata["model_name"] == fallback
+    assert outcomes == [(MODEL, False), (MODEL, False), (fallback, True)]
+    stats = scheduler.stats()
+    assert (stats["retries"], stats["failovers"], stats["completed"]) == (1, 1, 1)
+
+
+def test_raises_after_retries_without_failover(mock_server, model_access):
+    server = mock_server(fail_first=10)
+    scheduler = build_scheduler(model_access(server), failover=False)
+
+    with pytest.raises(Exception) as info:
+        ScheduledLLM(scheduler, MODEL).invoke(PROMPT)
+    assert RequestScheduler.is_retryable(info.value)
+    assert server.stats()["requests"] == 2
+    assert scheduler.stats()["failed"] == 1
+
+
+def test_does_not_retry_client_errors(mock_server, model_access):
+    server = mock_server(fail_first=1, error_status=400)
+    scheduler = build_scheduler(model_access(server))
+
+    with pytest.raises(Exception) as info:
+        ScheduledLLM(scheduler, MODEL).invoke(PROMPT)
+    assert not RequestScheduler.is_retryable(info.value)
+    assert server.stats()["requests"] == 1
+    assert scheduler.stats()["failovers"] == 0
+
+
+def test_retries_stream_before_first_chunk(mock_server, model_access):
+    server = mock_server(fail_first=1, chunks=4)
+    scheduler = build_scheduler(model_access(server), failover=False)
+    text = "".join(chunk.content for chunk in ScheduledLLM(scheduler, MODEL).stream(PROMPT))
+
+    assert text == "word0 word1 word2 word3 "
+    assert server.stats()["requests"] == 2
+    assert scheduler.stats()["retries"] == 1
+
+
+def test_ainvoke_from_another_event_loop(mock_server, model_access):
+    server = mock_server(latency=0.1)
+    scheduler = build_scheduler(model_access(server), max_concurrency=2)
+    llm = ScheduledLLM(scheduler, MODEL)
+
+    async def ask_all():
+        return await asyncio.gather(*(llm.ainvoke(PROMPT) for _ in range(4)))
+
+    assert len(asyncio.run(ask_all())) == 4
+    assert server.stats()["max_in_flight"] <= 2
@@ -0,0 +1,110 @@
+import asyncio, threading
+import pytest
+from llm.tools.response_cache import CachedLLM, ResponseCache
+
+MODEL = "google/gemini-3-pro-preview"
+PROMPT = ["Describe this image"]
+
+
+def ask_concurrently(llm, sessions, call="invoke"):
+    barrier = threading.Barrier(sessions)
+    results = [None] * sessions
+
+    def session(index):
+        barrier.wait()   # identical requests land at once
+        try:
+            results[index] = getattr(llm, call)(PROMPT)
+        except Exception as err:
+            results[index] = err
+
+    threads = [threading.Thread(target=session, args=(index,)) for index in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_single_flight_invoke(mock_server, model_access):
+    server = mock_server(latency=0.3)
+    cache = ResponseCache()
+    llm = CachedLLM(model_access(server).create_llm(MODEL, max_retries=0), cache, MODEL)
+    results = ask_concurrently(llm, 4)
+
+    assert server.stats()["requests"] == 1
+    assert len({result.content for result in results}) == 1
+    stats = cache.stats()
+    assert (stats["misses"], stats["deduplicated"], stats["stores"], stats["in_flight"]) == (1, 3, 1, 0)
+
+    # later identical requests are answered from the cache
+    assert llm.invoke(PROMPT).response_metadata["cache_hit"]
+    assert server.stats()["requests"] == 1
+
+
+def test_single_flight_failure_is_shared_and_not_cached(mock_server, model_access):
+    server = mock_server(latency=0.3, fail_first=1, error_status=400)
+    cache = ResponseCache()
+    llm = CachedLLM(model_access(server).create_llm(MODEL, max_retries=0), cache, MODEL)
+    results = ask_concurrently(llm, 3)
+
+    assert all(isinstance(result, Exception) for result in results)
+    assert server.stats()["requests"] == 1
+    assert cache.stats()["entries"] == 0
+    # the next request is sent again
+    assert llm.invoke(PROMPT).content.startswith("word0")
+    assert server.stats()["requests"] == 2
+
+
+def test_stream_is_cached_once_complete(mock_server, model_access):
+    server = mock_server(chunks=4)
+    cache = ResponseCache()
+    llm = CachedLLM(model_access(server).create_llm(MODEL, max_retries=0), cache, MODEL)
+
+    assert "".join(chunk.content for chunk in llm.stream(PROMPT)) == "word0 word1 word2 word3 "
+    cached = list(llm.stream(PROMPT))
+    assert len(cached) == 1 and cached[0].response_metadata["cache_hit"]
+    assert server.stats()["requests"] == 1
+
+
+def test_abandoned_stream_is_not_cached(mock_server, model_access):
+    server = mock_server(chunks=4)
+    cache = ResponseCache()
+    llm = CachedLLM(model_access(server).create_llm(MODEL, max_retries=0), cache, MODEL)
+    stream = llm.stream(PROMPT)
+    next(stream)
+    stream.close()
+
+    assert cache.stats()["entries"] == 0
+    assert "".join(chunk.content for chunk in llm.stream(PROMPT)) == "word0 word1 word2 word3 "
+    assert server.stats()["requests"] == 2
+
+
+def test_key_ignores_whitespace_and_keeps_images_apart():
+    image = {"type": "image", "mime_type": "image/jpeg", "data": "aGVsbG8="}
+    other = {"type": "image", "mime_type": "image/jpeg", "data": "d29ybGQ="}
+    key = ResponseCache.make_key([[{"type": "text", "text": "What is  this?\n"}, image]], MODEL, 0.0)
+
+    assert key == ResponseCache.make_key([[{"type": "text", "text": "What is this?"}, image]], MODEL, 0.0)
+    assert key != ResponseCache.make_key([[{"type": "text", "text": "What is this?"}, other]], MODEL, 0.0)
+    assert key != ResponseCache.make_key([[{"type": "text", "text": "What is this?"}, image]], MODEL, 0.5)
+
+
+def test_single_flight_ainvoke(mock_server, model_access):
+    server = mock_server(latency=0.3)
+    cache = ResponseCache()
+    llm = CachedLLM(model_access(server).create_llm(MODEL, max_retries=0), cache, MODEL)
+
+    async def ask_all():
+        return await asyncio.gather(*(llm.ainvoke(PROMPT) for _ in range(4)))
+
+    results = asyncio.run(ask_all())
+    assert server.stats()["requests"] == 1
+    assert len({result.content for result in results}) == 1
+    assert cache.stats()["deduplicated"] == 3
+    # shared with blocking callers
+    assert llm.invoke(PROMPT).response_metadata["cache_hit"]
+
+
+def test_key_keeps_case():
+    assert (ResponseCache.make_key(["Is the label 'US' or 'us'?"], MODEL, 0.0)
+            != ResponseCache.make_key(["is the label 'us' or 'us'?"], MODEL, 0.0))
@@ -0,0 +1,36 @@
+import importlib
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access. It is not registered in
+    sys.modules until then, so code scanning loaded modules (inspect, Streamlit's file watcher)
+    does not trigger the import.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'{' (loaded)' if self._module is not None else ''}>"
+
+
+def lazy_import(name):
+    """
+    Import a module on first use instead of now. Heavy dependencies (e.g. PyMuPDF) are bound at module
+    level as usual but only loaded once a code path actually uses them, which keeps them off the cold
+    start of the app and of processes that never touch them.
+
+    Args:
+        name (str): The module name.
+
+    Returns:
+        LazyModule: Proxy forwarding attribute access to the module.
+    """
+    return LazyModule(name)
@@ -0,0 +1,20 @@
+import logging
+import sys
+
+
+def get_logger(name):
+    """
+    Get a logger that works with and without Streamlit. Inside the Streamlit app, loggers come from
+    Streamlit so they follow its log level and formatting; headless (CLI, batch jobs, worker processes)
+    they are plain stdlib loggers configured by the caller.
+
+    Args:
+        name (str): The logger name, usually __name__.
+
+    Returns:
+        logging.Logger: The logger.
+    """
+    streamlit = sys.modules.get("streamlit")
+    if streamlit is not None and hasattr(streamlit, "logger"):
+        return streamlit.logger.get_logger(name)
+    return logging.getLogger(name)
@@ -1,10 +1,24 @@
+import os
+import sys
 from enum import Enum
-import streamlit as st
+
+
+def _secret(name):
+    """
+    Read a secret from Streamlit secrets when running inside the app, falling back to the environment
+    variable of the same name in upper case (e.g. OPENROUTER_API_KEY) for headless use.
+    """
+    streamlit = sys.modules.get("streamlit")
+    if streamlit is not None:
+        try:
+            return streamlit.secrets[name]
+        except Exception:
+            pass   # no secrets.toml, or the key is missing from it
+    return os.environ.get(name.upper())
 
 
 class Secrets(Enum):
-    OAUTH_CLIENT_ID = st.secrets.oauth_client_id
-    OAUTH_CLIENT_SECRET = st.secrets.oauth_client_secret
-    OPENROUTER_API_KEY = st.secrets.openrouter_api_key
-    CLOUDMERSIVE_API_KEY = st.secrets.cloudmersive_api_key
-    
\ No newline at end of file
+    OAUTH_CLIENT_ID = _secret("oauth_client_id")
+    OAUTH_CLIENT_SECRET = _secret("oauth_client_secret")
+    OPENROUTER_API_KEY = _secret("openrouter_api_key")
+    CLOUDMERSIVE_API_KEY = _secret("cloudmersive_api_key")